@@ -0,0 +1,457 @@
+# Banco de pruebas de rendimiento del bot (no es un test: no comprueba nada).
+# Ejecuta los handlers reales de bot.py contra un Interaction/Guild falsos con
+# latencia REST simulada, sobre un estado sintético de --size tickets y baneos,
+# y mide rendimiento, latencias p50/p99 y memoria máxima de cada escenario.
+#
+#   python benchmark.py                                # todos los escenarios
+#   python benchmark.py ticket_open bans_list --size 100000 --latency 0.08
+#   python benchmark.py --storage sqlite --output antes.json
+#
+# Cada escenario corre en un proceso nuevo dentro de un directorio temporal
+# (el RSS máximo y el arranque en frío no se contaminan entre escenarios) y el
+# resultado se guarda en JSON para comparar ejecuciones.
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ('ticket_open', 'bulk_ban', 'bans_list', 'persistence', 'cold_start')
+
+GUILD_ID = 900000000000000001
+CATEGORY_ID = 900000000000000002
+CHANNEL_BASE = 910000000000000000  # Canales de los tickets sintéticos
+USER_BASE = 920000000000000000  # Autores de los tickets sintéticos
+BANNED_BASE = 930000000000000000  # Usuarios baneados sintéticos
+NEW_USER_BASE = 940000000000000000  # Usuarios que abren tickets / son baneados durante la prueba
+STAFF = [f'staff{i}#000{i % 10}' for i in range(20)]
+REASONS = ['Cheats', 'Toxicidad', 'Metagaming', 'Powergaming', 'Spam en el chat', 'Insultos al staff', 'Duplicar objetos']
+
+# ==================== DISCORD FALSO ====================
+# Lo justo para que los handlers crean hablar con Discord: cada llamada REST
+# espera --latency segundos (± --jitter) y devuelve objetos mínimos.
+class FakeRest:
+    def __init__(self, latency, jitter):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+
+    async def call(self):
+        self.calls += 1
+        delay = random.gauss(self.latency, self.jitter) if self.jitter else self.latency
+        await asyncio.sleep(max(0.0, delay))
+
+class FakeMessage:
+    def __init__(self, channel, message_id):
+        self.channel = channel
+        self.id = message_id
+
+class FakeChannel:
+    def __init__(self, rest, guild, channel_id, name):
+        self.rest = rest
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        self.mention = f'<#{channel_id}>'
+
+    async def send(self, *args, **kwargs):
+        await self.rest.call()
+        return FakeMessage(self, random.getrandbits(62))
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f'user{user_id % 100000}'
+        self.mention = f'<@{user_id}>'
+        self.display_avatar = SimpleNamespace(url=f'https://cdn.example/avatars/{user_id}.png')
+
+    def __str__(self):
+        return self.name
+
+    def __hash__(self):
+        return hash(self.id)
+
+class FakeResponse:
+    def __init__(self, rest):
+        self.rest = rest
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def defer(self, *args, **kwargs):
+        await self.rest.call()
+        self._done = True
+
+    async def send_message(self, *args, **kwargs):
+        await self.rest.call()
+        self._done = True
+
+    async def edit_message(self, *args, **kwargs):
+        await self.rest.call()
+        self._done = True
+
+class FakeFollowup:
+    def __init__(self, rest):
+        self.rest = rest
+        self.messages = []
+
+    async def send(self, content=None, **kwargs):
+        await self.rest.call()
+        self.messages.append(content)
+
+class FakeInteraction:
+    def __init__(self, rest, guild, user, channel=None):
+        self.guild = guild
+        self.user = user
+        self.channel = channel
+        self.response = FakeResponse(rest)
+        self.followup = FakeFollowup(rest)
+        self.extras = {}
+        self.command = None
+
+    # create_ticket avisa de los fallos con un followup que empieza por ❌
+    @property
+    def failed(self):
+        return any(message and message.startswith('❌') for message in self.followup.messages)
+
+def make_guild(bot_module, rest):
+    import discord
+
+    class FakeCategory(discord.CategoryChannel):
+        def __init__(self, guild, channel_id):
+            self.guild = guild
+            self.id = channel_id
+            self.name = 'tickets'
+
+        async def create_text_channel(self, name, overwrites=None, **kwargs):
+            await rest.call()
+            channel = FakeChannel(rest, self.guild, next(self.guild.channel_ids), name)
+            self.guild.channels[channel.id] = channel
+            return channel
+
+    guild = SimpleNamespace(
+        id=GUILD_ID,
+        name='Benchmark RP',
+        default_role=FakeUser(GUILD_ID),
+        me=FakeUser(1),
+        channels={},
+        channel_ids=itertools.count(CHANNEL_BASE + 10**9),
+        get_role=lambda role_id: None
+    )
+    guild.get_channel = guild.channels.get
+    guild.channels[CATEGORY_ID] = FakeCategory(guild, CATEGORY_ID)
+    return guild
+
+# ==================== ESTADO SINTÉTICO ====================
+def synthetic_guild(bot_module, size):
+    data = bot_module.default_data()
+    for info in data['config']['ticket_categories'].values():
+        info['category_id'] = CATEGORY_ID
+    now = int(time.time())
+    tipos = list(data['config']['ticket_categories'])
+    rng = random.Random(size)
+    for i in range(size):
+        channel_id = CHANNEL_BASE + i
+        data['tickets'][str(channel_id)] = {
+            'user_id': USER_BASE + i,
+            'type': tipos[i % len(tipos)],
+            'number': str(i + 1).zfill(4),
+            'channel_id': channel_id,
+            'open': True,
+            'created_at': now - i * 60,
+            'messages': []
+        }
+        entry = {
+            'username': f'jugador{i}',
+            'razon': rng.choice(REASONS),
+            'duracion': 'permanente',
+            'banned_by': rng.choice(STAFF),
+            'banned_at': now - i * 30
+        }
+        if i % 4 == 0:
+            entry['duracion'] = '30d'
+            entry['expires_at'] = now + 30 * 86400 - i
+        data['banned_users'][str(BANNED_BASE + i)] = entry
+    data['config']['ticket_counter'] = size
+    return data
+
+# ==================== MEDICIÓN ====================
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * (len(ordered) - 1) + 0.5))]
+
+def summarize(latencies, wall, errors=0):
+    return {
+        'ops': len(latencies),
+        'errors': errors,
+        'wall_s': round(wall, 4),
+        'throughput_ops_s': round(len(latencies) / wall, 2) if wall else None,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        'max_ms': round(max(latencies) * 1000, 3) if latencies else None
+    }
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KB y macOS en bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+async def timed(func, *args):
+    start = time.perf_counter()
+    await func(*args)
+    return time.perf_counter() - start
+
+async def run_concurrently(factories, concurrency):
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(factory):
+        async with slots:
+            start = time.perf_counter()
+            await factory()
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one(f) for f in factories))
+    return list(latencies), time.perf_counter() - start
+
+def phase_summary(bot_module):
+    return {
+        phase: {'count': h.count, 'p50_le_ms': h.quantile(0.5) * 1000, 'p99_le_ms': h.quantile(0.99) * 1000}
+        for phase, h in sorted(bot_module.metrics.merged('bot_phase_seconds', 'phase').items())
+    }
+
+# ==================== ESCENARIOS ====================
+async def scenario_ticket_open(B, args, rest):
+    guild = make_guild(B, rest)
+    state = await B.guild_states.get(GUILD_ID)
+    interactions = [FakeInteraction(rest, guild, FakeUser(NEW_USER_BASE + i)) for i in range(args.concurrency)]
+    latencies, wall = await run_concurrently([lambda i=i: B.create_ticket(i, 'soporte') for i in interactions], args.concurrency)
+    flush = await timed(B.persistence.flush)
+    result = summarize(latencies, wall, errors=sum(i.failed for i in interactions))
+    result.update(flush_ms=round(flush * 1000, 3), open_tickets=state.index.open_count, phases=phase_summary(B))
+    return result
+
+async def scenario_bulk_ban(B, args, rest):
+    guild = make_guild(B, rest)
+    await B.guild_states.get(GUILD_ID)
+    staff = FakeUser(NEW_USER_BASE - 1)
+    factories = []
+    for i in range(args.ops):
+        interaction = FakeInteraction(rest, guild, staff)
+        usuario = FakeUser(NEW_USER_BASE + i)
+        factories.append(lambda interaction=interaction, usuario=usuario: B.ban.callback(interaction, usuario, random.choice(REASONS), random.choice(['permanente', '7d', '12h'])))
+    latencies, wall = await run_concurrently(factories, args.concurrency)
+    return summarize(latencies, wall)
+
+async def scenario_bans_list(B, args, rest):
+    state = await B.guild_states.get(GUILD_ID)
+    await state.load_bans()
+    owner = NEW_USER_BASE
+    results = {}
+
+    def measure(name, func):
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(args.ops):
+            t = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - t)
+        results[name] = summarize(latencies, time.perf_counter() - start)
+
+    # El filtro se aplica al renderizar la página
+    def staff_filter():
+        view = B.BansView(state, owner)
+        view.set_filters(staff=random.choice(STAFF))
+        view.render()
+
+    measure('first_page', lambda: B.BansView(state, owner).render())
+    measure('staff_filter', staff_filter)
+    measure('search', lambda: B.BansView(state, owner, query=random.choice(REASONS)[:5].lower()).render())
+
+    # Paginar hacia delante como lo haría el botón "Siguiente"
+    view = B.BansView(state, owner)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(min(args.ops, len(state.bans.by_time) // B.BANS_PAGE_SIZE)):
+        t = time.perf_counter()
+        view.render()
+        view.cursors.append(view.next_cursor)
+        latencies.append(time.perf_counter() - t)
+    results['paginate'] = summarize(latencies, time.perf_counter() - start)
+    return results
+
+async def scenario_persistence(B, args, rest):
+    state = await B.guild_states.get(GUILD_ID)
+    keys = list(state.data['tickets'])
+    rng = random.Random(0)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(args.ops):
+        key = rng.choice(keys)
+        t = time.perf_counter()
+        state.data['tickets'][key]['messages'].append({'author': 'bench', 'content': f'mensaje {i}'})
+        B.save_data(state, ('tickets', key))
+        latencies.append(time.perf_counter() - t)
+        if i % 100 == 99:
+            await asyncio.sleep(0)  # Dejar correr al escritor como con tráfico real
+    mark_wall = time.perf_counter() - start
+    flush = await timed(B.persistence.flush)
+    result = summarize(latencies, mark_wall)
+    result['final_flush_ms'] = round(flush * 1000, 3)
+    result['flushes'] = {
+        kind: {'count': h.count, 'p50_le_ms': h.quantile(0.5) * 1000, 'p99_le_ms': h.quantile(0.99) * 1000}
+        for kind, h in B.metrics.merged('bot_persistence_flush_seconds', 'kind').items()
+    }
+    return result
+
+async def scenario_cold_start(B, args, rest):
+    load = await timed(B.guild_states.get, GUILD_ID)
+    state = B.guild_states.peek(GUILD_ID)
+    temporary = await timed(state.temporary_bans)
+    bans_load = await timed(state.load_bans)
+    return {
+        'guild_load_ms': round(load * 1000, 3),
+        'temporary_bans_ms': round(temporary * 1000, 3),
+        'bans_load_ms': round(bans_load * 1000, 3),
+        'tickets': len(state.data['tickets']),
+        'bans': len(state.data['banned_users'])
+    }
+
+# ==================== PROCESOS ====================
+# --child prepare: escribe el estado sintético con el almacén del bot
+# --child <escenario>: carga bot.py en el directorio y ejecuta el escenario
+def run_child(args):
+    os.chdir(args.workdir)
+    sys.path.insert(0, REPO_DIR)
+    started = time.perf_counter()
+    import bot as B  # Importar no toca el disco: el almacén se abre en el directorio actual al cargar
+    import_ms = round((time.perf_counter() - started) * 1000, 3)
+
+    if args.child == 'prepare':
+        store = B.storage.open_partition(str(GUILD_ID), B.default_data)
+        store.load()  # Crea el directorio / las tablas de la partición
+        store.write_snapshot(synthetic_guild(B, args.size))
+        B.storage.close()
+        return
+
+    rest = FakeRest(args.latency, args.jitter)
+
+    async def main():
+        started = time.perf_counter()
+        await B.load_global_state()
+        global_load_ms = round((time.perf_counter() - started) * 1000, 3)
+        B.persistence.start()
+        B.outbound.start()
+        try:
+            result = await globals()[f'scenario_{args.child}'](B, args, rest)
+        finally:
+            await B.outbound.stop()
+            await B.persistence.stop()
+            B.guild_states.close()
+            B.storage.close()
+        result['import_ms'] = import_ms
+        result['global_load_ms'] = global_load_ms
+        result['rest_calls'] = rest.calls
+        result['peak_rss_mb'] = peak_rss_mb()
+        return result
+
+    result = asyncio.run(main())
+    with open('result.json', 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+def spawn(args, workdir, child):
+    command = [sys.executable, os.path.abspath(__file__), '--child', child, '--workdir', workdir,
+               '--size', str(args.size), '--ops', str(args.ops), '--concurrency', str(args.concurrency),
+               '--latency', str(args.latency), '--jitter', str(args.jitter)]
+    env = dict(os.environ, STORAGE_BACKEND=args.storage)
+    env.pop('CLUSTER_ID', None)
+    completed = subprocess.run(command, env=env, stdout=subprocess.DEVNULL if not args.verbose else None)
+    if completed.returncode != 0:
+        raise RuntimeError(f'el proceso {child} terminó con código {completed.returncode}')
+
+def format_result(result):
+    parts = []
+    for key, value in result.items():
+        if isinstance(value, dict) and 'p50_ms' in value:
+            parts.append(f"{key} p50 {value['p50_ms']} ms / p99 {value['p99_ms']} ms")
+        elif not isinstance(value, dict):
+            parts.append(f'{key}={value}')
+    return ', '.join(parts)
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_parent(args):
+    scenarios = args.scenarios or list(SCENARIOS)
+    report = {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'storage': args.storage,
+            'size': args.size,
+            'ops': args.ops,
+            'concurrency': args.concurrency,
+            'latency_s': args.latency,
+            'jitter_s': args.jitter
+        },
+        'scenarios': {}
+    }
+    for scenario in scenarios:
+        with tempfile.TemporaryDirectory(prefix=f'bench-{scenario}-') as workdir:
+            print(f'⏳ {scenario}: preparando {args.size} tickets y baneos...')
+            spawn(args, workdir, 'prepare')
+            print(f'🏃 {scenario}: ejecutando...')
+            spawn(args, workdir, scenario)
+            with open(os.path.join(workdir, 'result.json'), encoding='utf-8') as f:
+                result = json.load(f)
+        report['scenarios'][scenario] = result
+        print(f'✅ {scenario}: {format_result(result)}')
+
+    output = args.output or f'benchmark-{datetime.now():%Y%m%d-%H%M%S}.json'
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f'📄 Resultados guardados en {output}')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Banco de pruebas de rendimiento del bot')
+    parser.add_argument('scenarios', nargs='*', metavar='escenario', help=f'Escenarios a ejecutar ({", ".join(SCENARIOS)}); por defecto todos')
+    parser.add_argument('--size', type=int, default=10000, help='Tickets abiertos y baneos del estado sintético (10k-1M)')
+    parser.add_argument('--ops', type=int, default=1000, help='Operaciones por escenario')
+    parser.add_argument('--concurrency', type=int, default=500, help='Interacciones simultáneas (tickets abiertos a la vez en ticket_open)')
+    parser.add_argument('--latency', type=float, default=0.05, help='Latencia simulada de cada llamada REST (segundos)')
+    parser.add_argument('--jitter', type=float, default=0.01, help='Desviación de la latencia simulada (segundos)')
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default=os.getenv('STORAGE_BACKEND', 'json'))
+    parser.add_argument('--output', help='Fichero JSON de resultados (por defecto benchmark-<fecha>.json)')
+    parser.add_argument('--verbose', action='store_true', help='Mostrar la salida del bot en cada escenario')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f'escenarios desconocidos: {", ".join(unknown)}')
+    return args
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    if arguments.child:
+        run_child(arguments)
+    else:
+        run_parent(arguments)
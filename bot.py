@@ -6,6 +6,35 @@ import os
 from datetime import datetime
 import asyncio
 import io
+import threading
+import sqlite3
+import itertools
+import gzip
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+import heapq
+import bisect
+import time
+import html
+import tempfile
+import zlib
+import signal
+import subprocess
+import sys
+import csv
+import re
+import hmac
+import hashlib
+import contextvars
+import functools
+import math
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from aiohttp import web
+try:
+    import orjson  # Opcional: lectura/escritura de JSON más rápida
+except ImportError:
+    orjson = None
 
 # Intents necesarios
 intents = discord.Intents.default()
@@ -13,15 +42,317 @@ intents.message_content = True
 intents.members = True
 intents.guilds = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+# Con SHARD_COUNT sin definir discord.py pide a Discord el número recomendado.
+# En modo clúster (`python bot.py cluster`) el lanzador arranca un proceso por
+# rango de shards y le pasa CLUSTER_ID, SHARD_IDS y SHARD_COUNT.
+SHARD_COUNT = int(os.getenv('SHARD_COUNT')) if os.getenv('SHARD_COUNT') else None
+SHARD_IDS = [int(i) for i in os.getenv('SHARD_IDS').split(',')] if os.getenv('SHARD_IDS') else None
+CLUSTER_ID = os.getenv('CLUSTER_ID')
+
+# ==================== MÉTRICAS ====================
+# Cada comando y botón mide su latencia total y, por fases, cuánto tarda la
+# primera respuesta a Discord (defer), el almacenamiento (persistence), las
+# peticiones REST y el followup. También se miden el retraso del event loop, la
+# profundidad de las colas y cada escritura a disco. Todo vive en memoria: con
+# METRICS_PORT se sirve /metrics en formato Prometheus y /stats da un resumen.
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # Segundos
+METRICS_LAG_INTERVAL = 0.5
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT')) if os.getenv('METRICS_PORT') else None  # En clúster se suma CLUSTER_ID
+
+current_command = contextvars.ContextVar('current_command', default=None)
+
+class Histogram:
+    __slots__ = ('buckets', 'count', 'total')
+
+    def __init__(self):
+        self.buckets = [0] * (len(METRICS_BUCKETS) + 1)  # El último es +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(METRICS_BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def merge(self, other):
+        for i, n in enumerate(other.buckets):
+            self.buckets[i] += n
+        self.count += other.count
+        self.total += other.total
+
+    # Aproximado: límite superior del bucket en el que cae el cuantil
+    def quantile(self, q):
+        seen = 0
+        for bound, n in zip(METRICS_BUCKETS + (float('inf'),), self.buckets):
+            seen += n
+            if seen and seen >= q * self.count:
+                return bound
+        return 0.0
+
+def _prom_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels) + '}'
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}  # (nombre, etiquetas) -> Histogram
+        self.counters = {}  # (nombre, etiquetas) -> valor
+        self.gauges = {}  # nombre -> función que devuelve el valor actual
+        self.loop_lag = 0.0
+        self._task = None
+        self._runner = None
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, func):
+        self.gauges[name] = func
+
+    # Histogramas de `name` sumados por el valor de la etiqueta `label`
+    def merged(self, name, label):
+        result = {}
+        for (metric, labels), histogram in self.histograms.items():
+            if metric == name:
+                value = dict(labels).get(label)
+                result.setdefault(value, Histogram()).merge(histogram)
+        return result
+
+    def record_command(self, command, seconds, status):
+        self.observe('bot_command_seconds', seconds, command=command)
+        self.inc('bot_commands_total', command=command, status=status)
+
+    # Fase de la interacción en curso (fuera de un comando no mide nada)
+    @contextmanager
+    def phase(self, name):
+        command = current_command.get()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if command:
+                self.observe('bot_phase_seconds', time.perf_counter() - start, command=command, phase=name)
+
+    async def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._watch_loop(), name='metrics-loop-lag')
+        if METRICS_PORT and not self._runner:
+            app = web.Application()
+            app.router.add_get('/metrics', self._handle)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            port = METRICS_PORT + int(CLUSTER_ID or 0)
+            await web.TCPSite(self._runner, METRICS_HOST, port).start()
+            print(f'📊 Métricas en http://{METRICS_HOST}:{port}/metrics')
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    # Cuánto más de lo pedido tarda en volver un sleep: tiempo bloqueado del loop
+    async def _watch_loop(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(METRICS_LAG_INTERVAL)
+            self.loop_lag = max(0.0, time.perf_counter() - start - METRICS_LAG_INTERVAL)
+            self.observe('bot_event_loop_lag_seconds', self.loop_lag)
+
+    async def _handle(self, request):
+        return web.Response(text=self.render(), content_type='text/plain', charset='utf-8')
+
+    def render(self):
+        lines = []
+        for name, func in sorted(self.gauges.items()):
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {func()}')
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{_prom_labels(labels)} {value}')
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for bound, n in zip(METRICS_BUCKETS + (float('inf'),), histogram.buckets):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else str(bound)
+                lines.append(f'{name}_bucket{_prom_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{_prom_labels(labels)} {histogram.total}')
+            lines.append(f'{name}_count{_prom_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+# Los comandos de barra se miden desde el árbol: interaction_check marca el
+# inicio y el comando en curso (misma tarea que el comando) y el fin llega por
+# on_app_command_completion o por on_error.
+class InstrumentedTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction):
+        # El autocompletado no gasta fichas ni se mide: no admite send_message y
+        # se dispara con cada tecla mientras el usuario escribe
+        if interaction.type == discord.InteractionType.autocomplete:
+            return True
+        if not await allow_interaction(interaction, 'command'):
+            return False
+        if interaction.command:
+            current_command.set(interaction.command.qualified_name)
+            interaction.extras['started_at'] = time.perf_counter()
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        started_at = interaction.extras.get('started_at')
+        if started_at is not None and interaction.command:
+            metrics.record_command(interaction.command.qualified_name, time.perf_counter() - started_at, 'error')
+        await super().on_error(interaction, error)
+
+# Para callbacks que no son comandos de barra (botones, menús)
+def instrumented(name):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            current_command.set(name)
+            start = time.perf_counter()
+            status = 'error'
+            try:
+                result = await func(*args, **kwargs)
+                status = 'ok'
+                return result
+            finally:
+                metrics.record_command(name, time.perf_counter() - start, status)
+        return wrapper
+    return decorator
+
+# ==================== LÍMITE DE INTERACCIONES ====================
+# Cubos de fichas por usuario y por servidor para cada categoría de
+# interacción, comprobados antes de cualquier trabajo: un usuario o una raid
+# pulsando botones sin parar recibe un aviso efímero sin tocar el estado ni la
+# API REST. (capacidad, segundos) = ráfaga máxima y tiempo en recargarla entera.
+# Se pueden cambiar con RATE_LIMITS (JSON) y afinar por tipo de ticket con una
+# categoría 'ticket:<tipo>', p. ej. {"ticket:reporte": {"user": [1, 300]}}.
+RATE_LIMITS = {
+    'command': {'user': (5, 10), 'guild': (60, 10)},  # Comandos de barra
+    'ticket': {'user': (3, 60), 'guild': (60, 30)},  # Abrir tickets desde el panel
+    'ticket_close': {'user': (3, 30), 'guild': (30, 30)},  # Cerrar / transcript
+    'component': {'user': (10, 10)},  # Otros botones y menús (/bans...)
+}
+RATE_LIMITS.update(json.loads(os.getenv('RATE_LIMITS', '{}')))
+# Cubos recordados como máximo; se olvidan los menos usados. Olvidar un cubo
+# solo lo rellena, así que llenar la tabla no perjudica a nadie.
+RATE_LIMIT_MAX_BUCKETS = 50000
+
+class RateLimiter:
+    def __init__(self, limits, max_buckets):
+        self.limits = limits
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()  # (categoría, ámbito, id) -> [fichas, último uso]
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _bucket(self, key, capacity, period, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(capacity), now]
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * capacity / period)
+            bucket[1] = now
+        return bucket
+
+    # None si se permite (y se gasta una ficha de cada cubo); si no, (ámbito, segundos de espera)
+    def hit(self, category, user_id, guild_id):
+        limits = self.limits.get(category)
+        if limits is None:
+            # 'ticket:<tipo>' sin límites propios comparte los cubos de 'ticket'
+            category = category.split(':', 1)[0]
+            limits = self.limits.get(category, {})
+        now = time.monotonic()
+        buckets = []
+        for scope, key in (('user', user_id), ('guild', guild_id)):
+            if key is None or scope not in limits:
+                continue
+            capacity, period = limits[scope]
+            bucket = self._bucket((category, scope, key), capacity, period, now)
+            if bucket[0] < 1:
+                return scope, (1 - bucket[0]) * period / capacity
+            buckets.append(bucket)
+        # Solo se cobra si pasan todos: un servidor saturado no vacía el cubo del usuario
+        for bucket in buckets:
+            bucket[0] -= 1
+        return None
+
+rate_limiter = RateLimiter(RATE_LIMITS, RATE_LIMIT_MAX_BUCKETS)
+metrics.gauge('bot_rate_limit_buckets', lambda: len(rate_limiter))
+
+async def allow_interaction(interaction: discord.Interaction, category):
+    rejected = rate_limiter.hit(category, interaction.user.id, interaction.guild_id)
+    if rejected is None:
+        return True
+    scope, retry_after = rejected
+    metrics.inc('bot_rate_limited_total', category=category, scope=scope)
+    if scope == 'user':
+        message = f"⏳ Vas demasiado rápido. Inténtalo de nuevo en {math.ceil(retry_after)} s."
+    else:
+        message = f"⏳ El servidor está recibiendo muchas peticiones. Inténtalo de nuevo en {math.ceil(retry_after)} s."
+    await interaction.response.send_message(message, ephemeral=True)
+    return False
+
+bot = commands.AutoShardedBot(command_prefix="!", intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, tree_cls=InstrumentedTree)
 
 # Sistema de almacenamiento de datos
+# El estado está partido por servidor de Discord: cada partición ('<guild_id>')
+# guarda la config, los tickets abiertos, los baneos y el estado del servidor
+# FiveM de esa comunidad, y la partición 'global' las colas compartidas (logs
+# pendientes y trabajos).
+# Con el backend JSON cada partición es un directorio data/<partición>/ con un
+# snapshot (data.json) más un journal de solo-añadir (data.journal) con un
+# registro pequeño por cada cambio. Al cargar se lee el snapshot y se reaplica
+# el journal encima; cada cierto número de registros el journal se compacta en
+# un snapshot nuevo en segundo plano. Los baneos van en su propio snapshot
+# (bans.json) y, como en SQLite, solo se leen la primera vez que algo los usa.
+# Con STORAGE_BACKEND=sqlite se usa en su lugar una base SQLite (data.db) que
+# importa los ficheros JSON automáticamente la primera vez. Es el backend del
+# modo clúster: todos los procesos comparten la misma base.
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite' if CLUSTER_ID else 'json')  # 'json' o 'sqlite'
+DATA_DIR = 'data'
 DATA_FILE = 'data.json'
+JOURNAL_FILE = 'data.journal'
+BANS_FILE = 'bans.json'
+JOURNAL_COMPACT_EVERY = 500  # Registros acumulados antes de compactar
+JOURNAL_FSYNC = True  # fsync tras cada escritura del journal (durabilidad ante cortes)
+SQLITE_FILE = 'data.db'
+SQLITE_BUSY_TIMEOUT = 30  # Segundos esperando el lock de escritura de otro proceso
+ARCHIVE_DIR = 'archive'  # Tickets cerrados: <partición>/archive/tickets-AAAA-MM.jsonl.gz
+# Cada proceso del clúster tiene sus propias colas (sus servidores son otros)
+GLOBAL_PARTITION = f'global-{CLUSTER_ID}' if CLUSTER_ID else 'global'
+# data.json de antes del modo multi-servidor (en la raíz): lo hereda este
+# servidor o, si no se indica, el único servidor en el que está el bot. Sin
+# poder decidirlo no se carga ningún servidor.
+LEGACY_GUILD_ID = os.getenv('LEGACY_GUILD_ID')
 
-def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
+def default_data():
     return {
         'tickets': {},
         'server_status': 'offline',
@@ -31,45 +362,1683 @@ def load_data():
             'logs_channel_id': None,
             'updates_channel_id': None,
             'ticket_counter': 0,
+            'released_ticket_numbers': [],  # Números de creaciones fallidas pendientes de reutilizar
             'server_logo': 'https://i.imgur.com/9w3wHPF.png',  # Logo por defecto
             'server_online_image': 'https://i.imgur.com/dQwWZpF.png',  # Imagen online por defecto
             'server_offline_image': 'https://i.imgur.com/3vN8FkM.png',  # Imagen offline por defecto
             'transcript_channel_id': None,
             'ticket_panel_channel_id': None,
+            'fivem_endpoint': None,  # ip:puerto del servidor FiveM para el estado en vivo
+            'status_channel_id': None,
+            'status_message_id': None,
+            'announce_channel_ids': [],  # Canales extra (también de servidores aliados) para anuncios
             'ticket_categories': {
                 'soporte': {
                     'name': '🛠️ Soporte Técnico',
                     'description': 'Problemas técnicos, bugs del servidor o ayuda general',
                     'emoji': '🛠️',
+                    'style': 'primary',
                     'category_id': None
                 },
                 'donaciones': {
                     'name': '💰 Donaciones',
                     'description': 'Consultas sobre donaciones, VIP y beneficios',
                     'emoji': '💰',
+                    'style': 'success',
                     'category_id': None
                 },
                 'gangas': {
                     'name': '🎁 Gangas',
                     'description': 'Ofertas especiales, eventos y promociones',
                     'emoji': '🎁',
+                    'style': 'secondary',
                     'category_id': None
                 },
                 'reporte': {
                     'name': '🚨 Reporte a Jugador',
                     'description': 'Reportar jugadores que incumplen las normas',
                     'emoji': '🚨',
+                    'style': 'danger',
                     'category_id': None
                 }
             }
         }
     }
 
-def save_data(data):
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+def default_global_data():
+    return {
+        'pending_logs': {},
+        'jobs': {},
+        'ban_expiry': {},
+        'fivem_targets': {},
+        'command_sync': {}  # ámbito ('global' o guild_id) -> hash del árbol sincronizado
+    }
+
+# Todo el JSON del almacenamiento pasa por aquí. Con orjson instalado se
+# (de)serializa varias veces más rápido; el formato en disco es el mismo JSON,
+# así que se puede instalar o quitar sin migrar nada.
+if orjson:
+    def json_loads(data):
+        return orjson.loads(data)
+
+    def json_dumps(value):
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+else:
+    def json_loads(data):
+        return json.loads(data)
+
+    def json_dumps(value):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+def _apply_record(data, record):
+    *parents, key = record['path']
+    node = data
+    for part in parents:
+        node = node.setdefault(part, {})
+    if record['op'] == 'del':
+        node.pop(key, None)
+    else:
+        node[key] = record['value']
+
+# Con deferred, los registros de baneos se guardan ahí en vez de aplicarse
+def _replay_journal(data, path, deferred=None):
+    if not os.path.exists(path):
+        return 0
+    count = 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json_loads(line)
+            except ValueError:
+                # Última línea a medio escribir tras un corte: se descarta
+                print(f'⚠️ Registro corrupto ignorado en {path}')
+                continue
+            if deferred is not None and record['path'][0] == 'banned_users':
+                deferred.append(record)
+            else:
+                _apply_record(data, record)
+            count += 1
+    return count
+
+def _write_atomic(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(json_dumps(data))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+# ==================== ARCHIVO DE TICKETS CERRADOS ====================
+# Los tickets cerrados salen del estado en memoria y se añaden (JSON Lines
+# comprimido) al fichero del mes en que se cerraron. Cada escritura es un
+# miembro gzip nuevo, así que añadir no requiere reescribir el fichero.
+ARCHIVE_LOOKUP_CACHE = 256  # Tickets archivados recientes que se guardan en memoria
+
+def _archive_file(archive_dir, ticket):
+    closed_at = ticket.get('closed_at') or ticket.get('created_at') or 0
+    return os.path.join(archive_dir, f'tickets-{datetime.fromtimestamp(closed_at):%Y-%m}.jsonl.gz')
+
+def _append_archive(archive_dir, records):
+    by_file = {}
+    for ticket, encoded in records:
+        by_file.setdefault(_archive_file(archive_dir, ticket), []).append(encoded + '\n')
+    os.makedirs(archive_dir, exist_ok=True)
+    for path, lines in by_file.items():
+        with open(path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='ab') as gz:
+                gz.write(''.join(lines).encode('utf-8'))
+            raw.flush()
+            os.fsync(raw.fileno())
+
+# Del mes más reciente al más antiguo: lo normal es buscar tickets recientes
+def _archive_files(archive_dir):
+    if not os.path.isdir(archive_dir):
+        return []
+    names = sorted((n for n in os.listdir(archive_dir) if n.endswith('.jsonl.gz')), reverse=True)
+    return [os.path.join(archive_dir, n) for n in names]
+
+def _iter_archive_file(path):
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                yield json_loads(line)
+    except (EOFError, OSError, ValueError):
+        # Último bloque truncado por un corte: lo leído hasta ahí es válido
+        print(f'⚠️ Archivo de tickets incompleto: {path}')
+
+def _scan_archive(archive_dir, channel_id):
+    for path in _archive_files(archive_dir):
+        found = None
+        for ticket in _iter_archive_file(path):
+            if ticket.get('channel_id') == channel_id:
+                found = ticket  # Sin break: si se archivó dos veces vale la última
+        if found:
+            return found
+    return None
+
+class DataJournal:
+    def __init__(self, directory, defaults):
+        self.directory = directory
+        self.defaults = defaults
+        self.snapshot_file = os.path.join(directory, DATA_FILE)
+        self.bans_file = os.path.join(directory, BANS_FILE)
+        self.journal_file = os.path.join(directory, JOURNAL_FILE)
+        self.rotated_file = f'{self.journal_file}.1'
+        self.archive_dir = os.path.join(directory, ARCHIVE_DIR)
+        self._lock = threading.Lock()  # Protege el fichero del journal abierto
+        self._compact_lock = threading.Lock()  # Solo una compactación/snapshot a la vez
+        self._handle = None
+        self._records = 0
+        self._ban_records = []  # Cambios de baneos del journal mientras los baneos no están cargados
+
+    def _read_snapshot(self):
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, 'rb') as f:
+                return json_loads(f.read())
+        return self.defaults()
+
+    def _read_bans(self):
+        if os.path.exists(self.bans_file):
+            with open(self.bans_file, 'rb') as f:
+                return json_loads(f.read())
+        return {}
+
+    def _apply_ban_records(self, bans):
+        wrapper = {'banned_users': bans}
+        for record in self._ban_records:
+            _apply_record(wrapper, record)
+        self._ban_records = []
+        return wrapper['banned_users']
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        data = self._read_snapshot()
+        # Partición nueva o snapshot del formato anterior (baneos dentro de data.json):
+        # los baneos ya están leídos y se quedan en memoria
+        bans = data.pop('banned_users', None)
+        self._ban_records = []
+        _replay_journal(data, self.rotated_file, self._ban_records)
+        self._records = _replay_journal(data, self.journal_file, self._ban_records)
+        if bans is not None:
+            data['banned_users'] = self._apply_ban_records(bans)
+        self._handle = open(self.journal_file, 'a', encoding='utf-8')
+        closed = [(key, t) for key, t in data.get('tickets', {}).items() if not t.get('open', False)]
+        if closed:
+            # Historial de versiones anteriores: sacarlo del estado vivo una sola vez
+            _append_archive(self.archive_dir, [(t, json_dumps(t)) for _, t in closed])
+            for key, _ in closed:
+                del data['tickets'][key]
+            print(f'📦 {len(closed)} tickets cerrados movidos a {self.archive_dir}/')
+            self.write_snapshot(data)
+        elif os.path.exists(self.rotated_file) or (bans is not None and os.path.exists(self.snapshot_file)):
+            # Una compactación anterior quedó a medias, o hay que separar los baneos del snapshot
+            self.write_snapshot(data)
+        return data
+
+    # Baneos de la partición: su snapshot más los cambios del journal
+    def load_bans(self):
+        return self._apply_ban_records(self._read_bans())
+
+    # [(user_id, expires_at)] de los baneos temporales. JSON no tiene consultas por
+    # fila: se lee el snapshot de baneos pero no se queda en memoria.
+    def temporary_bans(self):
+        wrapper = {'banned_users': self._read_bans()}
+        for record in self._ban_records:
+            _apply_record(wrapper, record)
+        return [(user_id, entry['expires_at']) for user_id, entry in wrapper['banned_users'].items() if entry.get('expires_at')]
+
+    def normalize_path(self, path):
+        return tuple(path)
+
+    # records: (clave, ticket, json). Primero el archivo y después el borrado en el
+    # journal, para que un corte entre ambos no pierda el ticket.
+    def archive(self, records):
+        _append_archive(self.archive_dir, [(ticket, encoded) for _, ticket, encoded in records])
+        self.write([(('tickets', key), None) for key, _, _ in records])
+
+    def find_archived(self, channel_id):
+        return _scan_archive(self.archive_dir, channel_id)
+
+    def write(self, records):
+        lines = []
+        for path, value in records:
+            if value is None:
+                lines.append(f'{{"op":"del","path":{json_dumps(list(path))}}}\n')
+            else:
+                lines.append(f'{{"op":"set","path":{json_dumps(list(path))},"value":{value}}}\n')
+        with self._lock:
+            if self._handle is None:
+                raise RuntimeError(f'journal cerrado: {self.journal_file}')
+            self._handle.write(''.join(lines))
+            self._handle.flush()
+            if JOURNAL_FSYNC:
+                os.fsync(self._handle.fileno())
+            self._records += len(lines)
+            needs_compaction = self._records >= JOURNAL_COMPACT_EVERY
+        if needs_compaction and not self._compact_lock.locked():
+            threading.Thread(target=self.compact, name='journal-compact', daemon=True).start()
+
+    def compact(self):
+        with self._compact_lock:
+            with self._lock:
+                if self._handle is None or self._records < JOURNAL_COMPACT_EVERY:
+                    return
+                # Rotar el journal: los cambios nuevos van a un fichero limpio
+                self._handle.close()
+                os.replace(self.journal_file, self.rotated_file)
+                self._handle = open(self.journal_file, 'a', encoding='utf-8')
+                self._records = 0
+            # Se trabaja solo con ficheros, sin tocar el estado en memoria del bot
+            data = self._read_snapshot()
+            bans = data.pop('banned_users', None)
+            ban_records = []
+            _replay_journal(data, self.rotated_file, ban_records)
+            if ban_records or bans is not None:
+                wrapper = {'banned_users': self._read_bans() if bans is None else bans}
+                for record in ban_records:
+                    _apply_record(wrapper, record)
+                _write_atomic(self.bans_file, wrapper['banned_users'])
+            _write_atomic(self.snapshot_file, data)
+            os.remove(self.rotated_file)
+
+    def write_snapshot(self, data):
+        with self._compact_lock, self._lock:
+            if 'banned_users' in data:
+                bans = data['banned_users']
+                data = {top: value for top, value in data.items() if top != 'banned_users'}
+            elif self._ban_records:
+                # Baneos sin cargar: sus cambios solo están en el journal que se va a vaciar
+                bans = self._apply_ban_records(self._read_bans())
+            else:
+                bans = None
+            if bans is not None:
+                _write_atomic(self.bans_file, bans)
+            _write_atomic(self.snapshot_file, data)
+            self._handle.truncate(0)
+            if os.path.exists(self.rotated_file):
+                os.remove(self.rotated_file)
+            self._records = 0
+
+    # Espera a la compactación en curso: si no, al recargar la partición el
+    # snapshot nuevo y el de la compactación se pisarían en data.json.tmp
+    def close(self):
+        with self._compact_lock, self._lock:
+            if self._handle:
+                self._handle.close()
+                self._handle = None
+
+def _legacy_files():
+    return [p for p in (DATA_FILE, BANS_FILE, JOURNAL_FILE, f'{JOURNAL_FILE}.1', ARCHIVE_DIR) if os.path.exists(p)]
+
+# Servidor que hereda los datos anteriores: LEGACY_GUILD_ID o, si no se indica,
+# el que decide GuildStates antes de crear ninguna partición
+legacy_owner = LEGACY_GUILD_ID
+
+def _claims_legacy(pid):
+    return pid != GLOBAL_PARTITION and pid == legacy_owner
+
+class JsonStorage:
+    def legacy_pending(self):
+        return bool(_legacy_files())
+
+    def open_partition(self, pid, defaults):
+        directory = os.path.join(DATA_DIR, pid)
+        if not os.path.isdir(directory) and _legacy_files() and _claims_legacy(pid):
+            os.makedirs(directory)
+            for path in _legacy_files():
+                os.replace(path, os.path.join(directory, path))
+            print(f'📦 Datos anteriores al modo multi-servidor asignados al servidor {pid}')
+        return DataJournal(directory, defaults)
+
+    def close(self):
+        pass
+
+# ==================== ALMACENAMIENTO SQLITE ====================
+# Cada ticket, baneo, categoría y clave de config es una fila, con la partición
+# en la columna scope. Solo los tickets abiertos se cargan en memoria; el
+# historial cerrado se queda en disco. Una única conexión compartida por todas
+# las particiones, usada siempre desde el hilo de persistencia (o con el lock).
+# En modo clúster cada escritura deja además su ruta en la tabla changes, que
+# los demás procesos consultan para refrescar lo que tienen en memoria.
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scopes (
+    scope TEXT PRIMARY KEY,
+    created_at INTEGER
+);
+CREATE TABLE IF NOT EXISTS config (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+CREATE TABLE IF NOT EXISTS ticket_categories (
+    scope TEXT NOT NULL,
+    tipo TEXT NOT NULL,
+    category_id INTEGER,
+    data TEXT NOT NULL,
+    PRIMARY KEY (scope, tipo)
+);
+CREATE TABLE IF NOT EXISTS tickets (
+    channel_id INTEGER PRIMARY KEY,
+    scope TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    number TEXT,
+    open INTEGER NOT NULL,
+    created_at INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tickets_scope_user_open ON tickets (scope, user_id, open);
+CREATE INDEX IF NOT EXISTS idx_tickets_scope_open ON tickets (scope) WHERE open = 1;
+CREATE TABLE IF NOT EXISTS bans (
+    scope TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    username TEXT,
+    razon TEXT,
+    banned_by TEXT,
+    banned_at INTEGER,
+    data TEXT NOT NULL,
+    PRIMARY KEY (scope, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_bans_scope_banned_at ON bans (scope, banned_at);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    scope TEXT NOT NULL,
+    path TEXT NOT NULL,
+    origin TEXT NOT NULL,
+    at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS state (
+    scope TEXT NOT NULL,
+    top TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (scope, top, key)
+);
+PRAGMA user_version = 2;
+'''
+SQLITE_TABLES = ('config', 'ticket_categories', 'tickets', 'bans', 'state')
+LEGACY_SCOPE = ''  # Datos de una sola comunidad pendientes de asignar a un servidor
+
+# Profundidad de ruta que corresponde a una fila: ('tickets', id), ('config', clave),
+# ('config', 'ticket_categories', tipo)...
+def _row_depth(path):
+    if path[0] == 'config' and len(path) > 1 and path[1] == 'ticket_categories':
+        return 3
+    return 2
+
+class SqliteStorage:
+    def __init__(self, db_file, origin=None):
+        self.db_file = db_file
+        self.origin = origin  # Proceso del clúster que escribe (None: sin registro de cambios)
+        self.lock = threading.RLock()
+        self._conn = None
+
+    @property
+    def conn(self):
+        with self.lock:
+            if self._conn is None:
+                self._connect()
+            return self._conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        # Ya visible para la importación, que escribe a través de las particiones
+        self._conn = conn
+        try:
+            if version == 1:
+                self._migrate_v1(conn)
+            conn.executescript(SQLITE_SCHEMA)
+            if version == 0:
+                self._import_json(conn)
+        except Exception:
+            self._conn = None
+            conn.close()
+            raise
+
+    # v1 (una sola comunidad, sin columna scope): todo pasa a la partición heredada
+    def _migrate_v1(self, conn):
+        conn.executescript('''
+            DROP INDEX IF EXISTS idx_tickets_user_open;
+            DROP INDEX IF EXISTS idx_tickets_open;
+            DROP INDEX IF EXISTS idx_bans_banned_at;
+        ''' + ''.join(f'ALTER TABLE {table} RENAME TO {table}_v1;\n' for table in SQLITE_TABLES))
+        conn.executescript(SQLITE_SCHEMA)
+        with conn:
+            conn.execute('INSERT INTO scopes (scope, created_at) VALUES (?, ?)', (LEGACY_SCOPE, int(time.time())))
+            conn.execute('INSERT INTO config SELECT ?, key, value FROM config_v1', (LEGACY_SCOPE,))
+            conn.execute('INSERT INTO ticket_categories SELECT ?, tipo, category_id, data FROM ticket_categories_v1 ORDER BY rowid', (LEGACY_SCOPE,))
+            conn.execute('INSERT INTO tickets SELECT channel_id, ?, user_id, type, number, open, created_at, data FROM tickets_v1', (LEGACY_SCOPE,))
+            conn.execute('INSERT INTO bans SELECT ?, user_id, username, razon, banned_by, banned_at, data FROM bans_v1', (LEGACY_SCOPE,))
+            conn.execute('INSERT INTO state SELECT ?, top, key, value FROM state_v1', (LEGACY_SCOPE,))
+        conn.executescript(''.join(f'DROP TABLE {table}_v1;\n' for table in SQLITE_TABLES))
+        print('✅ Base de datos migrada al formato multi-servidor')
+
+    # Importación única de los ficheros JSON (data.json antiguo en la raíz y
+    # particiones de data/); los originales se renombran a *.migrated
+    def _import_json(self, conn):
+        sources = []
+        if _legacy_files():
+            sources.append((LEGACY_SCOPE, DataJournal('.', default_data)))
+        if os.path.isdir(DATA_DIR):
+            for pid in sorted(os.listdir(DATA_DIR)):
+                defaults = default_global_data if pid == GLOBAL_PARTITION else default_data
+                sources.append((pid, DataJournal(os.path.join(DATA_DIR, pid), defaults)))
+
+        for scope, legacy in sources:
+            data = legacy.load()
+            if 'config' in data and 'banned_users' not in data:
+                data['banned_users'] = legacy.load_bans()
+            legacy.close()
+            partition = SqlitePartition(self, scope, legacy.defaults)
+            with conn:
+                conn.execute('INSERT OR IGNORE INTO scopes (scope, created_at) VALUES (?, ?)', (scope, int(time.time())))
+                for top, value in data.items():
+                    partition._store((top,), value)
+                for path in _archive_files(legacy.archive_dir):
+                    for ticket in _iter_archive_file(path):
+                        partition._store(('tickets', str(ticket['channel_id'])), ticket)
+            print(f'✅ Partición {scope or "(anterior)"} importada a {self.db_file}: {len(data.get("tickets", {}))} tickets, {len(data.get("banned_users", {}))} baneos')
+
+        if sources:
+            for path in _legacy_files() + ([DATA_DIR] if os.path.isdir(DATA_DIR) else []):
+                os.replace(path, f'{path}.migrated')
+
+    def legacy_pending(self):
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM scopes WHERE scope = ?', (LEGACY_SCOPE,)).fetchone() is not None
+
+    def open_partition(self, pid, defaults):
+        return SqlitePartition(self, pid, defaults)
+
+    def record_changes(self, scope, paths):
+        if self.origin is None or not paths:
+            return
+        now = int(time.time())
+        self.conn.executemany(
+            'INSERT INTO changes (scope, path, origin, at) VALUES (?, ?, ?, ?)',
+            [(scope, json_dumps(list(path)), self.origin, now) for path in paths]
+        )
+
+    def latest_change(self):
+        with self.lock:
+            return self.conn.execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+
+    # Cambios escritos por otros procesos después de seq: [(seq, partición, ruta)]
+    def changes_since(self, seq):
+        with self.lock:
+            rows = self.conn.execute('SELECT seq, scope, path FROM changes WHERE seq > ? AND origin != ? ORDER BY seq', (seq, self.origin or '')).fetchall()
+        return [(row_seq, scope, tuple(json_loads(path))) for row_seq, scope, path in rows]
+
+    def prune_changes(self, older_than):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM changes WHERE at < ?', (older_than,))
+
+    def close(self):
+        with self.lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+
+class SqlitePartition:
+    def __init__(self, storage, scope, defaults):
+        self.storage = storage
+        self.scope = scope
+        self.defaults = defaults
+
+    def normalize_path(self, path):
+        return tuple(path[:_row_depth(path)])
+
+    def load(self):
+        with self.storage.lock:
+            conn = self.storage.conn
+            with conn:
+                # IMMEDIATE: otro proceso del clúster puede estar creando o heredando la misma partición
+                conn.execute('BEGIN IMMEDIATE')
+                known = {row[0] for row in conn.execute('SELECT scope FROM scopes WHERE scope IN (?, ?)', (self.scope, LEGACY_SCOPE))}
+                if self.scope not in known:
+                    if LEGACY_SCOPE in known and _claims_legacy(self.scope):
+                        for table in SQLITE_TABLES:
+                            conn.execute(f'UPDATE {table} SET scope = ? WHERE scope = ?', (self.scope, LEGACY_SCOPE))
+                        conn.execute('UPDATE scopes SET scope = ? WHERE scope = ?', (self.scope, LEGACY_SCOPE))
+                        print(f'📦 Datos anteriores al modo multi-servidor asignados al servidor {self.scope}')
+                    else:
+                        data = self.defaults()
+                        conn.execute('INSERT INTO scopes (scope, created_at) VALUES (?, ?)', (self.scope, int(time.time())))
+                        for top, value in data.items():
+                            self._store((top,), value)
+                        return data
+
+            data = self.defaults()
+            scope = (self.scope,)
+            if 'config' in data:
+                data['config'].update((key, json_loads(value)) for key, value in conn.execute('SELECT key, value FROM config WHERE scope = ?', scope))
+                data['config']['ticket_categories'] = {
+                    tipo: json_loads(value)
+                    for tipo, value in conn.execute('SELECT tipo, data FROM ticket_categories WHERE scope = ? ORDER BY rowid', scope)
+                }
+                data['tickets'] = {
+                    str(channel_id): json_loads(value)
+                    for channel_id, value in conn.execute('SELECT channel_id, data FROM tickets WHERE scope = ? AND open = 1', scope)
+                }
+                del data['banned_users']  # Se consultan al usarlos (load_bans)
+            for top, key, value in conn.execute('SELECT top, key, value FROM state WHERE scope = ? ORDER BY key', scope):
+                if key == '':
+                    data[top] = json_loads(value)
+                else:
+                    data.setdefault(top, {})[key] = json_loads(value)
+            return data
+
+    def load_bans(self):
+        with self.storage.lock:
+            rows = self.storage.conn.execute('SELECT user_id, data FROM bans WHERE scope = ?', (self.scope,)).fetchall()
+        return {user_id: json_loads(value) for user_id, value in rows}
+
+    # [(user_id, expires_at)] de los baneos temporales, sin decodificar el resto
+    def temporary_bans(self):
+        with self.storage.lock:
+            return self.storage.conn.execute(
+                "SELECT user_id, json_extract(data, '$.expires_at') FROM bans WHERE scope = ? AND json_extract(data, '$.expires_at') > 0",
+                (self.scope,)
+            ).fetchall()
+
+    def write(self, records):
+        with self.storage.lock, self.storage.conn:
+            for path, value in records:
+                self._store(path, json_loads(value) if value is not None else None)
+            self.storage.record_changes(self.scope, [path for path, _ in records])
+
+    def write_snapshot(self, data):
+        with self.storage.lock, self.storage.conn:
+            for top, value in data.items():
+                self._store((top,), value)
+            self.storage.record_changes(self.scope, [(top,) for top in data])
+
+    # Valor actual de una ruta de fila (tal como estaría en memoria), o None
+    def read(self, path):
+        top, key = path[0], path[-1]
+        if len(path) == 1:
+            query = ('SELECT value FROM state WHERE scope = ? AND top = ? AND key = ?', (self.scope, top, ''))
+        elif top == 'tickets':
+            query = ('SELECT data FROM tickets WHERE scope = ? AND channel_id = ? AND open = 1', (self.scope, int(key)))
+        elif top == 'banned_users':
+            query = ('SELECT data FROM bans WHERE scope = ? AND user_id = ?', (self.scope, key))
+        elif len(path) == 3:
+            query = ('SELECT data FROM ticket_categories WHERE scope = ? AND tipo = ?', (self.scope, key))
+        elif top == 'config':
+            query = ('SELECT value FROM config WHERE scope = ? AND key = ?', (self.scope, key))
+        else:
+            query = ('SELECT value FROM state WHERE scope = ? AND top = ? AND key = ?', (self.scope, top, key))
+        with self.storage.lock:
+            row = self.storage.conn.execute(*query).fetchone()
+        return json_loads(row[0]) if row else None
+
+    def _store(self, path, value):
+        conn = self.storage.conn
+        scope = self.scope
+        if len(path) < _row_depth(path):
+            # Colección completa (p. ej. ('tickets',)): reemplazar todas sus filas
+            self._clear(path)
+            if isinstance(value, dict):
+                for key, child in value.items():
+                    self._store(path + (key,), child)
+            elif value is not None and len(path) == 1:
+                conn.execute('INSERT OR REPLACE INTO state (scope, top, key, value) VALUES (?, ?, ?, ?)', (scope, path[0], '', json_dumps(value)))
+            return
+
+        top, key = path[0], path[-1]
+        if value is None:
+            if top == 'tickets':
+                conn.execute('DELETE FROM tickets WHERE channel_id = ?', (int(key),))
+            elif top == 'banned_users':
+                conn.execute('DELETE FROM bans WHERE scope = ? AND user_id = ?', (scope, key))
+            elif len(path) == 3:
+                conn.execute('DELETE FROM ticket_categories WHERE scope = ? AND tipo = ?', (scope, key))
+            elif top == 'config':
+                conn.execute('DELETE FROM config WHERE scope = ? AND key = ?', (scope, key))
+            else:
+                conn.execute('DELETE FROM state WHERE scope = ? AND top = ? AND key = ?', (scope, top, key))
+            return
+
+        encoded = json_dumps(value)
+        if top == 'tickets':
+            conn.execute(
+                'INSERT OR REPLACE INTO tickets (channel_id, scope, user_id, type, number, open, created_at, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (int(key), scope, value['user_id'], value['type'], value.get('number'), int(value.get('open', False)), value.get('created_at'), encoded)
+            )
+        elif top == 'banned_users':
+            conn.execute(
+                'INSERT OR REPLACE INTO bans (scope, user_id, username, razon, banned_by, banned_at, data) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (scope, key, value.get('username'), value.get('razon'), value.get('banned_by'), value.get('banned_at'), encoded)
+            )
+        elif len(path) == 3:
+            conn.execute(
+                # Upsert para conservar el rowid: el orden de las categorías es el del panel
+                'INSERT INTO ticket_categories (scope, tipo, category_id, data) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (scope, tipo) DO UPDATE SET category_id = excluded.category_id, data = excluded.data',
+                (scope, key, value.get('category_id'), encoded)
+            )
+        elif top == 'config':
+            conn.execute('INSERT OR REPLACE INTO config (scope, key, value) VALUES (?, ?, ?)', (scope, key, encoded))
+        else:
+            conn.execute('DELETE FROM state WHERE scope = ? AND top = ? AND key = ?', (scope, top, ''))
+            conn.execute('INSERT OR REPLACE INTO state (scope, top, key, value) VALUES (?, ?, ?, ?)', (scope, top, key, encoded))
+
+    def _clear(self, path):
+        conn = self.storage.conn
+        scope = (self.scope,)
+        if path[0] == 'tickets':
+            conn.execute('DELETE FROM tickets WHERE scope = ?', scope)
+        elif path[0] == 'banned_users':
+            conn.execute('DELETE FROM bans WHERE scope = ?', scope)
+        elif path[0] == 'config':
+            conn.execute('DELETE FROM ticket_categories WHERE scope = ?', scope)
+            if len(path) == 1:
+                conn.execute('DELETE FROM config WHERE scope = ?', scope)
+        else:
+            conn.execute('DELETE FROM state WHERE scope = ? AND top = ?', (self.scope, path[0]))
+
+    # En SQLite el historial ya vive en la tabla: archivar es guardar la fila cerrada
+    def archive(self, records):
+        with self.storage.lock, self.storage.conn:
+            for key, _, encoded in records:
+                self._store(('tickets', key), json_loads(encoded))
+            self.storage.record_changes(self.scope, [('tickets', key) for key, _, _ in records])
+
+    def find_archived(self, channel_id):
+        with self.storage.lock:
+            row = self.storage.conn.execute('SELECT data FROM tickets WHERE scope = ? AND channel_id = ?', (self.scope, channel_id)).fetchone()
+        return json_loads(row[0]) if row else None
+
+    def close(self):
+        pass  # La conexión es de SqliteStorage
+
+def create_storage():
+    if STORAGE_BACKEND == 'sqlite':
+        return SqliteStorage(SQLITE_FILE, CLUSTER_ID)
+    return JsonStorage()
+
+# Codifica el valor actual de cada ruta como (ruta, json), o (ruta, None) si ya
+# no existe. Se ejecuta en el hilo del bot para no leer el estado mientras cambia.
+def _encode_records(data, paths):
+    records = []
+    for path in paths:
+        node = data
+        for part in path:
+            if not isinstance(node, dict) or part not in node:
+                records.append((path, None))
+                break
+            node = node[part]
+        else:
+            records.append((path, json_dumps(node)))
+    return records
+
+# ==================== ESCRITOR EN SEGUNDO PLANO ====================
+# Los comandos solo marcan rutas como modificadas; una tarea del bot agrupa los
+# cambios durante PERSIST_WINDOW segundos y los escribe en un hilo aparte, de
+# forma que el event loop nunca espera al disco.
+PERSIST_WINDOW = 0.5
 
-bot_data = load_data()
+class PersistenceWriter:
+    def __init__(self, window):
+        self.window = window
+        # Un único hilo para que los registros lleguen al disco en orden
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='persistence')
+        self._dirty = {}  # (partición, ruta) -> partición; varias mutaciones de la misma ruta se escriben una vez
+        self._archived = []  # (partición, clave, ticket, json) pendientes de pasar al archivo
+        self._wakeup = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.create_task(self._run(), name='persistence-writer')
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    @property
+    def pending(self):
+        return len(self._dirty) + len(self._archived)
+
+    def mark_dirty(self, partition, paths):
+        for path in paths:
+            self._dirty[(partition.pid, partition.store.normalize_path(path))] = partition
+        self._wakeup.set()
+
+    def is_dirty(self, partition, path):
+        return (partition.pid, path) in self._dirty
+
+    def mark_archived(self, partition, key, ticket):
+        if partition.closed:
+            print(f'⚠️ Archivo del ticket {key} descartado: la partición {partition.pid} ya está descargada')
+            return
+        # El archivo ya guarda el ticket: un cambio pendiente de su ruta sería un borrado
+        self._dirty.pop((partition.pid, ('tickets', key)), None)
+        self._archived.append((partition, key, ticket, json_dumps(ticket)))
+        self._wakeup.set()
+
+    async def flush(self):
+        async with self._write_lock:
+            await self._flush_locked()
+
+    async def _flush_locked(self):
+        if not self._dirty and not self._archived:
+            return
+        failed = {}  # almacén -> excepción; un almacén que falla no bloquea a los demás
+        if self._archived:
+            archived, self._archived = self._archived, []
+            by_store = {}
+            for partition, key, ticket, encoded in archived:
+                by_store.setdefault(partition.store, []).append((key, ticket, encoded))
+            start = time.perf_counter()
+            failed = await self.run_io(_store_each, 'archive', by_store)
+            metrics.observe('bot_persistence_flush_seconds', time.perf_counter() - start, kind='archive')
+            metrics.inc('bot_persistence_records_total', len(archived), kind='archive')
+            self._archived[:0] = [item for item in archived if item[0].store in failed]
+        
+        # Lo pendiente de un almacén cuyo archivo falló espera: el archivo va antes que el journal
+        dirty = {key: partition for key, partition in self._dirty.items() if partition.store not in failed}
+        for key in dirty:
+            del self._dirty[key]
+        by_store = {}
+        for (_, path), partition in dirty.items():
+            by_store.setdefault(partition.store, []).extend(_encode_records(partition.data, [path]))
+        if by_store:
+            start = time.perf_counter()
+            write_failed = await self.run_io(_store_each, 'write', by_store)
+            metrics.observe('bot_persistence_flush_seconds', time.perf_counter() - start, kind='write')
+            metrics.inc('bot_persistence_records_total', len(dirty), kind='write')
+            # Reintentar en la siguiente escritura sin pisar cambios más nuevos
+            for key, partition in dirty.items():
+                if partition.store in write_failed:
+                    self._dirty.setdefault(key, partition)
+            failed.update(write_failed)
+        if failed:
+            raise next(iter(failed.values()))
+
+    # Escribe lo pendiente de la partición y cierra su almacén. Lo que se marque
+    # después sobre ese objeto (alguien que aún lo tenía) se descarta con aviso.
+    async def close_partition(self, partition):
+        async with self._write_lock:
+            while any(p is partition for p in self._dirty.values()) or any(item[0] is partition for item in self._archived):
+                await self._flush_locked()
+            partition.closed = True
+        await self.run_io(partition.store.close)
+
+    # Cualquier E/S de almacenamiento pasa por el mismo hilo, detrás de las escrituras pendientes
+    async def run_io(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def find_archived(self, partition, channel_id):
+        return await self.run_io(partition.store.find_archived, channel_id)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.window)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f'❌ Error al guardar datos: {e}')
+                self._wakeup.set()
+
+# Devuelve {almacén: excepción} de los que fallaron; los demás se escriben igual
+def _store_each(method, by_store):
+    failed = {}
+    for store, records in by_store.items():
+        try:
+            getattr(store, method)(records)
+        except Exception as e:
+            failed[store] = e
+    return failed
+
+# Una partición del estado: el dict en memoria y el almacén donde se guarda
+class Partition:
+    def __init__(self, pid, store, data):
+        self.pid = pid
+        self.store = store
+        self.data = data
+        self.closed = False  # Descargada: su almacén ya no admite escrituras
+
+storage = create_storage()
+persistence = PersistenceWriter(PERSIST_WINDOW)
+
+# save_data(state, ('banned_users', user_id), ...) marca solo las rutas indicadas
+# de la partición para el journal; con el bot en marcha la escritura ocurre en
+# segundo plano (usa `await persistence.flush()` si hace falta que sea durable ya).
+# Sin rutas escribe un snapshot completo.
+def save_data(state, *paths):
+    with metrics.phase('persistence'):
+        if state.closed:
+            print(f'⚠️ Cambios descartados en la partición {state.pid} ya descargada: {list(paths)[:5]}')
+        elif not paths:
+            state.store.write_snapshot(state.data)
+        elif persistence.running:
+            persistence.mark_dirty(state, paths)
+        else:
+            state.store.write(_encode_records(state.data, [state.store.normalize_path(p) for p in paths]))
+
+# La partición global (y con SQLite la importación/migración de la base, que
+# ocurre al abrirla) se carga en load_global_state, ya con el event loop en
+# marcha: importar el módulo no toca el disco
+global_state = Partition(GLOBAL_PARTITION, None, None)
+
+def _open_global_state():
+    store = storage.open_partition(GLOBAL_PARTITION, default_global_data)
+    return store, store.load()
+
+async def load_global_state():
+    if global_state.store is not None:
+        return
+    store, data = await persistence.run_io(_open_global_state)
+    if global_state.store is not None:
+        store.close()  # Otra carga simultánea terminó antes
+        return
+    global_state.store, global_state.data = store, data
+    for component in (log_pipeline, fivem_status, ban_expiry, announcements, jobs):
+        component.load()
+metrics.gauge('bot_persistence_pending', lambda: persistence.pending)
+
+# ==================== PLANIFICADOR DE PETICIONES A DISCORD ====================
+# Las llamadas REST que no son respuestas a interacciones pasan por una cola con
+# prioridad y un límite de concurrencia por ruta. Las respuestas/followups de
+# interacciones no se encolan nunca (van por el webhook de la interacción y son
+# lo primero); los logs se encolan en segundo plano sin que el comando espere.
+PRIORITY_NORMAL = 1  # Canales y mensajes que el usuario está esperando
+PRIORITY_BACKGROUND = 2  # Logs, transcripts y demás trabajo no crítico
+OUTBOUND_WORKERS = 8
+ROUTE_LIMITS = {
+    'channel_create': 5,  # Creación de canales (tickets, /setup)
+    'message': 4,  # Mensajes en canales de tickets
+    'announce': 5,  # Anuncios: envíos a la vez (cada uno a un canal distinto)
+    'log': 1,  # Canal de logs: en orden y sin ráfagas
+    'status': 2,  # Ediciones del mensaje de estado FiveM
+}
+DEFAULT_ROUTE_LIMIT = 4
+
+class OutboundScheduler:
+    def __init__(self, workers, route_limits):
+        self.workers = workers
+        self._route_limits = dict(route_limits)
+        self._routes = {}  # ruta -> heap de peticiones esperando hueco en su ruta
+        self._in_flight = {}  # ruta -> peticiones despachadas y aún sin terminar
+        self._ready = asyncio.PriorityQueue()  # Peticiones que ya tienen hueco en su ruta
+        self._seq = itertools.count()  # Desempate FIFO dentro de la misma prioridad
+        self._unfinished = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = []
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    @property
+    def pending(self):
+        return sum(len(queue) for queue in self._routes.values()) + self._ready.qsize()
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(), name=f'outbound-{i}') for i in range(self.workers)]
+
+    async def stop(self, timeout=10):
+        # Dar tiempo a que salgan los logs pendientes antes de cerrar
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f'⚠️ {self.pending} peticiones pendientes descartadas al cerrar')
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # factory es una función que devuelve la corutina (p. ej. lambda: canal.send(...))
+    def submit(self, route, factory, priority=PRIORITY_BACKGROUND):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._routes.setdefault(route, []), (priority, next(self._seq), factory, future))
+        self._unfinished += 1
+        self._idle.clear()
+        self._dispatch(route)
+        return future
+
+    async def run(self, route, factory, priority=PRIORITY_NORMAL):
+        with metrics.phase('rest'):
+            return await self.submit(route, factory, priority)
+
+    # Solo pasa a los workers lo que cabe en el límite de su ruta, así un worker
+    # nunca se queda bloqueado en una ruta saturada mientras las demás esperan
+    def _dispatch(self, route):
+        queue = self._routes.get(route)
+        limit = self._route_limits.get(route, DEFAULT_ROUTE_LIMIT)
+        while queue and self._in_flight.get(route, 0) < limit:
+            priority, seq, factory, future = heapq.heappop(queue)
+            self._in_flight[route] = self._in_flight.get(route, 0) + 1
+            item = (priority, seq, route, factory, future)
+            if self.running:
+                self._ready.put_nowait(item)
+            else:
+                # Sin workers (arranque, scripts): ejecutar directamente
+                asyncio.ensure_future(self._execute(item))
+
+    async def _execute(self, item):
+        priority, _, route, factory, future = item
+        start = time.perf_counter()
+        try:
+            result = await factory()
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            if priority == PRIORITY_BACKGROUND and not future.cancelled():
+                # Nadie espera estas peticiones: evitar "exception never retrieved"
+                future.exception()
+                print(f'❌ Error en petición en segundo plano ({route}): {e}')
+        else:
+            if not future.done():
+                future.set_result(result)
+        finally:
+            metrics.observe('bot_rest_seconds', time.perf_counter() - start, route=route)
+            self._in_flight[route] -= 1
+            self._unfinished -= 1
+            if not self._unfinished:
+                self._idle.set()
+            # Hueco libre: despachar la siguiente petición de esta ruta
+            self._dispatch(route)
+
+    async def _worker(self):
+        while True:
+            item = await self._ready.get()
+            await self._execute(item)
+
+outbound = OutboundScheduler(OUTBOUND_WORKERS, ROUTE_LIMITS)
+metrics.gauge('bot_outbound_queue_depth', lambda: outbound.pending)
+
+# ==================== REGISTRO DE ACCIONES (LOGS) ====================
+# log_action solo encola el evento (persistido en la partición global, en
+# 'pending_logs', para sobrevivir a reinicios). Una tarea agrupa varios eventos en un solo embed y
+# lo envía al llenarse el lote o al pasar LOG_BATCH_DELAY segundos. Si la cola
+# está llena, log_action espera a que haya sitio.
+LOG_BATCH_SIZE = 10  # Eventos por embed (Discord admite hasta 25 campos)
+LOG_BATCH_DELAY = 5  # Segundos máximos que un evento espera a completar lote
+LOG_QUEUE_MAX = 500
+LOG_RETRY_MAX = 300  # Espera máxima entre reintentos si Discord falla
+EMBED_FIELD_LIMIT = 1024
+EMBED_TOTAL_LIMIT = 6000
+
+class LogPipeline:
+    def __init__(self, state):
+        self.state = state
+        self._pending = None  # id -> evento; se enlaza al cargar el estado global (load)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Condition()
+        self._task = None
+
+    def load(self):
+        self._pending = self.state.data.setdefault('pending_logs', {})
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def start(self):
+        if self._pending:
+            print(f'📋 {len(self._pending)} logs pendientes de la sesión anterior')
+            self._wakeup.set()
+        if not self._task:
+            self._task = asyncio.create_task(self._run(), name='log-pipeline')
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Último intento; lo que no salga queda guardado para el siguiente arranque
+        try:
+            await self._drain()
+        except Exception as e:
+            print(f'⚠️ Logs pendientes sin enviar al cerrar: {len(self._pending)} ({e})')
+
+    async def enqueue(self, guild_id, accion, descripcion):
+        async with self._space:
+            await self._space.wait_for(lambda: len(self._pending) < LOG_QUEUE_MAX)
+        event_id = f'{time.time_ns()}-{next(self._seq)}'
+        self._pending[event_id] = {
+            'guild_id': guild_id,
+            'accion': accion,
+            'descripcion': descripcion[:EMBED_FIELD_LIMIT - 32],
+            'at': int(datetime.now().timestamp())
+        }
+        save_data(self.state, ('pending_logs', event_id))
+        self._wakeup.set()
+
+    # Eventos que venían en los datos de un servidor (formato anterior)
+    def adopt(self, events):
+        self._pending.update(events)
+        save_data(self.state, *[('pending_logs', event_id) for event_id in events])
+        self._wakeup.set()
+
+    async def _run(self):
+        # Sin caché de servidores no se distingue un canal borrado de uno aún no cargado
+        await bot.wait_until_ready()
+        loop = asyncio.get_running_loop()
+        retry_delay = LOG_BATCH_DELAY
+        while True:
+            await self._wakeup.wait()
+            deadline = loop.time() + LOG_BATCH_DELAY
+            while len(self._pending) < LOG_BATCH_SIZE:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+            self._wakeup.clear()
+            
+            try:
+                await self._drain()
+                retry_delay = LOG_BATCH_DELAY
+            except Exception as e:
+                print(f'❌ Error al enviar logs (reintento en {retry_delay}s): {e}')
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, LOG_RETRY_MAX)
+                self._wakeup.set()
+
+    def _next_batch(self):
+        # Eventos consecutivos del mismo servidor que caben en un embed
+        batch = []
+        size = 0
+        guild_id = None
+        for event_id, event in self._pending.items():
+            if guild_id is None:
+                guild_id = event['guild_id']
+            elif event['guild_id'] != guild_id:
+                continue
+            event_size = len(event['accion']) + len(event['descripcion']) + 32
+            if batch and (len(batch) >= LOG_BATCH_SIZE or size + event_size > EMBED_TOTAL_LIMIT - 200):
+                break
+            batch.append((event_id, event))
+            size += event_size
+        return guild_id, batch
+
+    async def _drain(self):
+        while self._pending:
+            guild_id, batch = self._next_batch()
+            channel = await self._logs_channel(guild_id)
+            if channel:
+                try:
+                    await outbound.run('log', lambda: channel.send(embed=self._build_embed(batch)), PRIORITY_BACKGROUND)
+                except (discord.Forbidden, discord.NotFound) as e:
+                    # Reintentar no va a arreglar permisos ni un canal borrado
+                    print(f'❌ Logs descartados, no se puede escribir en el canal de logs: {e}')
+            
+            # Enviados, o sin canal de logs (no configurado o borrado): no hay a dónde enviarlos.
+            # Si el canal aún no se pudo resolver, _logs_channel lanza y el lote se reintenta.
+            for event_id, _ in batch:
+                del self._pending[event_id]
+            save_data(self.state, *[('pending_logs', event_id) for event_id, _ in batch])
+            async with self._space:
+                self._space.notify_all()
+
+    async def _logs_channel(self, guild_id):
+        guild = bot.get_guild(guild_id)
+        if not guild:
+            if not bot.is_ready():
+                raise RuntimeError(f'servidor {guild_id} aún no cargado')
+            # El bot ya no está en el servidor
+            return None
+        if guild.unavailable:
+            raise RuntimeError(f'servidor {guild_id} no disponible')
+        state = await guild_states.get(guild_id)
+        channel_id = state.config['logs_channel_id']
+        if not channel_id:
+            return None
+        channel = guild.get_channel(channel_id)
+        if channel:
+            return channel
+        
+        # Fuera de caché no significa borrado: solo un 404 lo confirma
+        try:
+            return await outbound.run('log', lambda: guild.fetch_channel(channel_id), PRIORITY_BACKGROUND)
+        except (discord.Forbidden, discord.NotFound) as e:
+            print(f'❌ Canal de logs {channel_id} inaccesible en {guild.name}: {e}')
+            return None
+
+    def _build_embed(self, batch):
+        if len(batch) == 1:
+            event = batch[0][1]
+            return discord.Embed(
+                title=f"📋 {event['accion']}",
+                description=event['descripcion'],
+                color=discord.Color.orange(),
+                timestamp=datetime.fromtimestamp(event['at'])
+            )
+        
+        embed = discord.Embed(
+            title=f"📋 Registro de acciones ({len(batch)})",
+            color=discord.Color.orange(),
+            timestamp=datetime.now()
+        )
+        for _, event in batch:
+            embed.add_field(name=event['accion'][:256], value=f"{event['descripcion']}\n<t:{event['at']}:T>", inline=False)
+        return embed
+
+log_pipeline = LogPipeline(global_state)
+metrics.gauge('bot_log_queue_depth', lambda: log_pipeline.pending)
+
+async def log_action(guild: discord.Guild, accion: str, descripcion: str):
+    if not guild:
+        return
+    with metrics.phase('log'):
+        state = await guild_states.get(guild.id)
+        if not state.config['logs_channel_id']:
+            return
+        
+        await log_pipeline.enqueue(guild.id, accion, descripcion)
+
+# ==================== ÍNDICES EN MEMORIA ====================
+# Los tickets de cada servidor están en su partición; el índice mantiene solo lo
+# abierto para que comprobar o contar tickets no dependa de su tamaño. Se
+# actualiza al crear/cerrar y se reconstruye al cargar.
+class TicketIndex:
+    def __init__(self, state):
+        self.state = state
+        self.tickets = state.data['tickets']  # id de canal (str) -> ticket
+        self.open_by_user = {}  # user_id -> id de canal del ticket abierto
+        self.open_by_type = {}  # tipo -> nº de tickets abiertos
+        self.archived_cache = OrderedDict()  # channel_id -> ticket archivado (LRU)
+        self.rebuild()
+
+    def rebuild(self):
+        self.open_by_user.clear()
+        self.open_by_type.clear()
+        for key, ticket in self.tickets.items():
+            if ticket.get('open', False):
+                self.add(key, ticket)
+
+    def add(self, key, ticket):
+        self.open_by_user[ticket['user_id']] = key
+        self.open_by_type[ticket['type']] = self.open_by_type.get(ticket['type'], 0) + 1
+
+    def remove(self, key, ticket):
+        if self.open_by_user.get(ticket['user_id']) == key:
+            del self.open_by_user[ticket['user_id']]
+        if self.open_by_type.get(ticket['type'], 0) > 0:
+            self.open_by_type[ticket['type']] -= 1
+
+    def by_channel(self, channel_id):
+        return self.tickets.get(str(channel_id))
+
+    # Busca también en el archivo (con caché) si el ticket ya no está en memoria
+    async def lookup(self, channel_id):
+        ticket = self.by_channel(channel_id)
+        if ticket:
+            return ticket
+        if channel_id in self.archived_cache:
+            self.archived_cache.move_to_end(channel_id)
+            return self.archived_cache[channel_id]
+        ticket = await persistence.find_archived(self.state, channel_id)
+        if ticket:
+            self.archived_cache[channel_id] = ticket
+            if len(self.archived_cache) > ARCHIVE_LOOKUP_CACHE:
+                self.archived_cache.popitem(last=False)
+        return ticket
+
+    def open_ticket_for(self, user_id):
+        key = self.open_by_user.get(user_id)
+        return self.tickets.get(key) if key else None
+
+    @property
+    def open_count(self):
+        return len(self.open_by_user)
+
+# Índice de los baneos de un servidor para /bans: lista ordenada por fecha
+# (páginas por cursor con bisect, sin copiar la tabla), conjuntos por staff y
+# un índice de trigramas sobre usuario y razón para buscar subcadenas. Los
+# trigramas son lo más caro de construir: se crean en la primera búsqueda.
+class BanIndex:
+    def __init__(self, bans):
+        self.bans = bans  # user_id -> baneo (mismo dict que la partición)
+        self.by_time = []  # (banned_at, user_id) de más antiguo a más reciente
+        self.by_staff = {}  # banned_by -> {user_id}
+        self.trigrams = None  # trigrama -> {user_id}; None hasta la primera búsqueda
+        self.rebuild()
+
+    def rebuild(self):
+        self.by_time = sorted((entry.get('banned_at') or 0, user_id) for user_id, entry in self.bans.items())
+        self.by_staff.clear()
+        self.trigrams = None
+        for user_id, entry in self.bans.items():
+            self._index_text(user_id, entry, add=True)
+
+    def _ensure_trigrams(self):
+        if self.trigrams is None:
+            self.trigrams = {}
+            for user_id, entry in self.bans.items():
+                text = self._text(entry)
+                for i in range(len(text) - 2):
+                    self.trigrams.setdefault(text[i:i + 3], set()).add(user_id)
+
+    @staticmethod
+    def _text(entry):
+        # Con marcas de inicio/fin para que los textos de 1-2 letras también tengan trigramas
+        return f"\x00{entry.get('username', '')}\x00{entry.get('razon', '')}\x00".lower()
+
+    def _index_text(self, user_id, entry, add):
+        keys = [(self.by_staff, entry.get('banned_by'))]
+        if self.trigrams is not None:
+            text = self._text(entry)
+            keys.extend((self.trigrams, text[i:i + 3]) for i in range(len(text) - 2))
+        for index, key in keys:
+            if add:
+                index.setdefault(key, set()).add(user_id)
+            elif key in index:
+                index[key].discard(user_id)
+                if not index[key]:
+                    del index[key]
+
+    def add(self, user_id, entry):
+        bisect.insort(self.by_time, (entry.get('banned_at') or 0, user_id))
+        self._index_text(user_id, entry, add=True)
+
+    def remove(self, user_id, entry):
+        key = (entry.get('banned_at') or 0, user_id)
+        pos = bisect.bisect_left(self.by_time, key)
+        if pos < len(self.by_time) and self.by_time[pos] == key:
+            del self.by_time[pos]
+        self._index_text(user_id, entry, add=False)
+
+    def staff_counts(self):
+        return sorted(((len(ids), staff) for staff, ids in self.by_staff.items() if staff), reverse=True)
+
+    # user_ids que cumplen los filtros, o None si no hay filtro (todos)
+    def matches(self, query=None, staff=None):
+        result = None
+        if staff:
+            result = set(self.by_staff.get(staff, ()))
+        if query:
+            query = query.lower()
+            self._ensure_trigrams()
+            if len(query) >= 3:
+                sets = sorted((self.trigrams.get(query[i:i + 3], set()) for i in range(len(query) - 2)), key=len)
+                candidates = set.intersection(*sets)
+            else:
+                candidates = set().union(*(ids for gram, ids in self.trigrams.items() if query in gram))
+            # Los trigramas solo preseleccionan: confirmar la subcadena completa
+            candidates = {user_id for user_id in candidates if query in self._text(self.bans[user_id])}
+            result = candidates if result is None else result & candidates
+        return result
+
+    def sorted_keys(self, user_ids):
+        return sorted((self.bans[user_id].get('banned_at') or 0, user_id) for user_id in user_ids)
+
+# Página anterior a cursor (exclusivo) en una lista ordenada de (banned_at, user_id),
+# de más reciente a más antiguo. Devuelve (claves, hay_más).
+def page_before(keys, cursor, size):
+    end = bisect.bisect_left(keys, cursor) if cursor else len(keys)
+    start = max(0, end - size)
+    return keys[start:end][::-1], start > 0
+
+# ==================== PLANTILLAS DE EMBEDS ====================
+# Las partes fijas de los embeds más usados (logo, imágenes, textos de las
+# categorías...) y las vistas se construyen una vez por versión de la config de
+# cada servidor. Los comandos que cambian esa config llaman a invalidate() y
+# cada uso solo copia la plantilla y rellena lo que cambia por llamada.
+def _embed_from_template(template):
+    data = dict(template)
+    data['fields'] = list(template.get('fields', ()))  # from_dict comparte la lista: copiarla
+    embed = discord.Embed.from_dict(data)
+    embed.timestamp = datetime.now()
+    return embed
+
+class EmbedTemplates:
+    def __init__(self, state):
+        self.state = state
+        self.version = 0
+        self._cache = {}
+
+    def invalidate(self):
+        self.version += 1
+        self._cache.clear()
+
+    def value(self, key, build):
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    # build devuelve un discord.Embed; se guarda como dict y se copia en cada uso
+    def embed(self, key, build):
+        return _embed_from_template(self.value(('embed', key), lambda: build().to_dict()))
+
+    def view(self, key, build):
+        return self.value(('view', key), build)
+
+def _build_status_template(config, online):
+    if online:
+        embed = discord.Embed(title="🟢 SERVIDOR ONLINE", color=discord.Color.green())
+        embed.add_field(name="📡 Estado", value="✅ Online", inline=True)
+        image = config['server_online_image']
+    else:
+        embed = discord.Embed(title="🔴 SERVIDOR OFFLINE", color=discord.Color.red())
+        embed.add_field(name="📡 Estado", value="❌ Offline", inline=True)
+        image = config['server_offline_image']
+    if config['server_logo']:
+        embed.set_thumbnail(url=config['server_logo'])
+    if image:
+        embed.set_image(url=image)
+    return embed
+
+def _build_ticket_panel_template(config):
+    categories = config['ticket_categories']
+    as_buttons = len(categories) <= TICKET_BUTTONS_MAX
+    lines = ["**Bienvenido al sistema de soporte**\n",
+             "Selecciona el tipo de ticket que necesitas " + ("haciendo clic en uno de los botones de abajo:\n" if as_buttons else "en el menú de abajo:\n")]
+    for info in categories.values():
+        lines.append(f"{info['emoji']} **{_category_label(info)}**\n{info['description']}\n")
+    embed = discord.Embed(title="🎫 Sistema de Tickets", description="\n".join(lines).rstrip()[:4096], color=discord.Color.blue())
+    if config['server_logo']:
+        embed.set_thumbnail(url=config['server_logo'])
+    embed.set_footer(text="Haz clic en un botón para abrir tu ticket" if as_buttons else "Elige una opción del menú para abrir tu ticket")
+    return embed
+
+# La descripción de bienvenida se completa por ticket (saludo y fecha)
+def _build_ticket_welcome_template(config, ticket_type):
+    ticket_info = config['ticket_categories'][ticket_type]
+    embed = discord.Embed(
+        description=f"**Categoría:** {ticket_info['name']}\n"
+                    f"**Descripción:** {ticket_info['description']}\n",
+        color=discord.Color.blue()
+    )
+    if config['server_logo']:
+        embed.set_thumbnail(url=config['server_logo'])
+    return embed
+
+# ==================== ESTADO POR SERVIDOR ====================
+# Cada servidor de Discord tiene su propia partición (config, tickets, baneos...),
+# que se carga la primera vez que se usa y se descarga tras GUILD_IDLE_TIMEOUT
+# segundos sin actividad. Así varias comunidades comparten proceso sin pisarse.
+GUILD_IDLE_TIMEOUT = 1800
+GUILD_EVICT_INTERVAL = 300
+GUILD_EVICT_BUSY_WAIT = 60  # Segundos máximos esperando a tickets o trabajos en curso antes de descargar
+
+class GuildState(Partition):
+    def __init__(self, guild_id, store, data):
+        super().__init__(str(guild_id), store, data)
+        self.guild_id = guild_id
+        self.index = TicketIndex(self)
+        self._bans = None
+        self._bans_lock = asyncio.Lock()
+        self.allocator = TicketAllocator(self)
+        self.templates = EmbedTemplates(self)
+        self.last_used = time.monotonic()
+
+    @property
+    def config(self):
+        return self.data['config']
+
+    # Al cargar el servidor no se leen los baneos: la primera vez que algo los
+    # necesita se piden al almacén (en el hilo de persistencia). set_ban,
+    # remove_ban y el índice requieren haber esperado antes a load_bans().
+    @property
+    def bans_loaded(self):
+        return 'banned_users' in self.data
+
+    async def load_bans(self):
+        async with self._bans_lock:
+            if not self.bans_loaded:
+                self.data['banned_users'] = await persistence.run_io(self.store.load_bans)
+            if not self.ban_expiry_backfilled:
+                self._backfill_ban_expiry()
+        return self.data['banned_users']
+
+    @property
+    def ban_expiry_backfilled(self):
+        return bool(self.config.get('ban_expiry_backfilled'))
+
+    # Una sola vez por servidor: los baneos de antes de la expiración automática
+    # solo guardaban la duración como texto ("7d", "2 semanas"). Se les calcula
+    # el expires_at desde banned_at; los permanentes se dejan y los que no se
+    # pueden interpretar se avisan y se quedan como estaban.
+    def _backfill_ban_expiry(self):
+        updated = []
+        skipped = []
+        for user_id, entry in self.data['banned_users'].items():
+            if entry.get('expires_at'):
+                continue
+            try:
+                seconds = parse_duration(entry.get('duracion') or '')
+            except ValueError:
+                skipped.append((user_id, entry.get('duracion')))
+                continue
+            if not seconds:
+                continue
+            if not entry.get('banned_at'):
+                skipped.append((user_id, entry.get('duracion')))
+                continue
+            entry['expires_at'] = entry['banned_at'] + seconds
+            updated.append(user_id)
+            ban_expiry.track(self, user_id, entry)
+        self.config['ban_expiry_backfilled'] = True
+        save_data(self, ('config', 'ban_expiry_backfilled'), *[('banned_users', user_id) for user_id in updated])
+        if updated or skipped:
+            print(f'⏳ Servidor {self.guild_id}: {len(updated)} baneos antiguos con expiración calculada, {len(skipped)} sin duración válida')
+        for user_id, duracion in skipped[:20]:
+            print(f'   ⚠️ Baneo de {user_id} sin expiración: duración {duracion!r} no válida o sin fecha de baneo')
+
+    # [(user_id, expires_at)] de los baneos temporales; sin cargar el resto si aún no lo están
+    async def temporary_bans(self):
+        if self.bans_loaded:
+            return [(user_id, entry['expires_at']) for user_id, entry in self.data['banned_users'].items() if entry.get('expires_at')]
+        return await persistence.run_io(self.store.temporary_bans)
+
+    # El índice de baneos se construye cuando algo lo consulta (/bans)
+    @property
+    def bans(self):
+        if self._bans is None:
+            self._bans = BanIndex(self.data['banned_users'])
+        return self._bans
+
+    # Alta o cambio de un baneo con sus índices (guardar aparte con save_data)
+    def set_ban(self, user_id, entry):
+        old = self.data['banned_users'].get(user_id)
+        if old and self._bans is not None:
+            self._bans.remove(user_id, old)
+        self.data['banned_users'][user_id] = entry
+        if self._bans is not None:
+            self._bans.add(user_id, entry)
+        ban_expiry.track(self, user_id, entry)
+
+    def remove_ban(self, user_id):
+        entry = self.data['banned_users'].pop(user_id, None)
+        if entry and self._bans is not None:
+            self._bans.remove(user_id, entry)
+        return entry
+
+    # Cambio escrito por otro proceso del clúster (value None: ya no existe)
+    def apply_remote(self, path, value):
+        key = path[-1]
+        if path[0] == 'banned_users':
+            if not self.bans_loaded:
+                return  # Se leerán ya actualizados al cargarlos
+            if value is None:
+                self.remove_ban(key)
+            else:
+                self.set_ban(key, value)
+            return
+        if path[0] == 'config':
+            self.templates.invalidate()
+        if path[0] == 'tickets' and key in self.data['tickets']:
+            self.index.remove(key, self.data['tickets'][key])
+        _apply_record(self.data, {'op': 'del' if value is None else 'set', 'path': list(path), 'value': value})
+        if path[0] == 'tickets' and value is not None:
+            self.index.add(key, value)
+
+    # Tickets creándose o trabajos pendientes: no se puede descargar
+    @property
+    def busy(self):
+        return self.allocator.active or jobs.has_guild(self.guild_id)
+
+class GuildStates:
+    def __init__(self):
+        self._states = {}  # guild_id -> GuildState
+        self._loading = {}  # guild_id -> tarea de carga (varias peticiones esperan a la misma)
+        self._legacy_settled = False
+        self._task = None
+
+    def loaded(self):
+        return list(self._states.values())
+
+    # Solo si ya está en memoria (sin cargarla)
+    def peek(self, guild_id):
+        return self._states.get(guild_id)
+
+    async def get(self, guild_id):
+        state = self._states.get(guild_id)
+        if state is None:
+            task = self._loading.get(guild_id)
+            if task is None:
+                task = asyncio.create_task(self._load(guild_id), name=f'guild-load-{guild_id}')
+                self._loading[guild_id] = task
+                task.add_done_callback(lambda _: self._loading.pop(guild_id, None))
+            state = await asyncio.shield(task)
+        state.last_used = time.monotonic()
+        return state
+
+    # Los datos anteriores al modo multi-servidor los hereda la partición de su
+    # servidor al crearse. Hay que saber cuál es antes de crear ninguna: si se
+    # creara vacía (p. ej. una petición a la API antes de on_ready), esos datos
+    # quedarían huérfanos para siempre.
+    async def _settle_legacy(self):
+        global legacy_owner
+        if self._legacy_settled or legacy_owner is not None:
+            return
+        if not await persistence.run_io(storage.legacy_pending):
+            self._legacy_settled = True
+            return
+        if not CLUSTER_ID:
+            await bot.wait_until_ready()
+            if legacy_owner is None and len(bot.guilds) == 1:
+                legacy_owner = str(bot.guilds[0].id)
+            if legacy_owner is not None:
+                self._legacy_settled = True
+                return
+        # En modo clúster cada proceso solo ve parte de los servidores
+        raise RuntimeError('Hay datos anteriores al modo multi-servidor sin asignar: indica su servidor con LEGACY_GUILD_ID')
+
+    async def _load(self, guild_id):
+        await load_global_state()  # Recibe las colas compartidas de la partición heredada
+        await self._settle_legacy()
+        store = storage.open_partition(str(guild_id), default_data)
+        data = await persistence.run_io(store.load)
+        state = GuildState(guild_id, store, data)
+        
+        # Colas compartidas que venían en el data.json anterior: pasan a la partición global
+        legacy = {top: data.pop(top) for top in ('pending_logs', 'jobs') if top in data}
+        if legacy:
+            log_pipeline.adopt(legacy.get('pending_logs', {}))
+            jobs.adopt(legacy.get('jobs', {}))
+            save_data(state, *[(top,) for top in legacy])
+        
+        for key, ticket in data['tickets'].items():
+            # Cierre interrumpido antes de llegar a encolar el trabajo
+            if ticket.get('closing') and not jobs.has(ticket['closing']):
+                del ticket['closing']
+                save_data(state, ('tickets', key))
+        
+        ban_expiry.watch_guild(state)
+        self._states[guild_id] = state
+        return state
+
+    async def evict(self, guild_id):
+        state = self._states.get(guild_id)
+        if state is None:
+            return
+        # Quien está creando un ticket o ejecutando un trabajo tiene este objeto y
+        # seguiría escribiendo en él: esperar a que termine (con un límite)
+        deadline = time.monotonic() + GUILD_EVICT_BUSY_WAIT
+        while state.busy and time.monotonic() < deadline:
+            await asyncio.sleep(1)
+        if self._states.get(guild_id) is not state:
+            return  # Otra descarga se adelantó
+        del self._states[guild_id]
+        await persistence.close_partition(state)
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._evict_idle(), name='guild-evict')
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _evict_idle(self):
+        while True:
+            await asyncio.sleep(GUILD_EVICT_INTERVAL)
+            limit = time.monotonic() - GUILD_IDLE_TIMEOUT
+            for guild_id, state in list(self._states.items()):
+                if state.last_used < limit and not state.busy:
+                    await self.evict(guild_id)
+
+    # Tras el último flush: cerrar los almacenes de todas las particiones
+    def close(self):
+        for state in self._states.values():
+            state.store.close()
+        self._states.clear()
+        if global_state.store is not None:
+            global_state.store.close()
+
+guild_states = GuildStates()
+metrics.gauge('bot_guild_states_loaded', lambda: len(guild_states.loaded()))
+
+@bot.event
+async def setup_hook():
+    await load_global_state()
+    await metrics.start()
+    persistence.start()
+    outbound.start()
+    log_pipeline.start()
+    jobs.start()
+    guild_states.start()
+    ban_expiry.start()
+    announcements.start()
+    fivem_status.start()
+    if CLUSTER_ID:
+        change_watcher.start()
+    # En clúster la API la sirve solo el primer proceso (los demás ven sus cambios igual)
+    if BAN_API_TOKEN and CLUSTER_ID in (None, '0'):
+        await ban_api.start()
+    
+    # setup_hook corre una vez por proceso; on_ready se repite en cada reconexión.
+    # Registrar las vistas persistentes (los paneles de tickets van por on_interaction)
+    bot.add_view(CloseTicketView())
+    # En clúster sincroniza solo el primer proceso: el árbol es el mismo en todos.
+    # Va en segundo plano para que la conexión al gateway no espere a la API REST.
+    if CLUSTER_ID in (None, '0'):
+        task = asyncio.create_task(sync_commands(), name='command-sync')
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
 
 @bot.event
 async def on_ready():
@@ -77,17 +2046,65 @@ async def on_ready():
     print(f'ID: {bot.user.id}')
     print('------')
     
-    # Registrar las vistas persistentes
-    bot.add_view(TicketButtonView())
-    bot.add_view(CloseTicketView())
+    await bot.change_presence(activity=discord.Game(name="FiveM Server"))
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    started_at = interaction.extras.get('started_at')
+    if started_at is not None:
+        metrics.record_command(command.qualified_name, time.perf_counter() - started_at, 'ok')
+
+@bot.event
+async def on_guild_remove(guild):
+    await guild_states.evict(guild.id)
+
+# ==================== SINCRONIZACIÓN DE COMANDOS ====================
+# Subir el árbol entero en cada arranque o reconexión choca con el límite de
+# sincronizaciones de Discord. Se guarda en el estado global un hash estable del
+# árbol (nombres, opciones, choices, permisos) por ámbito y solo se sincronizan
+# los ámbitos (global o servidor con comandos propios) cuyo hash ha cambiado.
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC') == '1'
+background_tasks = set()  # Referencias a tareas sueltas para que no las recoja el GC
+
+def command_tree_hash(guild=None):
+    payload = sorted(
+        (command.to_dict(bot.tree) for command in bot.tree.get_commands(guild=guild)),
+        key=lambda c: (c.get('type', 1), c['name'])
+    )
+    if not payload:
+        return None
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+async def sync_commands():
+    synced_hashes = global_state.data.setdefault('command_sync', {})
+    # discord.py no expone qué servidores tienen comandos propios: se miran los
+    # registrados en el árbol y los que se sincronizaron antes (por si se quitaron)
+    guild_ids = set(getattr(bot.tree, '_guild_commands', {})) | {int(key) for key in synced_hashes if key != 'global'}
+    scopes = [None] + [discord.Object(id=guild_id) for guild_id in sorted(guild_ids)]
     
-    try:
-        synced = await bot.tree.sync()
-        print(f'✅ {len(synced)} comandos sincronizados')
-    except Exception as e:
-        print(f'❌ Error al sincronizar comandos: {e}')
+    changed = 0
+    for guild in scopes:
+        key = 'global' if guild is None else str(guild.id)
+        digest = command_tree_hash(guild)
+        if digest == synced_hashes.get(key) and not FORCE_COMMAND_SYNC:
+            continue
+        if digest is None and key not in synced_hashes:
+            continue
+        try:
+            synced = await bot.tree.sync(guild=guild)
+        except discord.HTTPException as e:
+            print(f'❌ Error al sincronizar comandos ({key}): {e}')
+            continue
+        if digest is None:
+            del synced_hashes[key]
+        else:
+            synced_hashes[key] = digest
+        save_data(global_state, ('command_sync', key))
+        changed += 1
+        print(f'✅ {len(synced)} comandos sincronizados ({key})')
     
-    await bot.change_presence(activity=discord.Game(name="FiveM Server"))
+    if not changed:
+        print('✅ Comandos sin cambios, no hace falta sincronizar')
 
 # ==================== COMANDOS DE CONFIGURACIÓN ====================
 
@@ -98,35 +2115,34 @@ async def setup(interaction: discord.Interaction):
     
     try:
         guild = interaction.guild
+        state = await guild_states.get(guild.id)
         
-        # Crear canal de logs
-        logs_channel = await guild.create_text_channel(
-            name="📋-logs",
-            overwrites={
-                guild.default_role: discord.PermissionOverwrite(view_channel=False)
-            }
-        )
-        
-        # Crear canal de actualizaciones
-        updates_channel = await guild.create_text_channel(
-            name="📢-actualizaciones",
-            overwrites={
-                guild.default_role: discord.PermissionOverwrite(send_messages=False)
-            }
-        )
-        
-        # Crear canal de transcripts
-        transcript_channel = await guild.create_text_channel(
-            name="📄-transcripts",
-            overwrites={
-                guild.default_role: discord.PermissionOverwrite(view_channel=False)
-            }
+        # Crear los canales de logs, actualizaciones y transcripts en paralelo
+        logs_channel, updates_channel, transcript_channel = await asyncio.gather(
+            outbound.run('channel_create', lambda: guild.create_text_channel(
+                name="📋-logs",
+                overwrites={
+                    guild.default_role: discord.PermissionOverwrite(view_channel=False)
+                }
+            )),
+            outbound.run('channel_create', lambda: guild.create_text_channel(
+                name="📢-actualizaciones",
+                overwrites={
+                    guild.default_role: discord.PermissionOverwrite(send_messages=False)
+                }
+            )),
+            outbound.run('channel_create', lambda: guild.create_text_channel(
+                name="📄-transcripts",
+                overwrites={
+                    guild.default_role: discord.PermissionOverwrite(view_channel=False)
+                }
+            ))
         )
         
-        bot_data['config']['logs_channel_id'] = logs_channel.id
-        bot_data['config']['updates_channel_id'] = updates_channel.id
-        bot_data['config']['transcript_channel_id'] = transcript_channel.id
-        save_data(bot_data)
+        state.config['logs_channel_id'] = logs_channel.id
+        state.config['updates_channel_id'] = updates_channel.id
+        state.config['transcript_channel_id'] = transcript_channel.id
+        save_data(state, ('config', 'logs_channel_id'), ('config', 'updates_channel_id'), ('config', 'transcript_channel_id'))
         
         embed = discord.Embed(
             title="✅ Setup Básico Completado",
@@ -144,15 +2160,23 @@ async def setup(interaction: discord.Interaction):
     except Exception as e:
         await interaction.followup.send(f"❌ Error al configurar: {e}", ephemeral=True)
 
+async def ticket_category_autocomplete(interaction: discord.Interaction, current: str):
+    state = await guild_states.get(interaction.guild.id)
+    current = current.lower()
+    return [
+        app_commands.Choice(name=info['name'][:100], value=tipo)
+        for tipo, info in state.config['ticket_categories'].items()
+        if current in tipo or current in info['name'].lower()
+    ][:25]
+
 @bot.tree.command(name="setupcategory", description="Configura la categoría para un tipo de ticket")
 @app_commands.checks.has_permissions(administrator=True)
-@app_commands.choices(tipo=[
-    app_commands.Choice(name="🛠️ Soporte Técnico", value="soporte"),
-    app_commands.Choice(name="💰 Donaciones", value="donaciones"),
-    app_commands.Choice(name="🎁 Gangas", value="gangas"),
-    app_commands.Choice(name="🚨 Reporte a Jugador", value="reporte")
-])
+@app_commands.autocomplete(tipo=ticket_category_autocomplete)
 async def setupcategory(interaction: discord.Interaction, tipo: str, category_id: str):
+    state = await guild_states.get(interaction.guild.id)
+    if tipo not in state.config['ticket_categories']:
+        await interaction.response.send_message("❌ Ese tipo de ticket no existe. Usa `/addcategory` para crearlo.", ephemeral=True)
+        return
     try:
         category_id_int = int(category_id)
         category = interaction.guild.get_channel(category_id_int)
@@ -161,10 +2185,11 @@ async def setupcategory(interaction: discord.Interaction, tipo: str, category_id
             await interaction.response.send_message("❌ ID de categoría inválido. Asegúrate de que sea una categoría válida.", ephemeral=True)
             return
         
-        bot_data['config']['ticket_categories'][tipo]['category_id'] = category_id_int
-        save_data(bot_data)
+        state.config['ticket_categories'][tipo]['category_id'] = category_id_int
+        save_data(state, ('config', 'ticket_categories', tipo))
+        state.templates.invalidate()
         
-        ticket_info = bot_data['config']['ticket_categories'][tipo]
+        ticket_info = state.config['ticket_categories'][tipo]
         
         embed = discord.Embed(
             title="✅ Categoría Configurada",
@@ -179,11 +2204,76 @@ async def setupcategory(interaction: discord.Interaction, tipo: str, category_id
     except ValueError:
         await interaction.response.send_message("❌ ID inválido. Debe ser un número.", ephemeral=True)
 
+@bot.tree.command(name="addcategory", description="Añade un nuevo tipo de ticket")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.choices(estilo=[
+    app_commands.Choice(name="Azul", value="primary"),
+    app_commands.Choice(name="Verde", value="success"),
+    app_commands.Choice(name="Gris", value="secondary"),
+    app_commands.Choice(name="Rojo", value="danger")
+])
+async def addcategory(interaction: discord.Interaction, tipo: str, nombre: str, emoji: str, descripcion: str, estilo: str = "primary"):
+    state = await guild_states.get(interaction.guild.id)
+    categories = state.config['ticket_categories']
+    tipo = tipo.lower()
+    if not TICKET_TYPE_RE.fullmatch(tipo):
+        await interaction.response.send_message("❌ El tipo solo puede tener letras minúsculas, números, `-` y `_` (máx. 32).", ephemeral=True)
+        return
+    if tipo in categories:
+        await interaction.response.send_message("❌ Ese tipo de ticket ya existe.", ephemeral=True)
+        return
+    emoji = parse_emoji(emoji)
+    if not emoji:
+        await interaction.response.send_message("❌ El emoji debe ser un único emoji Unicode o uno personalizado del servidor (`<:nombre:id>`).", ephemeral=True)
+        return
+    if len(categories) >= TICKET_SELECT_MAX:
+        await interaction.response.send_message(f"❌ No se pueden tener más de {TICKET_SELECT_MAX} tipos de ticket.", ephemeral=True)
+        return
+    
+    categories[tipo] = {
+        'name': f"{emoji} {nombre}",
+        'description': descripcion,
+        'emoji': emoji,
+        'style': estilo,
+        'category_id': None
+    }
+    save_data(state, ('config', 'ticket_categories', tipo))
+    state.templates.invalidate()
+    
+    embed = discord.Embed(
+        title="✅ Tipo de Ticket Añadido",
+        description=f"{emoji} **{nombre}**\nUsa `/setupcategory` para elegir dónde se abrirá y vuelve a enviar el panel con `/ticketpanel`.",
+        color=discord.Color.green(),
+        timestamp=datetime.now()
+    )
+    embed.add_field(name="📝 Descripción", value=descripcion, inline=False)
+    embed.add_field(name="🆔 Tipo", value=f"`{tipo}`", inline=True)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="removecategory", description="Elimina un tipo de ticket")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.autocomplete(tipo=ticket_category_autocomplete)
+async def removecategory(interaction: discord.Interaction, tipo: str):
+    state = await guild_states.get(interaction.guild.id)
+    categories = state.config['ticket_categories']
+    if tipo not in categories:
+        await interaction.response.send_message("❌ Ese tipo de ticket no existe.", ephemeral=True)
+        return
+    if state.index.open_by_type.get(tipo, 0) > 0:
+        await interaction.response.send_message("❌ Hay tickets abiertos de ese tipo. Ciérralos antes de eliminarlo.", ephemeral=True)
+        return
+    
+    info = categories.pop(tipo)
+    save_data(state, ('config', 'ticket_categories', tipo))
+    state.templates.invalidate()
+    await interaction.response.send_message(f"✅ Tipo de ticket **{info['name']}** eliminado. Vuelve a enviar el panel con `/ticketpanel`.", ephemeral=True)
+
 @bot.tree.command(name="setpanelchannel", description="Establece el canal donde se enviará el panel de tickets")
 @app_commands.checks.has_permissions(administrator=True)
 async def setpanelchannel(interaction: discord.Interaction, canal: discord.TextChannel):
-    bot_data['config']['ticket_panel_channel_id'] = canal.id
-    save_data(bot_data)
+    state = await guild_states.get(interaction.guild.id)
+    state.config['ticket_panel_channel_id'] = canal.id
+    save_data(state, ('config', 'ticket_panel_channel_id'))
     
     embed = discord.Embed(
         title="✅ Canal de Panel Configurado",
@@ -197,8 +2287,10 @@ async def setpanelchannel(interaction: discord.Interaction, canal: discord.TextC
 @bot.tree.command(name="setupstaff", description="Establece el rol de staff")
 @app_commands.checks.has_permissions(administrator=True)
 async def setupstaff(interaction: discord.Interaction, rol: discord.Role):
-    bot_data['config']['staff_role_id'] = rol.id
-    save_data(bot_data)
+    state = await guild_states.get(interaction.guild.id)
+    state.config['staff_role_id'] = rol.id
+    save_data(state, ('config', 'staff_role_id'))
+    state.templates.invalidate()
     
     embed = discord.Embed(
         title="✅ Rol de Staff Configurado",
@@ -217,17 +2309,20 @@ async def setupstaff(interaction: discord.Interaction, rol: discord.Role):
     app_commands.Choice(name="Imagen Server Offline", value="offline")
 ])
 async def setimages(interaction: discord.Interaction, tipo: str, url: str):
+    state = await guild_states.get(interaction.guild.id)
     if tipo == "logo":
-        bot_data['config']['server_logo'] = url
+        clave = 'server_logo'
         nombre = "Logo del Servidor"
     elif tipo == "online":
-        bot_data['config']['server_online_image'] = url
+        clave = 'server_online_image'
         nombre = "Imagen Server Online"
     else:
-        bot_data['config']['server_offline_image'] = url
+        clave = 'server_offline_image'
         nombre = "Imagen Server Offline"
     
-    save_data(bot_data)
+    state.config[clave] = url
+    save_data(state, ('config', clave))
+    state.templates.invalidate()
     
     embed = discord.Embed(
         title="✅ Imagen Configurada",
@@ -243,239 +2338,1300 @@ async def setimages(interaction: discord.Interaction, tipo: str, url: str):
 
 @bot.tree.command(name="serverup", description="Marca el servidor como online")
 async def serverup(interaction: discord.Interaction, ip: str = None, slots: int = 32):
-    bot_data['server_status'] = 'online'
-    save_data(bot_data)
+    state = await guild_states.get(interaction.guild.id)
+    state.data['server_status'] = 'online'
+    save_data(state, ('server_status',))
     
-    embed = discord.Embed(
-        title="🟢 SERVIDOR ONLINE",
-        description="¡El servidor está ahora disponible para jugar!",
-        color=discord.Color.green(),
-        timestamp=datetime.now()
-    )
-    embed.add_field(name="📡 Estado", value="✅ Online", inline=True)
+    embed = state.templates.embed(('status', True), lambda: _build_status_template(state.config, True))
+    embed.description = "¡El servidor está ahora disponible para jugar!"
     
     if ip:
         embed.add_field(name="🌐 IP del Servidor", value=f"`{ip}`", inline=True)
     
     embed.add_field(name="👥 Slots Disponibles", value=f"`{slots}`", inline=True)
     embed.add_field(name="⏰ Actualizado", value=f"<t:{int(datetime.now().timestamp())}:R>", inline=False)
-    
-    # Añadir logo
-    if bot_data['config']['server_logo']:
-        embed.set_thumbnail(url=bot_data['config']['server_logo'])
-    
-    # Añadir imagen de servidor online
-    if bot_data['config']['server_online_image']:
-        embed.set_image(url=bot_data['config']['server_online_image'])
-    
     embed.set_footer(text=f"Actualizado por {interaction.user.name}", icon_url=interaction.user.display_avatar.url)
     
     await interaction.response.send_message(embed=embed)
+    targets = announce_targets(state, include_updates=False)
+    if targets:
+        announcements.schedule(interaction.guild.id, targets, embed, created_by=interaction.user.id)
     await log_action(interaction.guild, "Server Status", f"{interaction.user.mention} marcó el servidor como **ONLINE**")
 
 @bot.tree.command(name="serverdown", description="Marca el servidor como offline")
 async def serverdown(interaction: discord.Interaction, razon: str = "Mantenimiento programado"):
-    bot_data['server_status'] = 'offline'
-    save_data(bot_data)
+    state = await guild_states.get(interaction.guild.id)
+    state.data['server_status'] = 'offline'
+    save_data(state, ('server_status',))
+    
+    embed = state.templates.embed(('status', False), lambda: _build_status_template(state.config, False))
+    embed.description = "El servidor está actualmente en mantenimiento."
+    embed.add_field(name="📝 Razón", value=razon, inline=True)
+    embed.add_field(name="⏰ Desde", value=f"<t:{int(datetime.now().timestamp())}:R>", inline=False)
+    embed.set_footer(text=f"Actualizado por {interaction.user.name}", icon_url=interaction.user.display_avatar.url)
+    
+    await interaction.response.send_message(embed=embed)
+    targets = announce_targets(state, include_updates=False)
+    if targets:
+        announcements.schedule(interaction.guild.id, targets, embed, created_by=interaction.user.id)
+    await log_action(interaction.guild, "Server Status", f"{interaction.user.mention} marcó el servidor como **OFFLINE**\n**Razón:** {razon}")
+
+# ==================== ESTADO FIVEM EN VIVO ====================
+# Una tarea consulta /info.json y /players.json de cada servidor FiveM
+# configurado con /setstatus (sesión HTTP compartida, con timeout y espera
+# exponencial si no responde), guarda el último resultado y edita un único
+# mensaje de estado solo cuando cambia el estado o el número de jugadores.
+# Los servidores a consultar se guardan en la partición global para retomarlos
+# sin cargar todas las particiones al arrancar.
+FIVEM_POLL_INTERVAL = 30
+FIVEM_TIMEOUT = 5
+FIVEM_RETRY_BASE = 5  # Primer reintento tras un fallo; se dobla hasta FIVEM_BACKOFF_MAX
+FIVEM_BACKOFF_MAX = 300
+FIVEM_OFFLINE_AFTER = 2  # Fallos seguidos antes de dar el servidor por caído
+FIVEM_CONCURRENCY = 10
+FIVEM_COLOR_CODES = re.compile(r'\^\d')
+
+class FiveMTarget:
+    def __init__(self, guild_id, endpoint):
+        self.guild_id = guild_id
+        self.endpoint = endpoint
+        self.base_url = (endpoint if '://' in endpoint else f'http://{endpoint}').rstrip('/')
+        self.failures = 0
+        self.next_poll = 0
+        self.snapshot = None  # Último resultado de la consulta
+        self.published = None  # Último resultado mostrado en Discord
+
+class FiveMStatusPoller:
+    def __init__(self, state):
+        self.state = state
+        self._registry = None  # guild_id (str) -> endpoint; se enlaza en load
+        self.targets = {}
+        self._session = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def load(self):
+        self._registry = self.state.data.setdefault('fivem_targets', {})
+        self.targets = {int(guild_id): FiveMTarget(int(guild_id), endpoint) for guild_id, endpoint in self._registry.items()}
+
+    def configure(self, guild_id, endpoint):
+        key = str(guild_id)
+        if endpoint:
+            self._registry[key] = endpoint
+            self.targets[guild_id] = FiveMTarget(guild_id, endpoint)
+        else:
+            self._registry.pop(key, None)
+            self.targets.pop(guild_id, None)
+        save_data(self.state, ('fivem_targets', key))
+        self._wakeup.set()
+
+    def snapshot(self, guild_id):
+        target = self.targets.get(guild_id)
+        return target.snapshot if target else None
+
+    def start(self):
+        if not self._task:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=FIVEM_CONCURRENCY * 2, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=FIVEM_TIMEOUT)
+            )
+            self._task = asyncio.create_task(self._run(), name='fivem-status')
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def _run(self):
+        await bot.wait_until_ready()
+        slots = asyncio.Semaphore(FIVEM_CONCURRENCY)
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            due = [target for target in self.targets.values() if target.next_poll <= now]
+            if due:
+                await asyncio.gather(*(self._poll(target, slots) for target in due))
+            next_poll = min((target.next_poll for target in self.targets.values()), default=now + FIVEM_POLL_INTERVAL)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0, next_poll - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _get_json(self, target, name):
+        async with self._session.get(f'{target.base_url}/{name}') as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)  # FXServer no siempre manda application/json
+
+    async def _poll(self, target, slots):
+        async with slots:
+            try:
+                info, players = await asyncio.gather(self._get_json(target, 'info.json'), self._get_json(target, 'players.json'))
+                variables = info.get('vars', {})
+                snapshot = {
+                    'online': True,
+                    'players': len(players),
+                    'max_players': int(variables.get('sv_maxClients') or 0),
+                    'hostname': FIVEM_COLOR_CODES.sub('', variables.get('sv_projectName') or variables.get('sv_hostname') or '')[:200]
+                }
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, AttributeError, TypeError):
+                target.failures += 1
+                target.next_poll = time.monotonic() + min(FIVEM_RETRY_BASE * 2 ** (target.failures - 1), FIVEM_BACKOFF_MAX)
+                if target.failures < FIVEM_OFFLINE_AFTER:
+                    return
+                snapshot = {'online': False}
+            else:
+                target.failures = 0
+                target.next_poll = time.monotonic() + FIVEM_POLL_INTERVAL
+        
+        target.snapshot = snapshot
+        if snapshot != target.published:
+            try:
+                await self._publish(target, snapshot)
+                target.published = snapshot
+            except Exception as e:
+                print(f'❌ Error al actualizar el estado FiveM del servidor {target.guild_id}: {e}')
+
+    async def _publish(self, target, snapshot):
+        guild = bot.get_guild(target.guild_id)
+        if not guild:
+            return
+        state = await guild_states.get(target.guild_id)
+        status = 'online' if snapshot['online'] else 'offline'
+        if state.data['server_status'] != status:
+            state.data['server_status'] = status
+            save_data(state, ('server_status',))
+            await log_action(guild, "Server Status", f"El servidor FiveM está ahora **{status.upper()}** (detectado automáticamente)")
+        
+        channel = guild.get_channel(state.config.get('status_channel_id') or 0)
+        if not channel:
+            return
+        embed = build_status_embed(state, target, snapshot)
+        message_id = state.config.get('status_message_id')
+        if message_id:
+            try:
+                await outbound.run('status', lambda: channel.get_partial_message(message_id).edit(embed=embed), PRIORITY_BACKGROUND)
+                return
+            except discord.NotFound:
+                pass  # Lo borraron: publicar uno nuevo
+        message = await outbound.run('status', lambda: channel.send(embed=embed), PRIORITY_BACKGROUND)
+        state.config['status_message_id'] = message.id
+        save_data(state, ('config', 'status_message_id'))
+
+fivem_status = FiveMStatusPoller(global_state)
+
+def build_status_embed(state, target, snapshot):
+    embed = state.templates.embed(('status', snapshot['online']), lambda: _build_status_template(state.config, snapshot['online']))
+    if snapshot['online']:
+        embed.description = snapshot['hostname'] or "¡El servidor está disponible para jugar!"
+        embed.add_field(name="👥 Jugadores", value=f"`{snapshot['players']}/{snapshot['max_players']}`", inline=True)
+    else:
+        embed.description = "El servidor no responde en este momento."
+    
+    embed.add_field(name="🌐 IP del Servidor", value=f"`{target.endpoint}`", inline=True)
+    embed.add_field(name="⏰ Último cambio", value=f"<t:{int(datetime.now().timestamp())}:R>", inline=False)
+    embed.set_footer(text=f"Se actualiza automáticamente cada {FIVEM_POLL_INTERVAL}s")
+    return embed
+
+@bot.tree.command(name="setstatus", description="Configura el estado en vivo del servidor FiveM (sin IP lo desactiva)")
+@app_commands.checks.has_permissions(administrator=True)
+async def setstatus(interaction: discord.Interaction, ip: str = None, canal: discord.TextChannel = None):
+    state = await guild_states.get(interaction.guild.id)
+    
+    if ip and not canal:
+        await interaction.response.send_message("❌ Indica el canal donde publicar el estado.", ephemeral=True)
+        return
+    
+    state.config['fivem_endpoint'] = ip
+    state.config['status_channel_id'] = canal.id if ip else None
+    state.config['status_message_id'] = None
+    save_data(state, ('config', 'fivem_endpoint'), ('config', 'status_channel_id'), ('config', 'status_message_id'))
+    fivem_status.configure(interaction.guild.id, ip)
+    
+    if not ip:
+        await interaction.response.send_message("✅ Estado en vivo desactivado.", ephemeral=True)
+        return
+    
+    embed = discord.Embed(
+        title="✅ Estado en Vivo Configurado",
+        description=f"Se consultará `{ip}` cada {FIVEM_POLL_INTERVAL} segundos y el estado se mantendrá actualizado en {canal.mention}.",
+        color=discord.Color.green(),
+        timestamp=datetime.now()
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# ==================== SISTEMA DE BANEOS ====================
+
+@bot.tree.command(name="ban", description="Banea a un usuario del servidor FiveM")
+async def ban(interaction: discord.Interaction, usuario: discord.User, razon: str, duracion: str = "permanente"):
+    try:
+        seconds = parse_duration(duracion)
+    except ValueError:
+        await interaction.response.send_message("❌ Duración inválida. Usa `permanente` o algo como `30m`, `12h`, `7d`, `2sem`, `1d12h`.", ephemeral=True)
+        return
+    
+    state = await guild_states.get(interaction.guild.id)
+    banned_at = int(datetime.now().timestamp())
+    entry = {
+        'username': str(usuario),
+        'razon': razon,
+        'duracion': duracion,
+        'banned_by': str(interaction.user),
+        'banned_at': banned_at
+    }
+    if seconds:
+        entry['expires_at'] = banned_at + seconds
+    await state.load_bans()
+    state.set_ban(str(usuario.id), entry)
+    save_data(state, ('banned_users', str(usuario.id)))
+    await persistence.flush()  # El servidor FiveM lee los baneos del disco
     
     embed = discord.Embed(
-        title="🔴 SERVIDOR OFFLINE",
-        description="El servidor está actualmente en mantenimiento.",
+        title="🔨 Usuario Baneado",
+        description=f"**{usuario.mention}** ha sido baneado del servidor FiveM.",
         color=discord.Color.red(),
         timestamp=datetime.now()
     )
-    embed.add_field(name="📡 Estado", value="❌ Offline", inline=True)
-    embed.add_field(name="📝 Razón", value=razon, inline=True)
-    embed.add_field(name="⏰ Desde", value=f"<t:{int(datetime.now().timestamp())}:R>", inline=False)
+    embed.add_field(name="👤 Usuario", value=f"{usuario.mention}\n`ID: {usuario.id}`", inline=True)
+    embed.add_field(name="⏰ Duración", value=duracion if not seconds else f"{duracion} (expira <t:{entry['expires_at']}:R>)", inline=True)
+    embed.add_field(name="📝 Razón", value=razon, inline=False)
+    embed.add_field(name="👮 Baneado por", value=interaction.user.mention, inline=True)
+    embed.set_thumbnail(url=usuario.display_avatar.url)
+    embed.set_footer(text=f"Ban ejecutado por {interaction.user.name}", icon_url=interaction.user.display_avatar.url)
     
-    # Añadir logo
-    if bot_data['config']['server_logo']:
-        embed.set_thumbnail(url=bot_data['config']['server_logo'])
+    await interaction.response.send_message(embed=embed)
+    await log_action(interaction.guild, "Ban", f"{interaction.user.mention} baneó a {usuario.mention}\n**Razón:** {razon}\n**Duración:** {duracion}")
+
+@bot.tree.command(name="unban", description="Desbanea a un usuario")
+async def unban(interaction: discord.Interaction, userid: str):
+    state = await guild_states.get(interaction.guild.id)
+    if userid not in await state.load_bans():
+        await interaction.response.send_message("❌ Este usuario no está baneado.", ephemeral=True)
+        return
     
-    # Añadir imagen de servidor offline
-    if bot_data['config']['server_offline_image']:
-        embed.set_image(url=bot_data['config']['server_offline_image'])
+    banned_user = state.remove_ban(userid)
+    save_data(state, ('banned_users', userid))
+    await persistence.flush()  # El servidor FiveM lee los baneos del disco
     
-    embed.set_footer(text=f"Actualizado por {interaction.user.name}", icon_url=interaction.user.display_avatar.url)
+    embed = discord.Embed(
+        title="✅ Usuario Desbaneado",
+        description=f"**{banned_user['username']}** ha sido desbaneado.",
+        color=discord.Color.green(),
+        timestamp=datetime.now()
+    )
+    embed.add_field(name="👤 Usuario", value=f"{banned_user['username']}\n`ID: {userid}`", inline=True)
+    embed.add_field(name="👮 Desbaneado por", value=interaction.user.mention, inline=True)
+    embed.set_footer(text=f"Unban ejecutado por {interaction.user.name}", icon_url=interaction.user.display_avatar.url)
     
     await interaction.response.send_message(embed=embed)
-    await log_action(interaction.guild, "Server Status", f"{interaction.user.mention} marcó el servidor como **OFFLINE**\n**Razón:** {razon}")
+    await log_action(interaction.guild, "Unban", f"{interaction.user.mention} desbaneó a {banned_user['username']}")
+
+# /bans pagina con cursores sobre el índice ordenado por fecha: cada página es
+# un bisect y un slice de BANS_PAGE_SIZE claves. Con filtros (staff o búsqueda)
+# se ordenan solo los baneos que coinciden.
+BANS_PAGE_SIZE = 10
+BANS_VIEW_TIMEOUT = 300
+BANS_ALL_STAFF = '__todos__'
+
+class BanSearchModal(discord.ui.Modal, title="Buscar baneos"):
+    texto = discord.ui.TextInput(label="Usuario o razón (vacío para quitar el filtro)", required=False, max_length=100)
+
+    def __init__(self, bans_view):
+        super().__init__()
+        self.bans_view = bans_view
+
+    async def on_submit(self, interaction: discord.Interaction):
+        self.bans_view.set_filters(query=self.texto.value.strip() or None)
+        await interaction.response.edit_message(embed=self.bans_view.render(), view=self.bans_view)
+
+class BansView(discord.ui.View):
+    def __init__(self, state, owner_id, query=None):
+        super().__init__(timeout=BANS_VIEW_TIMEOUT)
+        self.state = state
+        self.owner_id = owner_id
+        self.staff = None
+        # El valor de cada opción es su posición: los nombres largos no caben en 100 caracteres
+        counts = state.bans.staff_counts()[:24]
+        self.staff_names = [staff for _, staff in counts]
+        self.staff_select.options = [discord.SelectOption(label="Todo el staff", value=BANS_ALL_STAFF, emoji="👮")] + [
+            discord.SelectOption(label=staff[:100], value=str(i), description=f"{count} baneos")
+            for i, (count, staff) in enumerate(counts)
+        ]
+        self.set_filters(query=query)
+
+    def set_filters(self, query=..., staff=...):
+        if query is not ...:
+            self.query = query
+        if staff is not ...:
+            self.staff = staff
+        self.cursors = [None]  # Cursor de inicio de cada página visitada
+
+    def render(self):
+        # Se filtra en cada página: entre un clic y otro se levantan o expiran baneos.
+        # Sin filtros se pagina directamente sobre el índice (sin copiarlo)
+        allowed = self.state.bans.matches(self.query, self.staff)
+        self.keys = self.state.bans.by_time if allowed is None else self.state.bans.sorted_keys(allowed)
+        page, has_more = page_before(self.keys, self.cursors[-1], BANS_PAGE_SIZE)
+        self.next_cursor = page[-1] if page else None
+        self.prev_button.disabled = len(self.cursors) == 1
+        self.next_button.disabled = not has_more
+        
+        filtros = []
+        if self.staff:
+            filtros.append(f"staff **{self.staff}**")
+        if self.query:
+            filtros.append(f"búsqueda **{self.query}**")
+        descripcion = f"Total de baneados: **{len(self.state.bans.by_time)}**"
+        if filtros:
+            descripcion += f"\nFiltro: {', '.join(filtros)} — **{len(self.keys)}** resultados"
+        
+        embed = discord.Embed(
+            title="📋 Lista de Baneados",
+            description=descripcion,
+            color=discord.Color.red(),
+            timestamp=datetime.now()
+        )
+        offset = (len(self.cursors) - 1) * BANS_PAGE_SIZE
+        for idx, (_, user_id) in enumerate(page, offset + 1):
+            data = self.state.data['banned_users'][user_id]
+            duracion = data['duracion']
+            if data.get('expires_at'):
+                duracion += f" (expira <t:{data['expires_at']}:R>)"
+            embed.add_field(
+                name=f"{idx}. {data['username']}",
+                value=f"**ID:** `{user_id}`\n**Razón:** {data['razon']}\n**Duración:** {duracion}\n**Por:** {data['banned_by']}",
+                inline=False
+            )
+        if not page:
+            embed.add_field(name="Sin resultados", value="Ningún baneo coincide con el filtro.", inline=False)
+        
+        pages = max(1, -(-len(self.keys) // BANS_PAGE_SIZE))
+        embed.set_footer(text=f"Página {len(self.cursors)} de {pages}")
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if not await allow_interaction(interaction, 'component'):
+            return False
+        if interaction.user.id != self.owner_id:
+            await interaction.response.send_message("❌ Usa /bans para abrir tu propia lista.", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label="Anterior", style=discord.ButtonStyle.secondary, emoji="◀️", row=0)
+    @instrumented('bans_prev')
+    async def prev_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if len(self.cursors) > 1:
+            self.cursors.pop()
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="Siguiente", style=discord.ButtonStyle.secondary, emoji="▶️", row=0)
+    @instrumented('bans_next')
+    async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.next_cursor:
+            self.cursors.append(self.next_cursor)
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="Buscar", style=discord.ButtonStyle.primary, emoji="🔍", row=0)
+    @instrumented('bans_search')
+    async def search_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.send_modal(BanSearchModal(self))
+
+    @discord.ui.select(placeholder="Filtrar por staff", row=1)
+    @instrumented('bans_staff')
+    async def staff_select(self, interaction: discord.Interaction, select: discord.ui.Select):
+        value = select.values[0]
+        self.set_filters(staff=None if value == BANS_ALL_STAFF else self.staff_names[int(value)])
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+@bot.tree.command(name="bans", description="Lista de usuarios baneados")
+async def bans(interaction: discord.Interaction, buscar: str = None):
+    state = await guild_states.get(interaction.guild.id)
+    
+    if not await state.load_bans():
+        await interaction.response.send_message("✅ No hay usuarios baneados.", ephemeral=True)
+        return
+    
+    view = BansView(state, interaction.user.id, query=buscar)
+    await interaction.response.send_message(embed=view.render(), view=view, ephemeral=True)
+
+# ==================== API DE BANEOS ====================
+# API HTTP local para el servidor FiveM, servida en el mismo event loop del bot.
+# Responde desde los baneos en memoria de cada servidor (ignorando los que han
+# expirado) y permite importar/exportar baneos en CSV o JSONL en streaming.
+# Todas las rutas requieren "Authorization: Bearer <BAN_API_TOKEN>"; sin token
+# configurado la API no arranca. Con BAN_API_SOCKET escucha en un socket Unix.
+#   GET  /bans/{guild_id}/{user_id}         ¿está baneado?
+#   POST /bans/{guild_id}/check             {"ids": [...]} -> baneados de la lista
+#   GET  /bans/{guild_id}/export?format=csv exportar (csv o jsonl)
+#   POST /bans/{guild_id}/import?format=csv importar (csv o jsonl)
+BAN_API_TOKEN = os.getenv('BAN_API_TOKEN')
+BAN_API_HOST = os.getenv('BAN_API_HOST', '127.0.0.1')
+BAN_API_PORT = int(os.getenv('BAN_API_PORT', '8080'))
+BAN_API_SOCKET = os.getenv('BAN_API_SOCKET')
+BAN_CHECK_MAX_IDS = 1000  # IDs por consulta en lote
+BAN_IMPORT_BATCH = 500  # Baneos importados entre cesiones del event loop
+BAN_FIELDS = ['user_id', 'username', 'razon', 'duracion', 'banned_by', 'banned_at', 'expires_at']
+
+def ban_is_active(entry, now=None):
+    expires_at = entry.get('expires_at')
+    return not expires_at or expires_at > (now or time.time())
+
+def _ban_from_row(row):
+    user_id = str(row.get('user_id') or '').strip()
+    if not user_id.isdigit():
+        raise ValueError(f'user_id inválido: {user_id!r}')
+    entry = {
+        'username': row.get('username') or user_id,
+        'razon': row.get('razon') or 'Sin razón',
+        'duracion': row.get('duracion') or 'permanente',
+        'banned_by': row.get('banned_by') or 'importación',
+        'banned_at': int(row.get('banned_at') or datetime.now().timestamp())
+    }
+    if row.get('expires_at'):
+        entry['expires_at'] = int(row['expires_at'])
+    return user_id, entry
+
+class BanAPI:
+    def __init__(self, token):
+        self.token = token
+        self._runner = None
+
+    def _app(self):
+        app = web.Application(middlewares=[self._auth])
+        app.router.add_get(r'/bans/{guild_id:\d+}/export', self.export_bans)
+        app.router.add_post(r'/bans/{guild_id:\d+}/import', self.import_bans)
+        app.router.add_post(r'/bans/{guild_id:\d+}/check', self.check_many)
+        app.router.add_get(r'/bans/{guild_id:\d+}/{user_id:\d+}', self.check_one)
+        return app
+
+    async def start(self):
+        if self._runner:
+            return
+        self._runner = web.AppRunner(self._app(), access_log=None)
+        await self._runner.setup()
+        if BAN_API_SOCKET:
+            site = web.UnixSite(self._runner, BAN_API_SOCKET)
+        else:
+            site = web.TCPSite(self._runner, BAN_API_HOST, BAN_API_PORT)
+        await site.start()
+        print(f'✅ API de baneos escuchando en {BAN_API_SOCKET or f"{BAN_API_HOST}:{BAN_API_PORT}"}')
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @web.middleware
+    async def _auth(self, request, handler):
+        header = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(header.encode(), f'Bearer {self.token}'.encode()):
+            return web.json_response({'error': 'unauthorized'}, status=401)
+        return await handler(request)
+
+    async def _state(self, request):
+        return await guild_states.get(int(request.match_info['guild_id']))
+
+    async def check_one(self, request):
+        state = await self._state(request)
+        entry = (await state.load_bans()).get(request.match_info['user_id'])
+        if not entry or not ban_is_active(entry):
+            return web.json_response({'banned': False})
+        return web.json_response({'banned': True, **entry})
+
+    async def check_many(self, request):
+        try:
+            ids = (await request.json())['ids']
+        except (ValueError, KeyError, TypeError):
+            return web.json_response({'error': 'se esperaba {"ids": [...]}'}, status=400)
+        if not isinstance(ids, list) or len(ids) > BAN_CHECK_MAX_IDS:
+            return web.json_response({'error': f'"ids" debe ser una lista de hasta {BAN_CHECK_MAX_IDS} elementos'}, status=400)
+        
+        state = await self._state(request)
+        banned_users = await state.load_bans()
+        now = time.time()
+        banned = {}
+        for user_id in map(str, ids):
+            entry = banned_users.get(user_id)
+            if entry and ban_is_active(entry, now):
+                banned[user_id] = entry
+        return web.json_response({'banned': banned})
+
+    async def export_bans(self, request):
+        fmt = request.query.get('format', 'jsonl')
+        if fmt not in ('csv', 'jsonl'):
+            return web.json_response({'error': 'format debe ser csv o jsonl'}, status=400)
+        state = await self._state(request)
+        items = list((await state.load_bans()).items())  # Copia de referencias: el dict puede cambiar al ceder el loop
+        
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/csv; charset=utf-8' if fmt == 'csv' else 'application/x-ndjson',
+            'Content-Disposition': f'attachment; filename="bans-{state.guild_id}.{fmt}"'
+        })
+        await response.prepare(request)
+        for start in range(0, len(items), BAN_IMPORT_BATCH):
+            chunk = io.StringIO()
+            if fmt == 'csv':
+                writer = csv.DictWriter(chunk, fieldnames=BAN_FIELDS, extrasaction='ignore')
+                if start == 0:
+                    writer.writeheader()
+                writer.writerows({'user_id': user_id, **entry} for user_id, entry in items[start:start + BAN_IMPORT_BATCH])
+            else:
+                for user_id, entry in items[start:start + BAN_IMPORT_BATCH]:
+                    chunk.write(json.dumps({'user_id': user_id, **entry}, ensure_ascii=False) + '\n')
+            await response.write(chunk.getvalue().encode('utf-8'))
+        if not items and fmt == 'csv':
+            await response.write((','.join(BAN_FIELDS) + '\r\n').encode('utf-8'))
+        await response.write_eof()
+        return response
+
+    # Se lee el cuerpo línea a línea (los campos CSV no pueden contener saltos de línea)
+    async def import_bans(self, request):
+        fmt = request.query.get('format', 'jsonl')
+        if fmt not in ('csv', 'jsonl'):
+            return web.json_response({'error': 'format debe ser csv o jsonl'}, status=400)
+        state = await self._state(request)
+        await state.load_bans()
+        
+        header = None
+        imported = 0
+        errors = []
+        batch = []
+        line_no = 0
+        async for raw in request.content:
+            line_no += 1
+            line = raw.decode('utf-8-sig' if line_no == 1 else 'utf-8').strip()
+            if not line:
+                continue
+            try:
+                if fmt == 'csv':
+                    values = next(csv.reader([line]))
+                    if header is None:
+                        header = values
+                        continue
+                    row = dict(zip(header, values))
+                else:
+                    row = json.loads(line)
+                user_id, entry = _ban_from_row(row)
+            except (ValueError, TypeError, AttributeError) as e:
+                errors.append(f'línea {line_no}: {e}')
+                continue
+            state.set_ban(user_id, entry)
+            batch.append(('banned_users', user_id))
+            if len(batch) >= BAN_IMPORT_BATCH:
+                imported += len(batch)
+                save_data(state, *batch)
+                batch = []
+                await asyncio.sleep(0)  # Dejar pasar al resto del bot entre lotes
+        
+        if batch:
+            imported += len(batch)
+            save_data(state, *batch)
+        await persistence.flush()
+        
+        guild = bot.get_guild(state.guild_id)
+        if guild and imported:
+            await log_action(guild, "Importación de Baneos", f"{imported} baneos importados desde la API ({len(errors)} líneas con errores)")
+        return web.json_response({'imported': imported, 'errors': len(errors), 'first_errors': errors[:20]})
+
+ban_api = BanAPI(BAN_API_TOKEN)
+
+# ==================== EXPIRACIÓN DE BANEOS ====================
+# La duración de /ban se convierte en un expires_at absoluto. Una sola tarea
+# guarda todas las expiraciones en un min-heap y duerme hasta la más próxima;
+# al despertar quita en lote los baneos vencidos y los registra. Un baneo
+# quitado o renovado a mano deja su entrada vieja en el heap, que se descarta
+# al salir (expires_at ya no coincide).
+# Los servidores se cargan bajo demanda, así que la partición global guarda en
+# 'ban_expiry' la próxima expiración de cada servidor: al arrancar el heap se
+# reconstruye con esas marcas y, al vencer una, se carga el servidor y se
+# añaden sus baneos temporales (consultando solo esos, sin cargar el resto).
+BAN_EXPIRY_BATCH = 200  # Baneos quitados por vuelta
+BAN_EXPIRY_MAX_SLEEP = 3600  # Revisar al menos cada hora (cambios de reloj)
+BAN_EXPIRY_LOG_NAMES = 20
+PERMANENT_DURATIONS = ('', 'permanente', 'perma', 'perm', 'permanent', 'nunca')
+DURATION_UNITS = {
+    's': 1, 'seg': 1, 'segundo': 1, 'segundos': 1,
+    'm': 60, 'min': 60, 'minuto': 60, 'minutos': 60,
+    'h': 3600, 'hora': 3600, 'horas': 3600,
+    'd': 86400, 'dia': 86400, 'dias': 86400, 'día': 86400, 'días': 86400,
+    'w': 604800, 'sem': 604800, 'semana': 604800, 'semanas': 604800,
+    'mes': 2592000, 'meses': 2592000,
+}
+DURATION_RE = re.compile(r'(\d+)\s*([a-zí]+)')
+
+# "7d", "12h", "1d12h", "2 semanas"... -> segundos; None si es permanente
+def parse_duration(text):
+    text = text.strip().lower()
+    if text in PERMANENT_DURATIONS:
+        return None
+    total = 0
+    pos = 0
+    for match in DURATION_RE.finditer(text):
+        unit = DURATION_UNITS.get(match.group(2))
+        if unit is None or text[pos:match.start()].strip(' ,y'):
+            raise ValueError(text)
+        total += int(match.group(1)) * unit
+        pos = match.end()
+    if not total or text[pos:].strip():
+        raise ValueError(text)
+    return total
+
+class BanExpiryScheduler:
+    def __init__(self, state):
+        self.state = state
+        self._hints = None  # guild_id (str) -> próxima expiración (0: sin baneos temporales); se enlaza en load
+        self._heap = []  # (expires_at, guild_id, user_id); user_id None = marca de servidor
+        self._tracked = set()  # Entradas de baneo ya en el heap, para no repetirlas al recargar un servidor
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def load(self):
+        self._hints = self.state.data.setdefault('ban_expiry', {})
+        for guild_id, expires_at in self._hints.items():
+            if expires_at:
+                self._heap.append((expires_at, int(guild_id), None))
+        heapq.heapify(self._heap)
+
+    @property
+    def pending(self):
+        return len(self._heap)
+
+    def track(self, state, user_id, entry):
+        expires_at = entry.get('expires_at')
+        if not expires_at:
+            return
+        item = (expires_at, state.guild_id, user_id)
+        if item in self._tracked:
+            return
+        self._tracked.add(item)
+        heapq.heappush(self._heap, item)
+        self._set_hint(state.guild_id, min(expires_at, self._hints.get(str(state.guild_id)) or expires_at))
+        if self._heap[0][0] == expires_at:
+            self._wakeup.set()  # Es la nueva más próxima: recalcular la espera
+
+    # Al cargar un servidor no se leen sus baneos: basta su marca guardada, que
+    # vence con su primera expiración. Sin marca (servidor nuevo o que venía de
+    # otro proceso del clúster) o con baneos antiguos por convertir se revisa
+    # ahora en segundo plano.
+    def watch_guild(self, state):
+        if str(state.guild_id) not in self._hints or not state.ban_expiry_backfilled:
+            heapq.heappush(self._heap, (time.time(), state.guild_id, None))
+            self._wakeup.set()
+
+    # Baneos cambiados por otro proceso del clúster: aunque no estén cargados aquí,
+    # volver a leer los temporales del servidor para actualizar su marca
+    def recheck_guild(self, guild_id):
+        heapq.heappush(self._heap, (time.time(), guild_id, None))
+        self._wakeup.set()
+
+    # Al vencer la marca de un servidor: todos sus baneos temporales de una vez
+    # (solo esos, sin cargar el resto). Los que ya están en el heap no se duplican.
+    async def track_guild(self, state):
+        if not state.ban_expiry_backfilled:
+            await state.load_bans()  # Calcula el expires_at de los baneos antiguos
+        entries = [(expires_at, state.guild_id, user_id) for user_id, expires_at in await state.temporary_bans()]
+        self._set_hint(state.guild_id, min(entries)[0] if entries else 0)
+        entries = [item for item in entries if item not in self._tracked]
+        if entries:
+            self._tracked.update(entries)
+            self._heap.extend(entries)
+            heapq.heapify(self._heap)
+            self._wakeup.set()
+
+    def _set_hint(self, guild_id, expires_at):
+        key = str(guild_id)
+        if self._hints.get(key) == expires_at:
+            return
+        self._hints[key] = expires_at
+        save_data(self.state, ('ban_expiry', key))
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run(), name='ban-expiry')
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        # Hace falta la caché de servidores para saber cuáles son de este proceso
+        await bot.wait_until_ready()
+        while True:
+            self._wakeup.clear()
+            delay = min(self._heap[0][0] - time.time(), BAN_EXPIRY_MAX_SLEEP) if self._heap else BAN_EXPIRY_MAX_SLEEP
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._expire_due()
+            except Exception as e:
+                print(f'❌ Error al expirar baneos: {e}')
+                await asyncio.sleep(LOG_BATCH_DELAY)
+
+    async def _expire_due(self):
+        now = time.time()
+        due = {}  # guild_id -> [(user_id, expires_at)]
+        for _ in range(BAN_EXPIRY_BATCH):
+            if not self._heap or self._heap[0][0] > now:
+                break
+            expires_at, guild_id, user_id = heapq.heappop(self._heap)
+            self._tracked.discard((expires_at, guild_id, user_id))
+            due.setdefault(guild_id, []).append((user_id, expires_at))
+        
+        for guild_id, entries in due.items():
+            guild = bot.get_guild(guild_id)
+            if not guild:
+                continue  # Servidor que ya no está o de otro proceso del clúster
+            state = await guild_states.get(guild_id)
+            if any(user_id is None for user_id, _ in entries):
+                await self.track_guild(state)  # Marca del servidor: pasar sus baneos temporales al heap
+            entries = [(user_id, expires_at) for user_id, expires_at in entries if user_id]
+            if not entries:
+                continue
+            banned_users = await state.load_bans()
+            expired = []
+            for user_id, expires_at in entries:
+                entry = banned_users.get(user_id)
+                if entry and entry.get('expires_at') == expires_at:
+                    state.remove_ban(user_id)
+                    expired.append((user_id, entry))
+            if not expired:
+                continue
+            
+            save_data(state, *[('banned_users', user_id) for user_id, _ in expired])
+            nombres = '\n'.join(f"{entry['username']} (`{user_id}`)" for user_id, entry in expired[:BAN_EXPIRY_LOG_NAMES])
+            if len(expired) > BAN_EXPIRY_LOG_NAMES:
+                nombres += f"\n... y {len(expired) - BAN_EXPIRY_LOG_NAMES} más"
+            await log_action(guild, "Baneos Expirados", f"{len(expired)} baneo(s) temporal(es) han expirado:\n{nombres}")
+
+ban_expiry = BanExpiryScheduler(global_state)
+
+# ==================== SISTEMA DE ACTUALIZACIONES ====================
+
+# Los anuncios (actualizaciones, avisos de serverup/serverdown) se guardan en la
+# partición global con su hora y sus canales. Un heap despierta la tarea en la
+# siguiente hora pendiente (sin sondeos) y cada anuncio se envía a todos sus
+# canales a la vez; los envíos en vuelo los limita la ruta 'announce' del
+# planificador. El resultado de cada canal se guarda según llega, así que tras un
+# reinicio solo se reintentan los que faltaban, y al acabar se manda un informe.
+ANNOUNCE_MAX_CHANNELS = 50
+ANNOUNCE_MAX_SLEEP = 3600  # Despertar de vez en cuando aunque no haya nada
+ANNOUNCE_RETRY_DELAY = 60
+
+class AnnouncementScheduler:
+    def __init__(self, state):
+        self.state = state
+        self._pending = None  # id -> anuncio; se enlaza en load
+        self._heap = []
+        self._waiters = {}  # id -> interacción que espera el informe (solo en memoria)
+        self._deliveries = set()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def load(self):
+        self._pending = self.state.data.setdefault('announcements', {})
+        self._heap = [(record['due_at'], announcement_id) for announcement_id, record in self._pending.items()]
+        heapq.heapify(self._heap)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def get(self, announcement_id):
+        return self._pending.get(announcement_id)
+
+    def for_guild(self, guild_id):
+        return sorted((record for record in self._pending.values() if record['guild_id'] == guild_id), key=lambda r: r['due_at'])
+
+    def schedule(self, guild_id, channel_ids, embed, content=None, due_at=None, created_by=None, interaction=None):
+        announcement_id = f'{time.time_ns():x}'
+        record = {
+            'id': announcement_id,
+            'guild_id': guild_id,
+            'due_at': due_at or time.time(),
+            'channel_ids': list(dict.fromkeys(channel_ids)),  # Sin repetidos, en orden
+            'content': content,
+            'embed': embed.to_dict(),
+            'created_by': created_by,
+            'results': {}  # channel_id (str) -> None si se entregó, o el error
+        }
+        self._pending[announcement_id] = record
+        save_data(self.state, ('announcements', announcement_id))
+        heapq.heappush(self._heap, (record['due_at'], announcement_id))
+        if interaction:
+            self._waiters[announcement_id] = interaction
+        if self._heap[0][1] == announcement_id:
+            self._wakeup.set()  # Es el siguiente: recalcular la espera
+        return record
+
+    def cancel(self, announcement_id):
+        record = self._pending.pop(announcement_id, None)
+        if record:
+            save_data(self.state, ('announcements', announcement_id))
+            self._waiters.pop(announcement_id, None)
+        return record
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run(), name='announcements')
 
-# ==================== SISTEMA DE BANEOS ====================
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Los envíos a medias se retoman en el próximo arranque con lo que falte
+        for task in list(self._deliveries):
+            task.cancel()
+        await asyncio.gather(*self._deliveries, return_exceptions=True)
 
-@bot.tree.command(name="ban", description="Banea a un usuario del servidor FiveM")
-async def ban(interaction: discord.Interaction, usuario: discord.User, razon: str, duracion: str = "permanente"):
-    bot_data['banned_users'][str(usuario.id)] = {
-        'username': str(usuario),
-        'razon': razon,
-        'duracion': duracion,
-        'banned_by': str(interaction.user),
-        'banned_at': int(datetime.now().timestamp())
-    }
-    save_data(bot_data)
-    
-    embed = discord.Embed(
-        title="🔨 Usuario Baneado",
-        description=f"**{usuario.mention}** ha sido baneado del servidor FiveM.",
-        color=discord.Color.red(),
-        timestamp=datetime.now()
-    )
-    embed.add_field(name="👤 Usuario", value=f"{usuario.mention}\n`ID: {usuario.id}`", inline=True)
-    embed.add_field(name="⏰ Duración", value=duracion, inline=True)
-    embed.add_field(name="📝 Razón", value=razon, inline=False)
-    embed.add_field(name="👮 Baneado por", value=interaction.user.mention, inline=True)
-    embed.set_thumbnail(url=usuario.display_avatar.url)
-    embed.set_footer(text=f"Ban ejecutado por {interaction.user.name}", icon_url=interaction.user.display_avatar.url)
-    
-    await interaction.response.send_message(embed=embed)
-    await log_action(interaction.guild, "Ban", f"{interaction.user.mention} baneó a {usuario.mention}\n**Razón:** {razon}\n**Duración:** {duracion}")
+    async def _run(self):
+        await bot.wait_until_ready()
+        while True:
+            self._wakeup.clear()
+            # Descartar los cancelados o ya entregados que sigan en el heap
+            while self._heap and self._heap[0][1] not in self._pending:
+                heapq.heappop(self._heap)
+            delay = min(self._heap[0][0] - time.time(), ANNOUNCE_MAX_SLEEP) if self._heap else ANNOUNCE_MAX_SLEEP
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, announcement_id = heapq.heappop(self._heap)
+            task = asyncio.create_task(self._deliver_safe(self._pending[announcement_id]), name=f'announce-{announcement_id}')
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
 
-@bot.tree.command(name="unban", description="Desbanea a un usuario")
-async def unban(interaction: discord.Interaction, userid: str):
-    if userid not in bot_data['banned_users']:
-        await interaction.response.send_message("❌ Este usuario no está baneado.", ephemeral=True)
-        return
-    
-    banned_user = bot_data['banned_users'][userid]
-    del bot_data['banned_users'][userid]
-    save_data(bot_data)
-    
-    embed = discord.Embed(
-        title="✅ Usuario Desbaneado",
-        description=f"**{banned_user['username']}** ha sido desbaneado.",
-        color=discord.Color.green(),
-        timestamp=datetime.now()
-    )
-    embed.add_field(name="👤 Usuario", value=f"{banned_user['username']}\n`ID: {userid}`", inline=True)
-    embed.add_field(name="👮 Desbaneado por", value=interaction.user.mention, inline=True)
-    embed.set_footer(text=f"Unban ejecutado por {interaction.user.name}", icon_url=interaction.user.display_avatar.url)
-    
-    await interaction.response.send_message(embed=embed)
-    await log_action(interaction.guild, "Unban", f"{interaction.user.mention} desbaneó a {banned_user['username']}")
+    async def _deliver_safe(self, record):
+        try:
+            await self._deliver(record)
+        except Exception as e:
+            print(f'❌ Error al enviar el anuncio {record["id"]}: {e}')
+            if record['id'] in self._pending:
+                # Reintentar más tarde solo los canales que faltan
+                heapq.heappush(self._heap, (time.time() + ANNOUNCE_RETRY_DELAY, record['id']))
+                self._wakeup.set()
 
-@bot.tree.command(name="bans", description="Lista de usuarios baneados")
-async def bans(interaction: discord.Interaction):
-    banned_list = bot_data['banned_users']
-    
-    if not banned_list:
-        await interaction.response.send_message("✅ No hay usuarios baneados.", ephemeral=True)
-        return
-    
-    embed = discord.Embed(
-        title="📋 Lista de Baneados",
-        description=f"Total de baneados: **{len(banned_list)}**",
-        color=discord.Color.red(),
-        timestamp=datetime.now()
-    )
-    
-    for idx, (user_id, data) in enumerate(list(banned_list.items())[:10], 1):
-        embed.add_field(
-            name=f"{idx}. {data['username']}",
-            value=f"**ID:** `{user_id}`\n**Razón:** {data['razon']}\n**Duración:** {data['duracion']}\n**Por:** {data['banned_by']}",
-            inline=False
-        )
-    
-    if len(banned_list) > 10:
-        embed.set_footer(text=f"Mostrando 10 de {len(banned_list)} baneados")
-    
-    await interaction.response.send_message(embed=embed, ephemeral=True)
+    async def _deliver(self, record):
+        embed = discord.Embed.from_dict(record['embed'])
+        results = record['results']
+        
+        async def send(channel_id):
+            channel = bot.get_partial_messageable(channel_id)  # Sin caché: vale para canales de otros shards
+            try:
+                await outbound.run('announce', lambda: channel.send(content=record['content'], embed=embed), PRIORITY_BACKGROUND)
+                results[str(channel_id)] = None
+            except discord.Forbidden:
+                results[str(channel_id)] = 'sin permisos'
+            except discord.NotFound:
+                results[str(channel_id)] = 'canal no encontrado'
+            except discord.HTTPException as e:
+                results[str(channel_id)] = f'error {e.status}'
+            save_data(self.state, ('announcements', record['id']))
+        
+        # Esperar a todos los envíos antes de decidir: si un fallo inesperado se
+        # propagase con otros aún en vuelo, el reintento volvería a enviar a esos canales
+        outcomes = await asyncio.gather(*(send(channel_id) for channel_id in record['channel_ids'] if str(channel_id) not in results), return_exceptions=True)
+        errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+        if errors:
+            raise errors[0]  # _deliver_safe reintenta solo los canales sin resultado
+        
+        if self._pending.pop(record['id'], None) is None:
+            return  # Cancelado mientras se enviaba
+        save_data(self.state, ('announcements', record['id']))
+        failed = {channel_id: error for channel_id, error in results.items() if error}
+        report = f"✅ Anuncio entregado en {len(results) - len(failed)}/{len(results)} canales."
+        if failed:
+            report += "\n" + "\n".join(f"❌ <#{channel_id}>: {error}" for channel_id, error in list(failed.items())[:10])
+            if len(failed) > 10:
+                report += f"\n... y {len(failed) - 10} fallos más"
+        
+        interaction = self._waiters.pop(record['id'], None)
+        if interaction:
+            try:
+                await interaction.edit_original_response(content=report)
+            except discord.HTTPException:
+                pass  # El token de la interacción caduca a los 15 minutos
+        title = (record['embed'].get('title') or 'Anuncio')[:100]
+        await log_action(bot.get_guild(record['guild_id']), "Anuncio Enviado", f"**{title}**\n{report}")
 
-# ==================== SISTEMA DE ACTUALIZACIONES ====================
+announcements = AnnouncementScheduler(global_state)
+metrics.gauge('bot_announcements_pending', lambda: announcements.pending)
+
+# Canales de anuncios de un servidor: el de actualizaciones más los extra
+def announce_targets(state, include_updates=True):
+    targets = list(state.config.get('announce_channel_ids', []))
+    if include_updates and state.config['updates_channel_id']:
+        targets.insert(0, state.config['updates_channel_id'])
+    return targets
+
+# "30m", "2h" (desde ahora), "21:30" (hoy o mañana) o "2024-12-31 21:30".
+# El mensaje del ValueError se puede mostrar tal cual al usuario.
+def parse_schedule(text):
+    text = text.strip()
+    for fmt in ('%Y-%m-%d %H:%M', '%d/%m/%Y %H:%M'):
+        try:
+            due = datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            continue
+        if due <= time.time():
+            raise ValueError(f"La fecha `{text}` ya ha pasado. Indica una fecha y hora futuras.")
+        return due
+    try:
+        hour = datetime.strptime(text, '%H:%M')
+    except ValueError:
+        try:
+            seconds = parse_duration(text)
+        except ValueError:
+            seconds = None
+        if not seconds:
+            raise ValueError("Hora inválida. Usa algo como `30m`, `2h`, `21:30` o `2024-12-31 21:30`.")
+        return time.time() + seconds
+    due = datetime.now().replace(hour=hour.hour, minute=hour.minute, second=0, microsecond=0).timestamp()
+    return due if due > time.time() else due + 86400
 
-@bot.tree.command(name="actualizacion", description="Envía una actualización al canal de actualizaciones")
-async def actualizacion(interaction: discord.Interaction, titulo: str, descripcion: str, imagen: str = None):
-    if not bot_data['config']['updates_channel_id']:
+@bot.tree.command(name="actualizacion", description="Envía (o programa) una actualización a los canales de anuncios")
+async def actualizacion(interaction: discord.Interaction, titulo: str, descripcion: str, imagen: str = None, programar: str = None):
+    state = await guild_states.get(interaction.guild.id)
+    targets = announce_targets(state)
+    if not targets:
         await interaction.response.send_message("❌ No hay canal de actualizaciones configurado. Usa /setup primero.", ephemeral=True)
         return
     
-    channel = interaction.guild.get_channel(bot_data['config']['updates_channel_id'])
+    due_at = None
+    if programar:
+        try:
+            due_at = parse_schedule(programar)
+        except ValueError as e:
+            await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+            return
     
     embed = discord.Embed(
         title=f"📢 {titulo}",
         description=descripcion,
         color=discord.Color.blue(),
-        timestamp=datetime.now()
+        timestamp=datetime.fromtimestamp(due_at) if due_at else datetime.now()
     )
     
     if imagen:
         embed.set_image(url=imagen)
     
-    if bot_data['config']['server_logo']:
-        embed.set_thumbnail(url=bot_data['config']['server_logo'])
+    if state.config['server_logo']:
+        embed.set_thumbnail(url=state.config['server_logo'])
     
     embed.set_footer(text=f"Actualizado por {interaction.user.name}", icon_url=interaction.user.display_avatar.url)
     
-    await channel.send(content="@everyone", embed=embed)
-    await interaction.response.send_message("✅ Actualización enviada correctamente.", ephemeral=True)
+    if due_at:
+        record = announcements.schedule(interaction.guild.id, targets, embed, content="@everyone", due_at=due_at, created_by=interaction.user.id)
+        await interaction.response.send_message(f"🗓️ Actualización programada para <t:{int(due_at)}:F> en {len(record['channel_ids'])} canal(es). ID: `{record['id']}`", ephemeral=True)
+    else:
+        await interaction.response.send_message(f"⏳ Enviando la actualización a {len(set(targets))} canal(es)...", ephemeral=True)
+        announcements.schedule(interaction.guild.id, targets, embed, content="@everyone", created_by=interaction.user.id, interaction=interaction)
+
+@bot.tree.command(name="anuncios", description="Lista los anuncios programados de este servidor")
+@app_commands.checks.has_permissions(administrator=True)
+async def anuncios(interaction: discord.Interaction):
+    pending = announcements.for_guild(interaction.guild.id)
+    if not pending:
+        await interaction.response.send_message("✅ No hay anuncios programados.", ephemeral=True)
+        return
+    
+    embed = discord.Embed(title="🗓️ Anuncios Programados", color=discord.Color.blue(), timestamp=datetime.now())
+    for record in pending[:25]:
+        embed.add_field(
+            name=(record['embed'].get('title') or 'Anuncio')[:256],
+            value=f"**ID:** `{record['id']}`\n**Cuándo:** <t:{int(record['due_at'])}:R>\n**Canales:** {len(record['channel_ids'])}",
+            inline=False
+        )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="cancelaranuncio", description="Cancela un anuncio programado")
+@app_commands.checks.has_permissions(administrator=True)
+async def cancelaranuncio(interaction: discord.Interaction, anuncio_id: str):
+    record = announcements.get(anuncio_id)
+    if not record or record['guild_id'] != interaction.guild.id:
+        await interaction.response.send_message("❌ No hay ningún anuncio programado con ese ID.", ephemeral=True)
+        return
+    announcements.cancel(anuncio_id)
+    await interaction.response.send_message("✅ Anuncio cancelado.", ephemeral=True)
+
+@bot.tree.command(name="addannouncechannel", description="Añade un canal (de este u otro servidor) a los anuncios")
+@app_commands.checks.has_permissions(administrator=True)
+async def addannouncechannel(interaction: discord.Interaction, canal_id: str):
+    state = await guild_states.get(interaction.guild.id)
+    channel_ids = state.config.setdefault('announce_channel_ids', [])
+    try:
+        channel = bot.get_channel(int(canal_id))
+    except ValueError:
+        channel = None
+    if not isinstance(channel, discord.TextChannel):
+        await interaction.response.send_message("❌ No encuentro ese canal de texto. El bot tiene que estar en su servidor.", ephemeral=True)
+        return
+    # Publicar en otro servidor exige ser staff también allí
+    member = channel.guild.get_member(interaction.user.id)
+    if not member or not channel.permissions_for(member).manage_guild:
+        await interaction.response.send_message(f"❌ Necesitas el permiso de gestionar el servidor en **{channel.guild.name}**.", ephemeral=True)
+        return
+    if channel.id in channel_ids:
+        await interaction.response.send_message("❌ Ese canal ya recibe los anuncios.", ephemeral=True)
+        return
+    if len(channel_ids) >= ANNOUNCE_MAX_CHANNELS:
+        await interaction.response.send_message(f"❌ No se pueden tener más de {ANNOUNCE_MAX_CHANNELS} canales de anuncios.", ephemeral=True)
+        return
+    
+    channel_ids.append(channel.id)
+    save_data(state, ('config', 'announce_channel_ids'))
+    await interaction.response.send_message(f"✅ {channel.mention} (**{channel.guild.name}**) recibirá los anuncios y los avisos de estado.", ephemeral=True)
+
+@bot.tree.command(name="removeannouncechannel", description="Quita un canal de los anuncios")
+@app_commands.checks.has_permissions(administrator=True)
+async def removeannouncechannel(interaction: discord.Interaction, canal_id: str):
+    state = await guild_states.get(interaction.guild.id)
+    channel_ids = state.config.setdefault('announce_channel_ids', [])
+    if not canal_id.isdigit() or int(canal_id) not in channel_ids:
+        await interaction.response.send_message("❌ Ese canal no está en la lista de anuncios.", ephemeral=True)
+        return
+    channel_ids.remove(int(canal_id))
+    save_data(state, ('config', 'announce_channel_ids'))
+    await interaction.response.send_message("✅ Canal quitado de los anuncios.", ephemeral=True)
 
 # ==================== PANEL DE CONTROL ====================
 
 @bot.tree.command(name="panel", description="Muestra el panel de control del servidor")
 async def panel(interaction: discord.Interaction):
-    status = "🟢 Online" if bot_data['server_status'] == 'online' else "🔴 Offline"
-    ban_count = len(bot_data['banned_users'])
-    ticket_count = len([t for t in bot_data['tickets'].values() if t.get('open', False)])
+    state = await guild_states.get(interaction.guild.id)
+    status = "🟢 Online" if state.data['server_status'] == 'online' else "🔴 Offline"
+    ban_count = len(await state.load_bans())
+    ticket_count = state.index.open_count
     
     embed = discord.Embed(
         title="🎮 Panel de Control - FiveM",
         description="Estado actual del servidor y estadísticas",
-        color=discord.Color.green() if bot_data['server_status'] == 'online' else discord.Color.red(),
+        color=discord.Color.green() if state.data['server_status'] == 'online' else discord.Color.red(),
         timestamp=datetime.now()
     )
     embed.add_field(name="📡 Estado del Servidor", value=status, inline=True)
     embed.add_field(name="🔨 Usuarios Baneados", value=f"`{ban_count}`", inline=True)
     embed.add_field(name="🎫 Tickets Activos", value=f"`{ticket_count}`", inline=True)
     
-    if bot_data['config']['server_logo']:
-        embed.set_thumbnail(url=bot_data['config']['server_logo'])
+    snapshot = fivem_status.snapshot(interaction.guild.id)
+    if snapshot and snapshot['online']:
+        embed.add_field(name="👥 Jugadores", value=f"`{snapshot['players']}/{snapshot['max_players']}`", inline=True)
+    
+    if state.config['server_logo']:
+        embed.set_thumbnail(url=state.config['server_logo'])
     
     embed.set_footer(text=f"Solicitado por {interaction.user.name}", icon_url=interaction.user.display_avatar.url)
     
     await interaction.response.send_message(embed=embed)
 
-# ==================== SISTEMA DE TICKETS ====================
+def _format_seconds(seconds):
+    if seconds == float('inf'):
+        return f"> {METRICS_BUCKETS[-1]:g} s"
+    return f"{seconds * 1000:.0f} ms" if seconds < 1 else f"{seconds:g} s"
 
-class TicketButtonView(discord.ui.View):
-    def __init__(self):
-        super().__init__(timeout=None)
+def _format_histogram(histogram):
+    return f"p50 ≤ {_format_seconds(histogram.quantile(0.5))} · p99 ≤ {_format_seconds(histogram.quantile(0.99))}"
+
+@bot.tree.command(name="stats", description="Latencias y colas internas del bot")
+@app_commands.checks.has_permissions(administrator=True)
+async def stats(interaction: discord.Interaction):
+    embed = discord.Embed(
+        title="📊 Estadísticas del Bot",
+        description=f"Latencia del gateway: **{bot.latency * 1000:.0f} ms**",
+        color=discord.Color.blurple(),
+        timestamp=datetime.now()
+    )
+    
+    commands_by_use = sorted(metrics.merged('bot_command_seconds', 'command').items(), key=lambda item: -item[1].count)[:10]
+    if commands_by_use:
+        embed.add_field(
+            name="⏱️ Comandos más usados",
+            value="\n".join(f"`{name}` ×{h.count} — {_format_histogram(h)}" for name, h in commands_by_use),
+            inline=False
+        )
+    
+    phases = metrics.merged('bot_phase_seconds', 'phase')
+    if phases:
+        embed.add_field(
+            name="🧩 Fases",
+            value="\n".join(f"`{name}` — {_format_histogram(h)}" for name, h in sorted(phases.items())),
+            inline=False
+        )
     
-    @discord.ui.button(label="Soporte Técnico", style=discord.ButtonStyle.primary, emoji="🛠️", custom_id="ticket_soporte")
-    async def soporte_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await create_ticket(interaction, "soporte")
+    lag = metrics.merged('bot_event_loop_lag_seconds', None).get(None)
+    embed.add_field(
+        name="🔄 Event loop",
+        value=f"Retraso actual: {_format_seconds(metrics.loop_lag)}" + (f"\n{_format_histogram(lag)}" if lag else ""),
+        inline=True
+    )
+    embed.add_field(
+        name="📥 Colas",
+        value="\n".join(f"`{name.removeprefix('bot_')}`: {func()}" for name, func in sorted(metrics.gauges.items())),
+        inline=True
+    )
     
-    @discord.ui.button(label="Donaciones", style=discord.ButtonStyle.success, emoji="💰", custom_id="ticket_donaciones")
-    async def donaciones_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await create_ticket(interaction, "donaciones")
+    flushes = metrics.merged('bot_persistence_flush_seconds', 'kind')
+    if flushes:
+        embed.add_field(
+            name="💾 Escrituras a disco",
+            value="\n".join(f"`{kind}` ×{h.count} — {_format_histogram(h)}" for kind, h in sorted(flushes.items())),
+            inline=False
+        )
     
-    @discord.ui.button(label="Gangas", style=discord.ButtonStyle.secondary, emoji="🎁", custom_id="ticket_gangas")
-    async def gangas_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await create_ticket(interaction, "gangas")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# ==================== SISTEMA DE TICKETS ====================
+
+TICKET_BUTTONS_MAX = 5  # Con más tipos el panel usa un menú desplegable
+TICKET_SELECT_MAX = 25  # Opciones máximas de un menú de Discord
+TICKET_SELECT_ID = 'ticketpanel_select'
+TICKET_TYPE_RE = re.compile(r'[a-z0-9_-]{1,32}')
+# Caracteres con presentación emoji según Unicode (emoji-data). En U+2xxx solo
+# son emoji algunos sueltos: flechas como →, operadores o cajas no lo son y
+# Discord rechaza el panel entero si un botón los lleva.
+EMOJI_CHARS = (
+    r'©®‼⁉™ℹ↔-↙↩↪⌚⌛⌨⏏'
+    r'⏩-⏳⏸-⏺Ⓜ▪▫▶◀◻-◾☀-☄☎'
+    r'☑☔☕☘☝☠☢☣☦☪☮☯☸-☺'
+    r'♀♂♈-♓♟♠♣♥♦♨♻♾♿'
+    r'⚒-⚗⚙⚛⚜⚠⚡⚧⚪⚫⚰⚱⚽⚾'
+    r'⛄⛅⛈⛎⛏⛑⛓⛔⛩⛪⛰-⛵⛷-⛺'
+    r'⛽✂✅✈-✍✏✒✔✖✝✡✨✳✴'
+    r'❄❇❌❎❓-❕❗❣❤➕-➗➡➰➿'
+    r'⤴⤵⬅-⬇⬛⬜⭐⭕〰〽㊗㊙'
+    r'\U0001F004\U0001F0CF\U0001F170\U0001F171\U0001F17E\U0001F17F\U0001F18E\U0001F191-\U0001F19A'
+    r'\U0001F201\U0001F202\U0001F21A\U0001F22F\U0001F232-\U0001F23A\U0001F250\U0001F251'
+    r'\U0001F300-\U0001F64F\U0001F680-\U0001F6FF\U0001F7E0-\U0001F7EB\U0001F7F0'
+    r'\U0001F90C-\U0001F9FF\U0001FA70-\U0001FAFF'
+)
+# Un único emoji Unicode: bandera, tecla (1️⃣) o emoji con variantes de tono,
+# etiquetas y uniones ZWJ (👨‍💻)
+UNICODE_EMOJI_RE = re.compile(
+    r'[\U0001F1E6-\U0001F1FF]{2}'
+    r'|[0-9#*]\ufe0f?\u20e3'
+    rf'|[{EMOJI_CHARS}]\ufe0f?[\U0001F3FB-\U0001F3FF]?[\U000E0020-\U000E007F]*'
+    rf'(?:\u200d[{EMOJI_CHARS}]\ufe0f?[\U0001F3FB-\U0001F3FF]?)*'
+)
+
+# Emoji normalizado ('<:nombre:id>' o el carácter Unicode), o None si no es válido
+def parse_emoji(text):
+    emoji = discord.PartialEmoji.from_str(text.strip())
+    if emoji.id:
+        return str(emoji)
+    return emoji.name if UNICODE_EMOJI_RE.fullmatch(emoji.name) else None
+
+TICKET_BUTTON_STYLES = {
+    'primary': discord.ButtonStyle.primary,
+    'success': discord.ButtonStyle.success,
+    'secondary': discord.ButtonStyle.secondary,
+    'danger': discord.ButtonStyle.danger
+}
+
+def _category_label(info):
+    return info['name'].removeprefix(info['emoji']).strip() or info['name']
+
+# El panel se genera desde config['ticket_categories']. Sus botones no tienen
+# callback: on_interaction enruta el custom_id, así los paneles enviados antes
+# de un reinicio (o de añadir tipos) siguen funcionando sin registrar vistas.
+class TicketPanelView(discord.ui.View):
+    def __init__(self, categories):
+        super().__init__(timeout=None)
+        if len(categories) <= TICKET_BUTTONS_MAX:
+            for tipo, info in categories.items():
+                self.add_item(discord.ui.Button(
+                    label=_category_label(info)[:80],
+                    emoji=info['emoji'] or None,
+                    style=TICKET_BUTTON_STYLES.get(info.get('style'), discord.ButtonStyle.primary),
+                    custom_id=f"ticket_{tipo}"
+                ))
+        else:
+            self.add_item(discord.ui.Select(
+                custom_id=TICKET_SELECT_ID,
+                placeholder="🎫 Selecciona el tipo de ticket",
+                options=[
+                    discord.SelectOption(label=_category_label(info)[:100], value=tipo, emoji=info['emoji'] or None, description=info['description'][:100])
+                    for tipo, info in categories.items()
+                ]
+            ))
+
+# custom_id del botón -> tipo de ticket
+def ticket_routes(state):
+    return state.templates.value('ticket_routes', lambda: {f"ticket_{tipo}": tipo for tipo in state.config['ticket_categories']})
+
+@bot.event
+async def on_interaction(interaction: discord.Interaction):
+    if interaction.type != discord.InteractionType.component or interaction.guild is None:
+        return
+    custom_id = interaction.data.get('custom_id', '')
+    if custom_id == TICKET_SELECT_ID:
+        tipo = interaction.data['values'][0]
+        if not await allow_interaction(interaction, f'ticket:{tipo}'):
+            return
+        state = await guild_states.get(interaction.guild.id)
+    elif custom_id.startswith('ticket_'):
+        if not await allow_interaction(interaction, f'ticket:{custom_id.removeprefix("ticket_")}'):
+            return
+        state = await guild_states.get(interaction.guild.id)
+        tipo = ticket_routes(state).get(custom_id)
+    else:
+        return
     
-    @discord.ui.button(label="Reporte a Jugador", style=discord.ButtonStyle.danger, emoji="🚨", custom_id="ticket_reporte")
-    async def reporte_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await create_ticket(interaction, "reporte")
+    if tipo not in state.config['ticket_categories']:
+        await interaction.response.send_message("❌ Este tipo de ticket ya no existe. Pide a un administrador que actualice el panel.", ephemeral=True)
+        return
+    await create_ticket(interaction, tipo)
 
 class CloseTicketView(discord.ui.View):
     def __init__(self):
         super().__init__(timeout=None)
     
+    async def interaction_check(self, interaction: discord.Interaction):
+        return await allow_interaction(interaction, 'ticket_close')
+    
     @discord.ui.button(label="Cerrar Ticket", style=discord.ButtonStyle.danger, emoji="🔒", custom_id="close_ticket")
+    @instrumented('close_ticket')
     async def close_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         await close_ticket_action(interaction)
     
     @discord.ui.button(label="Transcript", style=discord.ButtonStyle.secondary, emoji="📄", custom_id="transcript_ticket")
+    @instrumented('transcript_ticket')
     async def transcript_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         await create_transcript(interaction)
 
 @bot.tree.command(name="ticketpanel", description="Crea el panel de tickets con botones")
 @app_commands.checks.has_permissions(administrator=True)
 async def ticketpanel(interaction: discord.Interaction):
+    state = await guild_states.get(interaction.guild.id)
     # Verificar que las categorías estén configuradas
     missing_categories = []
-    for tipo, data in bot_data['config']['ticket_categories'].items():
+    for tipo, data in state.config['ticket_categories'].items():
         if data['category_id'] is None:
             missing_categories.append(data['name'])
     
+    if not state.config['ticket_categories']:
+        await interaction.response.send_message("❌ No hay tipos de ticket. Usa `/addcategory` para crear alguno.", ephemeral=True)
+        return
+    
     if missing_categories:
         await interaction.response.send_message(
             f"❌ Faltan configurar categorías:\n" + "\n".join([f"• {cat}" for cat in missing_categories]) + 
@@ -484,118 +3640,721 @@ async def ticketpanel(interaction: discord.Interaction):
         )
         return
     
-    embed = discord.Embed(
-        title="🎫 Sistema de Tickets",
-        description="**Bienvenido al sistema de soporte**\n\n"
-                    "Selecciona el tipo de ticket que necesitas abriendo haciendo clic en uno de los botones de abajo:\n\n"
-                    "🛠️ **Soporte Técnico**\n"
-                    "Problemas técnicos, bugs del servidor o ayuda general\n\n"
-                    "💰 **Donaciones**\n"
-                    "Consultas sobre donaciones, VIP y beneficios\n\n"
-                    "🎁 **Gangas**\n"
-                    "Ofertas especiales, eventos y promociones\n\n"
-                    "🚨 **Reporte a Jugador**\n"
-                    "Reportar jugadores que incumplen las normas",
-        color=discord.Color.blue(),
-        timestamp=datetime.now()
-    )
-    
-    if bot_data['config']['server_logo']:
-        embed.set_thumbnail(url=bot_data['config']['server_logo'])
-    
-    embed.set_footer(text="Haz clic en un botón para abrir tu ticket")
+    embed = state.templates.embed('ticket_panel', lambda: _build_ticket_panel_template(state.config))
+    view = state.templates.view('ticket_panel', lambda: TicketPanelView(state.config['ticket_categories']))
     
     # Determinar canal
-    if bot_data['config']['ticket_panel_channel_id']:
-        channel = interaction.guild.get_channel(bot_data['config']['ticket_panel_channel_id'])
+    if state.config['ticket_panel_channel_id']:
+        channel = interaction.guild.get_channel(state.config['ticket_panel_channel_id'])
         if channel:
-            view = TicketButtonView()
             await channel.send(embed=embed, view=view)
             await interaction.response.send_message("✅ Panel de tickets creado en el canal configurado.", ephemeral=True)
         else:
-            view = TicketButtonView()
             await interaction.channel.send(embed=embed, view=view)
             await interaction.response.send_message("✅ Panel de tickets creado en este canal.", ephemeral=True)
     else:
-        view = TicketButtonView()
         await interaction.channel.send(embed=embed, view=view)
         await interaction.response.send_message("✅ Panel de tickets creado.", ephemeral=True)
 
+# ==================== ASIGNACIÓN DE TICKETS ====================
+# Cada usuario crea sus tickets de uno en uno (dos clics seguidos no abren dos
+# tickets) y el número se reserva sin esperas y se devuelve si Discord falla.
+# Cuántos canales se crean a la vez lo limita la ruta 'channel_create' del
+# planificador de peticiones.
+class TicketAllocator:
+    def __init__(self, state):
+        self.state = state
+        self._user_locks = {}  # user_id -> [lock, nº de usos]; se borra al quedar libre
+
+    def is_busy(self, user_id):
+        return user_id in self._user_locks
+
+    @property
+    def active(self):
+        return bool(self._user_locks)
+
+    # Números devueltos por creaciones fallidas (min-heap). Se guardan con la
+    # configuración para reutilizarlos también tras un reinicio
+    @property
+    def released(self):
+        return self.state.config.setdefault('released_ticket_numbers', [])
+
+    @asynccontextmanager
+    async def user_lock(self, user_id):
+        entry = self._user_locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[user_id]
+
+    def reserve_number(self):
+        released = self.released
+        if released:
+            number = heapq.heappop(released)
+            save_data(self.state, ('config', 'released_ticket_numbers'))
+            return number
+        config = self.state.config
+        config['ticket_counter'] += 1
+        save_data(self.state, ('config', 'ticket_counter'))
+        return config['ticket_counter']
+
+    def release_number(self, number):
+        config = self.state.config
+        if number == config['ticket_counter']:
+            config['ticket_counter'] -= 1
+            save_data(self.state, ('config', 'ticket_counter'))
+        else:
+            heapq.heappush(self.released, number)
+            save_data(self.state, ('config', 'released_ticket_numbers'))
+
+@instrumented('create_ticket')
 async def create_ticket(interaction: discord.Interaction, ticket_type: str):
-    await interaction.response.defer(ephemeral=True)
+    with metrics.phase('defer'):
+        await interaction.response.defer(ephemeral=True)
     
-    ticket_info = bot_data['config']['ticket_categories'][ticket_type]
+    state = await guild_states.get(interaction.guild.id)
+    ticket_info = state.config['ticket_categories'][ticket_type]
     
     if not ticket_info['category_id']:
         await interaction.followup.send(f"❌ La categoría de {ticket_info['name']} no está configurada. Contacta con un administrador.", ephemeral=True)
         return
     
-    # Verificar si ya tiene un ticket abierto
-    for ticket in bot_data['tickets'].values():
-        if ticket.get('user_id') == interaction.user.id and ticket.get('open', False):
-            channel = interaction.guild.get_channel(ticket['channel_id'])
-            await interaction.followup.send(f"❌ Ya tienes un ticket abierto: {channel.mention}", ephemeral=True)
-            return
+    if state.allocator.is_busy(interaction.user.id):
+        await interaction.followup.send("⏳ Tu ticket ya se está creando, espera un momento.", ephemeral=True)
+        return
     
     try:
-        bot_data['config']['ticket_counter'] += 1
-        ticket_number = str(bot_data['config']['ticket_counter']).zfill(4)
-        
-        category = interaction.guild.get_channel(ticket_info['category_id'])
+        async with state.allocator.user_lock(interaction.user.id):
+            # Verificar si ya tiene un ticket abierto
+            ticket = state.index.open_ticket_for(interaction.user.id)
+            if ticket:
+                channel = interaction.guild.get_channel(ticket['channel_id'])
+                if channel:
+                    await interaction.followup.send(f"❌ Ya tienes un ticket abierto: {channel.mention}", ephemeral=True)
+                    return
+                # El canal se borró a mano: dar el ticket por cerrado
+                mark_ticket_closed(state, ticket, None)
+            
+            category = interaction.guild.get_channel(ticket_info['category_id'])
+            if not isinstance(category, discord.CategoryChannel):
+                await interaction.followup.send(f"❌ La categoría de {ticket_info['name']} ya no existe. Contacta con un administrador.", ephemeral=True)
+                return
+            
+            overwrites = {
+                interaction.guild.default_role: discord.PermissionOverwrite(view_channel=False),
+                interaction.user: discord.PermissionOverwrite(view_channel=True, send_messages=True, read_message_history=True, attach_files=True),
+                interaction.guild.me: discord.PermissionOverwrite(view_channel=True, send_messages=True, read_message_history=True, manage_channels=True)
+            }
+            
+            # Añadir permisos al staff si está configurado
+            if state.config['staff_role_id']:
+                staff_role = interaction.guild.get_role(state.config['staff_role_id'])
+                if staff_role:
+                    overwrites[staff_role] = discord.PermissionOverwrite(view_channel=True, send_messages=True, read_message_history=True)
+            
+            number = state.allocator.reserve_number()
+            ticket_number = str(number).zfill(4)
+            try:
+                channel = await outbound.run('channel_create', lambda: category.create_text_channel(
+                    name=f"ticket-{ticket_number}",
+                    overwrites=overwrites
+                ))
+            except Exception:
+                state.allocator.release_number(number)
+                raise
+            
+            state.data['tickets'][str(channel.id)] = {
+                'user_id': interaction.user.id,
+                'type': ticket_type,
+                'number': ticket_number,
+                'channel_id': channel.id,
+                'open': True,
+                'created_at': int(datetime.now().timestamp()),
+                'messages': []
+            }
+            state.index.add(str(channel.id), state.data['tickets'][str(channel.id)])
+            save_data(state, ('tickets', str(channel.id)))
         
-        overwrites = {
-            interaction.guild.default_role: discord.PermissionOverwrite(view_channel=False),
-            interaction.user: discord.PermissionOverwrite(view_channel=True, send_messages=True, read_message_history=True, attach_files=True),
-            interaction.guild.me: discord.PermissionOverwrite(view_channel=True, send_messages=True, read_message_history=True, manage_channels=True)
-        }
+        embed = state.templates.embed(('ticket_welcome', ticket_type), lambda: _build_ticket_welcome_template(state.config, ticket_type))
+        embed.title = f"{ticket_info['emoji']} Ticket #{ticket_number} - {ticket_info['name']}"
+        embed.description = (f"¡Hola {interaction.user.mention}!\n\n"
+                             f"Gracias por abrir un ticket. Un miembro del staff te atenderá pronto.\n\n"
+                             f"{embed.description}"
+                             f"**Creado:** <t:{int(datetime.now().timestamp())}:R>")
+        embed.set_footer(text=f"Ticket creado por {interaction.user.name}", icon_url=interaction.user.display_avatar.url)
         
-        # Añadir permisos al staff si está configurado
-        if bot_data['config']['staff_role_id']:
-            staff_role = interaction.guild.get_role(bot_data['config']['staff_role_id'])
-            if staff_role:
-                overwrites[staff_role] = discord.PermissionOverwrite(view_channel=True, send_messages=True, read_message_history=True)
+        view = state.templates.view('close_ticket', CloseTicketView)
         
-        channel = await category.create_text_channel(
-            name=f"ticket-{ticket_number}",
-            overwrites=overwrites
-        )
+        staff_role_id = state.config['staff_role_id']
+        mention_text = interaction.user.mention + state.templates.value('staff_mention', lambda: f" <@&{staff_role_id}>" if staff_role_id else "")
         
-        bot_data['tickets'][str(channel.id)] = {
-            'user_id': interaction.user.id,
-            'type': ticket_type,
-            'number': ticket_number,
-            'channel_id': channel.id,
-            'open': True,
-            'created_at': int(datetime.now().timestamp()),
-            'messages': []
-        }
-        save_data(bot_data)
+        # Primero el enlace al usuario; el mensaje de bienvenida puede tardar algo más
+        with metrics.phase('followup'):
+            await interaction.followup.send(f"✅ Ticket creado: {channel.mention}", ephemeral=True)
+        await outbound.run('message', lambda: channel.send(content=mention_text, embed=embed, view=view))
         
-        embed = discord.Embed(
-            title=f"{ticket_info['emoji']} Ticket #{ticket_number} - {ticket_info['name']}",
-            description=f"¡Hola {interaction.user.mention}!\n\n"
-                       f"Gracias por abrir un ticket. Un miembro del staff te atenderá pronto.\n\n"
-                       f"**Categoría:** {ticket_info['name']}\n"
-                       f"**Descripción:** {ticket_info['description']}\n"
-                       f"**Creado:** <t:{int(datetime.now().timestamp())}:R>",
-            color=discord.Color.blue(),
-            timestamp=datetime.now()
+        await log_action(interaction.guild, "Ticket Creado", f"{interaction.user.mention} creó el ticket #{ticket_number}\n**Tipo:** {ticket_info['name']}")
+    except Exception as e:
+        await interaction.followup.send(f"❌ Error al crear el ticket: {e}", ephemeral=True)
+
+def mark_ticket_closed(state, ticket, closed_by):
+    key = str(ticket['channel_id'])
+    ticket['open'] = False
+    ticket['closed_at'] = int(datetime.now().timestamp())
+    ticket['closed_by'] = closed_by
+    state.index.remove(key, ticket)
+    del state.data['tickets'][key]
+    if persistence.running:
+        persistence.mark_archived(state, key, ticket)
+    else:
+        state.store.archive([(key, ticket, json_dumps(ticket))])
+
+async def close_ticket_action(interaction: discord.Interaction):
+    state = await guild_states.get(interaction.guild.id)
+    ticket = state.index.by_channel(interaction.channel.id)
+    
+    if not ticket or not ticket.get('open', False):
+        await interaction.response.send_message("❌ Este canal no es un ticket abierto.", ephemeral=True)
+        return
+    
+    if ticket.get('closing'):
+        await interaction.response.send_message("⏳ Este ticket ya se está cerrando.", ephemeral=True)
+        return
+    
+    ticket['closing'] = True
+    try:
+        with metrics.phase('defer'):
+            await interaction.response.send_message(f"🔒 {interaction.user.mention} ha cerrado el ticket. ⏳ En cola...")
+        with metrics.phase('followup'):
+            status = await interaction.original_response()
+    except Exception:
+        ticket['closing'] = False
+        raise
+    
+    ticket['closing'] = jobs.submit(
+        'close',
+        guild_id=interaction.guild.id,
+        channel_id=interaction.channel.id,
+        user_id=interaction.user.id,
+        status_channel_id=status.channel.id,
+        status_message_id=status.id
+    )
+    save_data(state, ('tickets', str(interaction.channel.id)))
+
+# ==================== TRANSCRIPTS ====================
+# El historial se recorre página a página (channel.history pide 100 mensajes
+# cada vez) y cada mensaje se escribe ya convertido a HTML en un gzip sobre un
+# fichero temporal que pasa a disco al superar TRANSCRIPT_SPOOL_MEMORY. Cuando
+# la parte actual se acerca al límite de subida del servidor se cierra, se
+# sube y se empieza otra, así que la memoria no depende del largo del ticket.
+TRANSCRIPT_SPOOL_MEMORY = 1024 * 1024
+TRANSCRIPT_FLUSH_EVERY = 256 * 1024  # Bytes sin comprimir entre flushes del gzip
+TRANSCRIPT_SIZE_MARGIN = 512 * 1024  # Margen bajo el límite de subida
+TRANSCRIPT_PROGRESS_EVERY = 500  # Mensajes entre avisos de progreso
+
+TRANSCRIPT_HEADER = """<!DOCTYPE html>
+<html lang="es"><head><meta charset="utf-8"><title>{title}</title>
+<style>
+body{{font-family:sans-serif;background:#36393f;color:#dcddde;margin:20px}}
+.msg{{padding:6px 0;border-bottom:1px solid #2f3136}}
+.author{{font-weight:bold;color:#fff}}
+.time{{color:#72767d;font-size:12px;margin-left:8px}}
+.content{{white-space:pre-wrap;margin-top:2px}}
+.embed{{border-left:4px solid #5865f2;padding-left:8px;margin-top:4px}}
+a{{color:#00aff4}}
+</style></head><body>
+<h2>{title}</h2>
+"""
+TRANSCRIPT_FOOTER = "</body></html>\n"
+
+def _render_message(message):
+    parts = [
+        '<div class="msg">',
+        f'<span class="author">{html.escape(str(message.author))}</span>',
+        f'<span class="time">{message.created_at:%Y-%m-%d %H:%M:%S} UTC</span>'
+    ]
+    if message.content:
+        parts.append(f'<div class="content">{html.escape(message.content)}</div>')
+    for embed in message.embeds:
+        texto = ' — '.join(html.escape(t) for t in (embed.title, embed.description) if t)
+        if texto:
+            parts.append(f'<div class="embed">{texto}</div>')
+    for attachment in message.attachments:
+        parts.append(f'<div>📎 <a href="{html.escape(attachment.url)}">{html.escape(attachment.filename)}</a> ({attachment.size} bytes)</div>')
+    parts.append('</div>\n')
+    return ''.join(parts)
+
+class TranscriptPart:
+    def __init__(self, title, index):
+        self.index = index
+        self.messages = 0
+        self.buffer = tempfile.SpooledTemporaryFile(max_size=TRANSCRIPT_SPOOL_MEMORY)
+        self._gz = gzip.GzipFile(fileobj=self.buffer, mode='wb', mtime=0)
+        self._unflushed = 0
+        self.write(TRANSCRIPT_HEADER.format(title=html.escape(f'{title} (parte {index})')))
+
+    # Cota superior del tamaño comprimido: lo ya volcado más lo pendiente sin comprimir
+    @property
+    def size(self):
+        return self.buffer.tell() + self._unflushed
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self._gz.write(data)
+        self._unflushed += len(data)
+        if self._unflushed >= TRANSCRIPT_FLUSH_EVERY:
+            self._gz.flush(zlib.Z_SYNC_FLUSH)
+            self._unflushed = 0
+
+    def finish(self):
+        self.write(TRANSCRIPT_FOOTER)
+        self._gz.close()
+        self.buffer.seek(0)
+        return self.buffer
+
+async def stream_transcript(channel, title, size_limit, progress=None):
+    part = TranscriptPart(title, 1)
+    total = 0
+    try:
+        async for message in channel.history(limit=None, oldest_first=True):
+            chunk = _render_message(message)
+            if part.messages and part.size + len(chunk.encode('utf-8')) + len(TRANSCRIPT_FOOTER) > size_limit - TRANSCRIPT_SIZE_MARGIN:
+                yield part
+                part = TranscriptPart(title, part.index + 1)
+            part.write(chunk)
+            part.messages += 1
+            total += 1
+            if progress and total % TRANSCRIPT_PROGRESS_EVERY == 0:
+                await progress(f"📄 Generando transcript... {total} mensajes")
+        yield part
+    finally:
+        part.buffer.close()
+
+async def generate_transcript(state, channel, ticket, requested_by, progress=None):
+    destino = channel
+    if state.config['transcript_channel_id']:
+        destino = channel.guild.get_channel(state.config['transcript_channel_id']) or destino
+    
+    title = f"Ticket #{ticket['number']} - {channel.name}"
+    total_messages = 0
+    urls = []
+    async for part in stream_transcript(channel, title, channel.guild.filesize_limit, progress):
+        fp = part.finish()
+        filename = f"transcript-{ticket['number']}-parte{part.index}.html.gz"
+        sent = await outbound.run(
+            'transcript',
+            lambda: destino.send(
+                content=f"📄 Transcript del ticket #{ticket['number']} (parte {part.index}, {part.messages} mensajes) — generado por <@{requested_by}>",
+                file=discord.File(fp, filename=filename)
+            ),
+            PRIORITY_BACKGROUND
         )
+        fp.close()
+        total_messages += part.messages
+        urls.append(sent.jump_url)
+        if progress:
+            await progress(f"📄 Transcript: parte {part.index} subida ({total_messages} mensajes)")
+    
+    ticket['transcript'] = {
+        'generated_at': int(datetime.now().timestamp()),
+        'generated_by': requested_by,
+        'message_count': total_messages,
+        'parts': urls
+    }
+    if state.index.by_channel(channel.id) is ticket:
+        save_data(state, ('tickets', str(channel.id)))
+    return total_messages, urls
+
+async def create_transcript(interaction: discord.Interaction):
+    state = await guild_states.get(interaction.guild.id)
+    ticket = await state.index.lookup(interaction.channel.id)
+    if not ticket:
+        await interaction.response.send_message("❌ Este canal no es un ticket.", ephemeral=True)
+        return
+    
+    await interaction.response.send_message(f"📄 Transcript solicitado por {interaction.user.mention}. ⏳ En cola...")
+    status = await interaction.original_response()
+    jobs.submit(
+        'transcript',
+        guild_id=interaction.guild.id,
+        channel_id=interaction.channel.id,
+        user_id=interaction.user.id,
+        status_channel_id=status.channel.id,
+        status_message_id=status.id
+    )
+
+# ==================== COLA DE TRABAJOS ====================
+# Cerrar tickets y generar transcripts son trabajos largos: los botones solo los
+# encolan y responden al momento. Un grupo de workers los ejecuta en paralelo,
+# editando el mensaje de estado según avanzan. Los trabajos se guardan en
+# la partición global (se retoman tras un reinicio) y se reintentan con espera
+# exponencial si fallan.
+JOB_WORKERS = 4
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BASE = 5  # Segundos antes del primer reintento; se dobla en cada fallo
+JOB_PROGRESS_INTERVAL = 2  # Segundos mínimos entre ediciones del mensaje de estado
+CLOSE_DELETE_DELAY = 5
+
+class JobContext:
+    def __init__(self, job_id, job):
+        self.job_id = job_id
+        self.job = job
+        self._last_progress = 0
+
+    def save(self):
+        save_data(jobs.state, ('jobs', self.job_id))
+
+    async def progress(self, text, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_progress < JOB_PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        channel = bot.get_channel(self.job['status_channel_id'])
+        if not channel:
+            return
+        message = channel.get_partial_message(self.job['status_message_id'])
+        try:
+            await outbound.run('job_status', lambda: message.edit(content=text))
+        except discord.HTTPException:
+            pass  # El progreso es informativo: no debe tumbar el trabajo
+
+class JobQueue:
+    def __init__(self, state, workers):
+        self.state = state
+        self.workers = workers
+        self._jobs = None  # id -> trabajo; se enlaza en load
+        self._handlers = {}
+        self._queue = asyncio.Queue()
+        self._tasks = []
+
+    def load(self):
+        self._jobs = self.state.data.setdefault('jobs', {})
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def handler(self, kind):
+        def decorator(func):
+            self._handlers[kind] = func
+            return func
+        return decorator
+
+    def has(self, job_id):
+        return job_id in self._jobs
+
+    def has_guild(self, guild_id):
+        return any(job.get('guild_id') == guild_id for job in self._jobs.values())
+
+    def start(self):
+        for job_id in self._jobs:
+            self._queue.put_nowait(job_id)
+        if self._jobs:
+            print(f'🔁 {len(self._jobs)} trabajos pendientes retomados')
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(), name=f'jobs-{i}') for i in range(self.workers)]
+
+    async def stop(self):
+        # Lo que esté a medias se repite en el siguiente arranque
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, kind, **fields):
+        job_id = f'{kind}-{time.time_ns()}'
+        self._jobs[job_id] = {'kind': kind, 'attempts': 0, 'created_at': int(datetime.now().timestamp()), **fields}
+        save_data(self.state, ('jobs', job_id))
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    # Trabajos que venían en los datos de un servidor (formato anterior)
+    def adopt(self, pending):
+        self._jobs.update(pending)
+        save_data(self.state, *[('jobs', job_id) for job_id in pending])
+        if self._tasks:
+            for job_id in pending:
+                self._queue.put_nowait(job_id)
+
+    def _retry_later(self, job_id, delay):
+        asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job:
+                await self._execute(job_id, job)
+            self._queue.task_done()
+
+    async def _execute(self, job_id, job):
+        ctx = JobContext(job_id, job)
+        try:
+            await self._handlers[job['kind']](ctx)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job['attempts'] += 1
+            if job['attempts'] >= JOB_MAX_ATTEMPTS:
+                print(f'❌ Trabajo {job_id} abandonado tras {job["attempts"]} intentos: {e}')
+                del self._jobs[job_id]
+                ctx.save()
+                await self._on_failed(job)
+                await ctx.progress(f"❌ No se pudo completar la operación: {e}", force=True)
+                return
+            delay = JOB_RETRY_BASE * 2 ** (job['attempts'] - 1)
+            print(f'⚠️ Trabajo {job_id} falló (intento {job["attempts"]}), reintento en {delay}s: {e}')
+            ctx.save()
+            await ctx.progress(f"⚠️ Error, reintentando en {delay}s...", force=True)
+            self._retry_later(job_id, delay)
+            return
         
-        if bot_data['config']['server_logo']:
-            embed.set_thumbnail(url=bot_data['config']['server_logo'])
-        
-        embed.set_footer(text=f"Ticket creado por {interaction.user.name}", icon_url=interaction.user.display_avatar.url)
-        
-        view = CloseTicketView()
-        
-        mention_text = interaction.user.mention
-        if bot_data['config']['staff_role_id']:
-            mention_text += f" <@&{bot_data['config']['staff_role_id']}>"
+        del self._jobs[job_id]
+        ctx.save()
+
+    async def _on_failed(self, job):
+        if job['kind'] == 'close':
+            # Permitir volver a pulsar "Cerrar Ticket"
+            state = await guild_states.get(job['guild_id'])
+            ticket = state.index.by_channel(job['channel_id'])
+            if ticket:
+                ticket.pop('closing', None)
+                save_data(state, ('tickets', str(job['channel_id'])))
+
+jobs = JobQueue(global_state, JOB_WORKERS)
+metrics.gauge('bot_job_queue_depth', lambda: jobs.pending)
+
+@jobs.handler('transcript')
+async def run_transcript_job(ctx: JobContext):
+    channel = bot.get_channel(ctx.job['channel_id'])
+    state = await guild_states.get(ctx.job['guild_id'])
+    ticket = await state.index.lookup(ctx.job['channel_id'])
+    if not channel or not ticket:
+        return
+    
+    await ctx.progress("📄 Generando transcript...", force=True)
+    total_messages, urls = await generate_transcript(state, channel, ticket, ctx.job['user_id'], ctx.progress)
+    await ctx.progress(f"✅ Transcript generado: {total_messages} mensajes en {len(urls)} archivo(s).\n{urls[0]}", force=True)
+
+@jobs.handler('close')
+async def run_close_job(ctx: JobContext):
+    job = ctx.job
+    channel = bot.get_channel(job['channel_id'])
+    state = await guild_states.get(job['guild_id'])
+    ticket = state.index.by_channel(job['channel_id'])
+    
+    if ticket and ticket.get('open', False):
+        # Guardar el transcript antes de borrar el canal, si hay canal de transcripts
+        if channel and state.config['transcript_channel_id'] and not job.get('transcript_done'):
+            await ctx.progress("📄 Generando transcript antes de cerrar...", force=True)
+            await generate_transcript(state, channel, ticket, job['user_id'], ctx.progress)
+            job['transcript_done'] = True
+            ctx.save()
         
-        await channel.send(content=mention_text, embed=embed, view=view)
-        await interaction.followup.send(f"✅ Ticket creado: {channel.mention}", ephemeral=True)
+        ticket.pop('closing', None)
+        mark_ticket_closed(state, ticket, job['user_id'])
+        if channel:
+            await log_action(channel.guild, "Ticket Cerrado", f"<@{job['user_id']}> cerró el ticket #{ticket['number']}")
+    
+    if not channel:
+        return
+    
+    await ctx.progress(f"🔒 Ticket cerrado. El canal se eliminará en {CLOSE_DELETE_DELAY} segundos.", force=True)
+    await asyncio.sleep(CLOSE_DELETE_DELAY)
+    try:
+        await outbound.run('channel_delete', lambda: channel.delete(reason=f"Ticket cerrado por {job['user_id']}"))
+    except discord.NotFound:
+        pass
+
+# ==================== MODO CLÚSTER ====================
+# `python bot.py cluster` arranca CLUSTER_PROCESSES procesos, cada uno con un
+# rango de shards, sobre la misma base SQLite. Cada proceso vigila la tabla
+# changes cada CHANGES_POLL_INTERVAL segundos y refresca en memoria lo que otro
+# haya escrito, así que un /ban se ve en todo el clúster en ese plazo.
+# Otro almacén compartido (p. ej. Redis) solo tiene que ofrecer la misma
+# interfaz: open_partition, latest_change, changes_since y prune_changes.
+CLUSTER_PROCESSES = int(os.getenv('CLUSTER_PROCESSES', '2'))
+CLUSTER_IDENTIFY_DELAY = 5  # Segundos por shard entre arranques (límite de IDENTIFY de Discord)
+CLUSTER_RESTART_DELAY = 10
+CHANGES_POLL_INTERVAL = 1
+CHANGES_RETENTION = 3600  # Segundos que se guardan los cambios antes de purgarlos
+
+class ChangeWatcher:
+    def __init__(self, interval):
+        self.interval = interval
+        self._stale = set()  # guild_id con una colección reescrita fuera, pendientes de recargar
+        self._task = None
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run(), name='change-watcher')
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        last_seq = await persistence.run_io(storage.latest_change)
+        last_prune = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                changes = await persistence.run_io(storage.changes_since, last_seq)
+                if changes:
+                    last_seq = changes[-1][0]
+                    await self._apply(changes)
+                await self._evict_stale()
+                if time.monotonic() - last_prune > CHANGES_RETENTION:
+                    last_prune = time.monotonic()
+                    await persistence.run_io(storage.prune_changes, int(time.time()) - CHANGES_RETENTION)
+            except Exception as e:
+                print(f'❌ Error al leer cambios del clúster: {e}')
+
+    async def _apply(self, changes):
+        by_state = {}
+        ban_guilds = set()
+        for _, scope, path in changes:
+            if path[0] == 'banned_users' and scope.isdigit() and bot.get_guild(int(scope)):
+                ban_guilds.add(int(scope))
+            state = guild_states.peek(int(scope)) if scope.isdigit() else None
+            if state and (path[0] != 'banned_users' or state.bans_loaded):
+                by_state.setdefault(state, {})[path] = None
+        # Baneos de nuestros servidores escritos por otro proceso (p. ej. importados
+        # por la API del proceso 0): sus expiraciones son cosa de este proceso
+        for guild_id in ban_guilds:
+            ban_expiry.recheck_guild(guild_id)
         
-        await log_action(interaction.guild, "Ticket Creado", f"{interaction.user.mention} creó el ticket #{ticket_number}\n**Tipo:** {ticket_info['name']}")
-    except Exception as e:
-        await interaction.followup.send(f"❌ Error al crear el ticket: {e}", ephemeral=True)
\ No newline at end of file
+        for state, paths in by_state.items():
+            if any(len(path) < _row_depth(path) and isinstance(state.data.get(path[0]), dict) for path in paths):
+                # Se reescribió una colección entera: recargar la partición al usarla.
+                # Si alguien la está usando, se descarga cuando termine (_evict_stale)
+                self._stale.add(state.guild_id)
+                continue
+            for path in paths:
+                paths[path] = await persistence.run_io(state.store.read, path)
+            for path, value in paths.items():
+                # Un cambio local aún sin escribir es más nuevo que lo leído
+                if not persistence.is_dirty(state, path):
+                    state.apply_remote(path, value)
+
+    async def _evict_stale(self):
+        for guild_id in list(self._stale):
+            state = guild_states.peek(guild_id)
+            if state is None:
+                self._stale.discard(guild_id)
+            elif not state.busy:
+                self._stale.discard(guild_id)
+                await guild_states.evict(guild_id)
+
+change_watcher = ChangeWatcher(CHANGES_POLL_INTERVAL)
+
+async def _recommended_shards(token):
+    http = discord.http.HTTPClient(asyncio.get_running_loop())
+    try:
+        await http.static_login(token)
+        shards, _, _ = await http.get_bot_gateway()
+        return shards
+    finally:
+        await http.close()
+
+def _spawn_worker(cluster_id, shard_ids, shard_count):
+    env = dict(
+        os.environ,
+        CLUSTER_ID=str(cluster_id),
+        SHARD_IDS=','.join(str(i) for i in shard_ids),
+        SHARD_COUNT=str(shard_count),
+        STORAGE_BACKEND='sqlite'
+    )
+    print(f'🚀 Proceso {cluster_id}: shards {shard_ids[0]}-{shard_ids[-1]} de {shard_count}')
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+def run_cluster():
+    if STORAGE_BACKEND != 'sqlite':
+        print('❌ El modo clúster necesita STORAGE_BACKEND=sqlite (base compartida entre procesos)')
+        return
+    # Importar/migrar la base antes de lanzar los workers: la encuentran lista y
+    # no compiten por hacerla
+    store, _ = _open_global_state()
+    store.close()
+    storage.close()
+    
+    shard_count = SHARD_COUNT or asyncio.run(_recommended_shards(os.getenv('DISCORD_TOKEN')))
+    processes = max(1, min(CLUSTER_PROCESSES, shard_count))
+    per_process = -(-shard_count // processes)
+    ranges = [list(range(start, min(start + per_process, shard_count))) for start in range(0, shard_count, per_process)]
+    
+    workers = {}  # cluster_id -> proceso
+    restart_at = {}  # cluster_id -> instante en que relanzarlo
+    stopping = False
+    
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for proc in workers.values():
+            if proc.poll() is None:
+                proc.terminate()
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    
+    for cluster_id, shard_ids in enumerate(ranges):
+        if stopping:
+            break
+        workers[cluster_id] = _spawn_worker(cluster_id, shard_ids, shard_count)
+        time.sleep(CLUSTER_IDENTIFY_DELAY * len(shard_ids))
+    
+    while not stopping:
+        time.sleep(1)
+        for cluster_id, proc in list(workers.items()):
+            if stopping or proc.poll() is None:
+                continue
+            if cluster_id not in restart_at:
+                print(f'⚠️ Proceso {cluster_id} terminó con código {proc.returncode}, relanzando en {CLUSTER_RESTART_DELAY}s')
+                restart_at[cluster_id] = time.monotonic() + CLUSTER_RESTART_DELAY
+            elif time.monotonic() >= restart_at[cluster_id]:
+                del restart_at[cluster_id]
+                workers[cluster_id] = _spawn_worker(cluster_id, ranges[cluster_id], shard_count)
+    
+    for proc in workers.values():
+        proc.wait()
+
+async def main():
+    loop = asyncio.get_running_loop()
+    try:
+        # Heroku y similares paran el worker con SIGTERM: cerrar limpio para vaciar el journal
+        loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(bot.close()))
+    except NotImplementedError:
+        pass
+    
+    async with bot:
+        try:
+            await bot.start(os.getenv('DISCORD_TOKEN'))
+        finally:
+            await ban_api.stop()
+            await change_watcher.stop()
+            await fivem_status.stop()
+            await announcements.stop()
+            await ban_expiry.stop()
+            await guild_states.stop()
+            await jobs.stop()
+            await log_pipeline.stop()
+            await outbound.stop()
+            await persistence.stop()
+            await metrics.stop()
+            guild_states.close()
+            storage.close()
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['cluster']:
+        run_cluster()
+    else:
+        asyncio.run(main())
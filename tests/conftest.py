@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402  Importar no toca el disco: el almacén se abre al cargar
+
+
+@pytest.fixture
+def B():
+    return bot
+
+
+# Reloj controlable para lo que usa time.monotonic (límites, esperas)
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(bot.time, 'monotonic', clock)
+    return clock
@@ -0,0 +1,81 @@
+import pytest
+
+
+@pytest.mark.parametrize('text, seconds', [
+    ('30m', 1800),
+    ('12h', 43200),
+    ('7d', 604800),
+    ('1d12h', 129600),
+    ('1 día y 12 horas', 129600),
+    ('2 semanas', 1209600),
+    ('1mes', 2592000),
+    (' 3D ', 259200),
+])
+def test_parse_duration(B, text, seconds):
+    assert B.parse_duration(text) == seconds
+
+
+@pytest.mark.parametrize('text', ['permanente', 'Perma', 'nunca', ''])
+def test_parse_duration_permanent(B, text):
+    assert B.parse_duration(text) is None
+
+
+@pytest.mark.parametrize('text', ['un rato', '3x', '0d', '5', 'd5', '1d basura', 'basura 1d'])
+def test_parse_duration_invalid(B, text):
+    with pytest.raises(ValueError):
+        B.parse_duration(text)
+
+
+def make_bans():
+    return {
+        '1': {'username': 'alice', 'razon': 'Spam en el chat', 'banned_by': 'mod1', 'banned_at': 100},
+        '2': {'username': 'bob', 'razon': 'Insultos', 'banned_by': 'mod2', 'banned_at': 200},
+        '3': {'username': 'carol', 'razon': 'spam de enlaces', 'banned_by': 'mod1', 'banned_at': 300},
+        '4': {'username': 'dave', 'razon': 'Cheats', 'banned_by': 'mod1', 'banned_at': 400},
+        '5': {'username': 'al', 'razon': 'Multicuenta', 'banned_by': 'mod2', 'banned_at': 500},
+    }
+
+
+def test_ban_index_search(B):
+    index = B.BanIndex(make_bans())
+    assert index.matches() is None
+    assert index.matches(query='SPAM') == {'1', '3'}
+    assert index.matches(query='al') == {'1', '5'}  # Menos de 3 letras
+    assert index.matches(query='a') == {'1', '3', '4', '5'}
+    assert index.matches(staff='mod2') == {'2', '5'}
+    assert index.matches(query='spam', staff='mod2') == set()
+    assert index.matches(query='nadie') == set()
+    assert index.staff_counts() == [(3, 'mod1'), (2, 'mod2')]
+
+
+def test_ban_index_updates(B):
+    bans = make_bans()
+    index = B.BanIndex(bans)
+    index.matches(query='spam')  # Construye los trigramas
+
+    entry = {'username': 'eve', 'razon': 'spam masivo', 'banned_by': 'mod3', 'banned_at': 250}
+    bans['6'] = entry
+    index.add('6', entry)
+    assert index.matches(query='spam') == {'1', '3', '6'}
+    assert index.matches(staff='mod3') == {'6'}
+
+    index.remove('1', bans.pop('1'))
+    assert index.matches(query='spam') == {'3', '6'}
+    assert [user_id for _, user_id in index.by_time] == ['2', '6', '3', '4', '5']
+
+
+def test_page_before(B):
+    keys = B.BanIndex(make_bans()).by_time
+    page, more = B.page_before(keys, None, 2)
+    assert [user_id for _, user_id in page] == ['5', '4'] and more
+    page, more = B.page_before(keys, page[-1], 2)
+    assert [user_id for _, user_id in page] == ['3', '2'] and more
+    page, more = B.page_before(keys, page[-1], 2)
+    assert [user_id for _, user_id in page] == ['1'] and not more
+
+
+def test_page_before_filtered(B):
+    index = B.BanIndex(make_bans())
+    keys = index.sorted_keys(index.matches(staff='mod1'))
+    page, more = B.page_before(keys, None, 10)
+    assert [user_id for _, user_id in page] == ['4', '3', '1'] and not more
@@ -0,0 +1,67 @@
+import asyncio
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+
+# Servidor FiveM de mentira: /info.json y /players.json, o 500 si está "caído"
+def fivem_app(server):
+    async def info(request):
+        if server['down']:
+            raise web.HTTPInternalServerError()
+        return web.json_response({'vars': {'sv_maxClients': '64', 'sv_projectName': '^1Mi ^7Servidor RP'}}, content_type='text/plain')
+
+    async def players(request):
+        if server['down']:
+            raise web.HTTPInternalServerError()
+        return web.json_response([{'id': i} for i in range(server['players'])])
+
+    app = web.Application()
+    app.router.add_get('/info.json', info)
+    app.router.add_get('/players.json', players)
+    return app
+
+
+async def poll_stub(B, server, rounds):
+    async with TestServer(fivem_app(server)) as stub:
+        poller = B.FiveMStatusPoller(B.Partition('global', None, {}))
+        poller.load()
+        target = B.FiveMTarget(1, f'{stub.host}:{stub.port}')
+        poller._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=B.FIVEM_TIMEOUT))
+        slots = asyncio.Semaphore(1)
+        snapshots = []
+        try:
+            for down in rounds:
+                server['down'] = down
+                await poller._poll(target, slots)
+                snapshots.append((target.snapshot, target.failures))
+        finally:
+            await poller._session.close()
+        return target, snapshots
+
+
+def test_poll_online(B):
+    server = {'down': False, 'players': 12}
+    target, snapshots = asyncio.run(poll_stub(B, server, [False]))
+    assert snapshots == [({'online': True, 'players': 12, 'max_players': 64, 'hostname': 'Mi Servidor RP'}, 0)]
+    assert target.next_poll > B.time.monotonic() + B.FIVEM_POLL_INTERVAL - 5
+
+
+def test_poll_offline_after_consecutive_failures(B):
+    server = {'down': False, 'players': 3}
+    _, snapshots = asyncio.run(poll_stub(B, server, [False, True, True, False]))
+    online = {'online': True, 'players': 3, 'max_players': 64, 'hostname': 'Mi Servidor RP'}
+    assert snapshots == [
+        (online, 0),
+        (online, 1),  # Un fallo suelto no cambia el estado publicado
+        ({'online': False}, 2),
+        (online, 0),
+    ]
+
+
+def test_poll_backoff(B):
+    server = {'down': True, 'players': 0}
+    target, _ = asyncio.run(poll_stub(B, server, [True, True, True]))
+    wait = target.next_poll - B.time.monotonic()
+    assert B.FIVEM_RETRY_BASE * 4 - 5 < wait <= B.FIVEM_RETRY_BASE * 4
@@ -0,0 +1,83 @@
+import json
+import os
+
+
+def defaults():
+    return {'tickets': {}, 'banned_users': {}, 'config': {'ticket_counter': 0}}
+
+
+def record(path, value):
+    return (path, json.dumps(value) if value is not None else None)
+
+
+def test_apply_record(B):
+    data = {'config': {'ticket_counter': 1}}
+    B._apply_record(data, {'op': 'set', 'path': ['config', 'ticket_counter'], 'value': 2})
+    B._apply_record(data, {'op': 'set', 'path': ['tickets', '10'], 'value': {'number': 2}})
+    B._apply_record(data, {'op': 'del', 'path': ['config', 'no_existe']})
+    assert data == {'config': {'ticket_counter': 2}, 'tickets': {'10': {'number': 2}}}
+    B._apply_record(data, {'op': 'del', 'path': ['tickets', '10']})
+    assert data['tickets'] == {}
+
+
+def test_journal_replay(B, tmp_path):
+    journal = B.DataJournal(str(tmp_path), defaults)
+    assert journal.load() == defaults()
+    journal.write([
+        record(('config', 'ticket_counter'), 1),
+        record(('tickets', '10'), {'number': 1, 'open': True}),
+        record(('tickets', '11'), {'number': 2, 'open': True}),
+    ])
+    journal.write([record(('tickets', '11'), None), record(('config', 'ticket_counter'), 2)])
+    journal.close()
+    # Última línea a medio escribir tras un corte
+    with open(tmp_path / B.JOURNAL_FILE, 'a', encoding='utf-8') as f:
+        f.write('{"op":"set","path":["config","ticket_coun')
+
+    journal = B.DataJournal(str(tmp_path), defaults)
+    data = journal.load()
+    journal.close()
+    assert data['config'] == {'ticket_counter': 2}
+    assert data['tickets'] == {'10': {'number': 1, 'open': True}}
+
+
+def test_journal_defers_unloaded_bans(B, tmp_path):
+    journal = B.DataJournal(str(tmp_path), defaults)
+    data = journal.load()
+    data['banned_users']['1'] = {'username': 'alice'}
+    journal.write_snapshot(data)
+    journal.write([record(('banned_users', '2'), {'username': 'bob', 'expires_at': 50})])
+    journal.close()
+
+    journal = B.DataJournal(str(tmp_path), defaults)
+    data = journal.load()
+    assert 'banned_users' not in data  # Se cargan aparte, al usarlos
+    assert journal.temporary_bans() == [('2', 50)]
+    assert journal.load_bans() == {'1': {'username': 'alice'}, '2': {'username': 'bob', 'expires_at': 50}}
+    journal.close()
+
+
+def test_journal_compaction(B, tmp_path, monkeypatch):
+    monkeypatch.setattr(B, 'JOURNAL_COMPACT_EVERY', 4)
+    journal = B.DataJournal(str(tmp_path), defaults)
+    data = journal.load()
+    journal.write_snapshot(data)  # Baneos fuera de data.json desde aquí
+    journal.write([record(('tickets', str(i)), {'number': i, 'open': True}) for i in range(3)] + [record(('banned_users', '7'), {'username': 'eve'})])
+    journal.compact()  # Si la compactación en segundo plano se adelantó, no hace nada
+    journal.write([record(('config', 'ticket_counter'), 3)])
+    journal.close()
+
+    assert not os.path.exists(tmp_path / f'{B.JOURNAL_FILE}.1')
+    with open(tmp_path / B.DATA_FILE, encoding='utf-8') as f:
+        snapshot = json.load(f)
+    assert sorted(snapshot['tickets']) == ['0', '1', '2']
+    assert 'banned_users' not in snapshot
+    with open(tmp_path / B.BANS_FILE, encoding='utf-8') as f:
+        assert json.load(f) == {'7': {'username': 'eve'}}
+
+    journal = B.DataJournal(str(tmp_path), defaults)
+    data = journal.load()
+    assert data['config'] == {'ticket_counter': 3}
+    assert sorted(data['tickets']) == ['0', '1', '2']
+    assert journal.load_bans() == {'7': {'username': 'eve'}}
+    journal.close()
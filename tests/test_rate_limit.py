@@ -0,0 +1,40 @@
+def test_user_bucket_refills(B, clock):
+    limiter = B.RateLimiter({'ticket': {'user': (2, 10)}}, 100)
+    assert limiter.hit('ticket', 1, 10) is None
+    assert limiter.hit('ticket', 1, 10) is None
+    scope, wait = limiter.hit('ticket', 1, 10)
+    assert scope == 'user' and wait == 5
+    assert limiter.hit('ticket', 2, 10) is None  # Cada usuario tiene su cubo
+
+    clock.advance(5)
+    assert limiter.hit('ticket', 1, 10) is None
+    assert limiter.hit('ticket', 1, 10) is not None
+
+
+def test_guild_limit_does_not_charge_user(B, clock):
+    limiter = B.RateLimiter({'ticket': {'user': (5, 10), 'guild': (1, 60)}}, 100)
+    assert limiter.hit('ticket', 1, 10) is None
+    scope, _ = limiter.hit('ticket', 2, 10)
+    assert scope == 'guild'
+    # El rechazo por servidor no gastó fichas del usuario 2
+    assert limiter._buckets[('ticket', 'user', 2)][0] == 5
+    assert limiter.hit('ticket', 2, 20) is None
+
+
+def test_subcategory_shares_parent_buckets(B, clock):
+    limiter = B.RateLimiter({'ticket': {'user': (1, 10)}, 'ticket:soporte': {'user': (3, 10)}}, 100)
+    assert limiter.hit('ticket:compras', 1, None) is None
+    assert limiter.hit('ticket', 1, None) is not None
+    assert limiter.hit('ticket:soporte', 1, None) is None  # Límites propios
+    assert limiter.hit('sin_limites', 1, None) is None
+
+
+def test_forgets_least_recently_used(B, clock):
+    limiter = B.RateLimiter({'component': {'user': (1, 10)}}, 2)
+    limiter.hit('component', 1, None)
+    limiter.hit('component', 2, None)
+    limiter.hit('component', 1, None)  # Rechazado, pero 1 pasa a ser el más reciente
+    limiter.hit('component', 3, None)
+    assert len(limiter) == 2
+    assert ('component', 'user', 2) not in limiter._buckets
+    assert limiter.hit('component', 1, None) is not None